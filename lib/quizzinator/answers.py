@@ -1,11 +1,11 @@
+import json
 import os.path
 import re
 
 from typing import Optional
-from pathlib import Path
 
 from .logging import logger
-from .cli import cli_get_args
+from .failures import failures_log
 
 def gender_rule_numbers_to_names(number: str):
   number = number.strip()
@@ -144,8 +144,120 @@ def pattern_all(pattern: str, text: str) -> list[str]:
 
 
 import re
+from datetime import datetime
+from functools import lru_cache
 from typing import Optional, Union, List
 
+# The rules for finding an answer in what the LLM said, most certain first:
+# (name, regex with _T_ for the target, text every match contains). The text
+# is how a rule is skipped without running it: if it isn't in the reply
+# (ignoring case), the rule can't match.
+ANSWER_RULES = [
+  # 0) Final answer always most important
+  ('final_answer', r'\*\*\s*Final Answer\s*:?[\\*\\s]*Answer:\s*_T_', 'final answer'),
+
+  # Boxed is next most certain
+  ('boxed', r'\\boxed\{([^}]+)\}', '\\boxed{'),
+
+  # “Answer Selected:” for *any* target (unquoted, comma/dash-sep, etc)
+  ('selected', r'Answer Selected:\s*_T_', 'answer selected:'),
+  ('selected_single_quotes', r"Answer Selected:\s*'_T_'", 'answer selected:'),
+  ('selected_double_quotes', r'Answer Selected:\s*"_T_"', 'answer selected:'),
+
+  # Now the regular “Answer:” patterns
+  ('answer', r'Answer:\s*_T_', 'answer:'),
+  ('answer_parens', r'Answer:\s*\(_T_\)', 'answer:'),
+  ('answer_double_quotes', r'Answer:\s*"_T_"', 'answer:'),
+  ('answer_single_quotes', r"Answer:\s*'_T_'", 'answer:'),
+  ('bold_answer', r'\*\*\s*Answer\s*:?[\\*\\s]*_T_', 'answer'),
+  ('answer_tag', r'<answer>_T_</answer>', '<answer>'),
+
+  # 5) fallback fuzzy patterns
+  ('line', r'^_T_$', ''),
+  ('bold', r'\*\*_T_\*\*', '**'),
+  ('bold_parens', r'\*\*\(_T_\)\*\*', '**('),
+  ('parens', r'\(_T_\)', '('),
+]
+
+class Extractor:
+  """
+  ANSWER_RULES compiled for one target, the regex of what an answer looks
+  like; see extract_llm_answer. scan() goes over the reply once to see which
+  rules could match at all and runs just those, in order, so a reply costs a
+  few regex searches instead of building and compiling fifteen of them.
+  """
+  def __init__(self, target: str | None = None, multi: bool = False):
+    tpat = target or r'\d+(?:-\d+)*|[A-Z]'
+    tgt = rf'\#?({tpat})'
+    self.multi = multi
+    self.rules = [
+      (name, re.compile(pattern.replace('_T_', tgt), re.IGNORECASE | re.MULTILINE), needle)
+      for name, pattern, needle in ANSWER_RULES
+    ]
+
+  def scan(self, text: str) -> tuple[Optional[Union[str, List[str]]], str | None]:
+    """(the answer, the name of the rule that found it), or (None, None)"""
+    text = text.strip()
+    lowered = text.lower()
+    for name, regex, needle in self.rules:
+      if needle not in lowered: continue
+      raw = regex.findall(text)
+      if not raw:
+        continue
+
+      # flatten tuples vs strings
+      flat: List[str] = []
+      for m in raw:
+        if isinstance(m, tuple):
+          flat.extend([g for g in m if g])
+        elif isinstance(m, str):
+          m = m.replace(',','-').replace(' ','')
+          if '-' in m:
+            flat += m.split('-')
+          else:
+            flat.append(m)
+        else:
+          flat.append(m)
+
+      # dedupe while preserving order
+      uniq = sorted(list(set(flat)))
+
+      if not uniq:
+        continue
+
+      # if multi, return every unique match right away
+      if self.multi:
+        return uniq, name
+
+      # single mode: only accept exactly one match
+      if len(uniq) == 1:
+        return uniq[0], name
+      # else >1 → ambiguous for this pattern, keep searching
+
+    # no pattern yielded an acceptable answer
+    return None, None
+
+  def signature(self, text: str) -> list[str]:
+    """
+    How close the rules came to an answer scan() didn't find: the rules that
+    found more than one answer, marked with a *, and the first rule for each
+    other kind of text the reply has (like 'answer:') that found none
+    """
+    text = text.strip()
+    lowered = text.lower()
+    found, seen = [], []
+    for name, regex, needle in self.rules:
+      if needle not in lowered: continue
+      if regex.search(text): found.append(f'{name}*')
+      elif needle and not any(needle in s for s in seen): found.append(name)
+      seen.append(needle)
+    return found
+
+@lru_cache(maxsize=None)
+def extractor(target: str | None = None, multi: bool = False) -> Extractor:
+  """The Extractor for a target, compiled the first time it is asked for"""
+  return Extractor(target, multi)
+
 def extract_llm_answer(
     text: str,
     target: str | None = None,
@@ -159,191 +271,165 @@ def extract_llm_answer(
     - otherwise (multi=False and >1 matches), skip to the next pattern
   If none match, return None.
   """
-  flags = re.IGNORECASE | re.MULTILINE
-  tpat  = target or r'\d+(?:-\d+)*|[A-Z]'
-  tgt   = rf'\#?({tpat})'
-
-  patterns = [
-    # 0) Final answer always most important
-    r'\*\*\s*Final Answer\s*:?[\\*\\s]*Answer:\s*_T_',
-
-    # Boxed is next most certain
-    r'\\boxed\{([^}]+)\}',
-
-    # “Answer Selected:” for *any* target (unquoted, comma/dash-sep, etc)
-    r'Answer Selected:\s*_T_',
-    r"Answer Selected:\s*'_T_'",
-    r'Answer Selected:\s*"_T_"',
-
-    # Now the regular “Answer:” patterns
-    r'Answer:\s*_T_',
-    r'Answer:\s*\(_T_\)',
-    r'Answer:\s*"_T_"',
-    r"Answer:\s*'_T_'",
-    r'\*\*\s*Answer\s*:?[\\*\\s]*_T_',
-    r'<answer>_T_</answer>',
-
-    # 5) fallback fuzzy patterns
-    r'^_T_$',
-    r'\*\*_T_\*\*',
-    r'\*\*\(_T_\)\*\*',
-    r'\(_T_\)',
-  ]
-
-  for pat in patterns:
-    # build the real regex
-    regex = pat.replace('_T_', tgt)
-    raw   = re.findall(regex, text.strip(), flags)
-
-    if not raw:
-      continue
-
-    # flatten tuples vs strings
-    flat: List[str] = []
-    for m in raw:
-      if isinstance(m, tuple):
-        flat.extend([g for g in m if g])
-      elif isinstance(m, str):
-        m = m.replace(',','-').replace(' ','')
-        if '-' in m:
-          flat += m.split('-')
-        else:
-          flat.append(m)
-      else:
-        flat.append(m)
-
-    # dedupe while preserving order
-    uniq = sorted(list(set(flat)))
-
-    if not uniq:
-      continue
-
-    # if multi, return every unique match right away
-    if multi:
-      return uniq
-
-    # single mode: only accept exactly one match
-    if len(uniq) == 1:
-      return uniq[0]
-    # else >1 → ambiguous for this pattern, keep searching
-
-  # no pattern yielded an acceptable answer
-  return None
-
-
-
-
-def get_legal_answer(prompt: str, text: str, mode: str, legal_values: dict[str]) -> list:
-  if '### Final Answer' in text:
-    text = text.split('### Final Answer', 1)[1]
-
-  if mode == 'ignore':
-    return [True, '']
-
-  if mode == 'free':
-    return [True, text]
+  return extractor(target, multi).scan(text)[0]
 
-  if mode == 'line':
-    # first try the normal extractor:
-    extracted = extract_llm_answer(text, r'.+', multi=False)
-    # if nothing matched, grab the first non-empty line
-    if extracted is None:
-      for line in text.splitlines():
-        line = line.strip()
-        if line:
-          extracted = line
-          break
-    return [extracted is not None, extracted]
-
-  if mode == 'word':
-    # 1) try the extractor with a “one-or-more non-space” target
-    extracted = extract_llm_answer(text, r'\S+', multi=False)
-
-    # 2) fallback: first non-empty word in the raw text
-    if extracted is None:
-      for tok in re.split(r'\s+', text):
-        tok = tok.strip()
-        if tok:
-          extracted = tok
-          break
-
-    return [extracted is not None, extracted]
-
-  if mode == 'number':
-    extracted = extract_llm_answer(text, r'[\d,]+')
-    ok = extracted is not None
-    if not ok: log_failures(mode, prompt, text)
-    return [ok, extracted]
-
-  if mode in ('date'):
-    extracted = extract_llm_answer(text, r'\S+')
-    ok = extracted is not None
-    if not ok:
-      log_failures(mode, prompt, text)
-    else:
+def answer_schema(mode: str, legal_values: list) -> dict | None:
+  """
+  The JSON schema of a reply that answers a question of this mode, for
+  backends that can hold the model to one (--structured); None for free text
+  """
+  codes = [int(v) for v in legal_values]
+  if mode == 'single': answer = {'type': 'integer', 'enum': codes}
+  elif mode == 'multi': answer = {'type': 'array', 'items': {'type': 'integer', 'enum': codes}, 'minItems': 1, 'uniqueItems': True}
+  elif mode == 'number': answer = {'type': 'integer'}
+  elif mode == 'word': answer = {'type': 'string', 'pattern': r'^\S+$'}
+  elif mode == 'line': answer = {'type': 'string', 'pattern': r'^[^\n]+$'}
+  elif mode == 'date': answer = {'type': 'string', 'pattern': r'^\d{4}-\d{2}-\d{2}$'}
+  else: return None
+  return {'type': 'object', 'properties': {'answer': answer}, 'required': ['answer']}
+
+class AnswerExtractor:
+  """
+  get_legal_answer for one question: its mode and legal values are fixed,
+  so the target regex - for single and multi choice, the alternation of the
+  legal codes - is built and compiled once, when the questions are parsed.
+  """
+  def __init__(self, mode: str, legal_values: list):
+    self.mode = mode
+    self.codes = {str(v) for v in legal_values}
+    self.schema = answer_schema(mode, legal_values)
+    lv = '|'.join(map(str, reversed(legal_values)))
+    if mode == 'line': self.extractor = extractor(r'.+')
+    elif mode in ('word', 'date'): self.extractor = extractor(r'\S+')
+    elif mode == 'number': self.extractor = extractor(r'[\d,]+')
+    elif mode == 'single': self.extractor = extractor(lv)
+    elif mode == 'multi':
+      # allow comma or hyphen, with optional surrounding spaces
+      sep = r'(?:\s*[-,]\s*)'
+      self.extractor = extractor(rf'(?:{lv})(?:{sep}(?:{lv}))*', True)
+    else: self.extractor = None
+
+  def __deepcopy__(self, memo):
+    # nothing in here changes, so every copy of a question can share it
+    return self
+
+  def __call__(self, prompt: str, text: str, log: bool = True) -> list:
+    ok, answer, _ = self.scan(prompt, text, log)
+    return [ok, answer]
+
+  def structured(self, text: str) -> tuple[bool, object]:
+    """
+    (ok, answer) from a reply that follows self.schema, the answer in the
+    same form the rules would have found it in; (False, None) for any other
+    reply, which is left to the rules
+    """
+    text = text.strip()
+    if self.schema is None or not text.startswith('{'): return False, None
+    try:
+      answer = json.loads(text)['answer']
+    except (ValueError, TypeError, KeyError):
+      return False, None
+    mode = self.mode
+    if mode in ('single', 'number'):
+      if isinstance(answer, bool) or not isinstance(answer, (int, str)) or not str(answer).strip().isdigit(): return False, None
+      answer = str(int(answer))
+      return mode == 'number' or answer in self.codes, answer
+    if mode == 'multi':
+      if not isinstance(answer, list) or not answer: return False, None
+      picked = sorted({str(a) for a in answer if not isinstance(a, bool)})
+      return all(a in self.codes for a in picked), picked
+    if not isinstance(answer, str) or not answer.strip(): return False, None
+    answer = answer.strip()
+    if mode == 'word' and len(answer.split()) != 1: return False, None
+    if mode == 'line' and '\n' in answer: return False, None
+    if mode == 'date':
       try:
-        parsed = datetime.strptime(extracted, "%Y-%m-%d")
-        return [True, parsed]
+        return True, datetime.strptime(answer, "%Y-%m-%d")
       except ValueError:
-        log_failures(mode, prompt, text)
-        return [False, extracted]
-
-  if mode == 'single':
-    # choose an appropriate target regex
-    tmap = {
-      'number': r'[\d,]+',
-      'date': r'\S+',
-    }
-    extracted = extract_llm_answer(text, '|'.join(map(str, reversed(legal_values))))
+        return False, None
+    return True, answer
+
+  def signature(self, text: str) -> list[str]:
+    """See Extractor.signature"""
+    return self.extractor.signature(text) if self.extractor else []
+
+  def scan(self, prompt: str, text: str, log: bool = True, question: str | None = None) -> tuple[bool, object, str | None]:
+    """
+    (ok, answer, the rule that found it - None for a fallback or nothing);
+    a reply that follows the question's schema is read as JSON, rule 'schema'.
+    With log, a reply without an answer is recorded (see log_failures).
+    """
+    mode = self.mode
+    ok, answer = self.structured(text)
+    if ok: return True, answer, 'schema'
+    if '### Final Answer' in text:
+      text = text.split('### Final Answer', 1)[1]
+
+    if mode == 'ignore':
+      return True, '', None
+
+    if mode == 'free':
+      return True, text, None
+
+    if self.extractor is None:
+      raise ValueError(f'Unknown mode {mode}')
+    extracted, rule = self.extractor.scan(text)
+
+    if mode == 'line':
+      # if nothing matched, grab the first non-empty line
+      if extracted is None:
+        for line in text.splitlines():
+          line = line.strip()
+          if line:
+            extracted = line
+            break
+      return extracted is not None, extracted, rule
+
+    if mode == 'word':
+      # fallback: first non-empty word in the raw text
+      if extracted is None:
+        for tok in re.split(r'\s+', text):
+          tok = tok.strip()
+          if tok:
+            extracted = tok
+            break
+      return extracted is not None, extracted, rule
+
     ok = extracted is not None
-    if not ok: log_failures(mode, prompt, text)
     if mode == 'date' and ok:
       try:
-        parsed = datetime.strptime(extracted, "%Y-%m-%d")
-        return [True, parsed]
+        return True, datetime.strptime(extracted, "%Y-%m-%d"), rule
       except ValueError:
-        return [False, extracted]
-    return [ok, extracted]
+        ok = False
 
+    if mode == 'multi':
+      if extracted:
+        # strip any stray whitespace just in case
+        return True, [v.strip() for v in extracted], rule
+      if log: log_failures(mode, prompt, text, question, self.signature(text))
+      return False, text, None
 
-  if mode == 'multi':
+    if not ok and log: log_failures(mode, prompt, text, question, self.signature(text))
+    return ok, extracted, rule
 
-    lv = '|'.join(map(str, reversed(legal_values)))
-    # allow comma or hyphen, with optional surrounding spaces
-    sep = r'(?:\s*[-,]\s*)'
-    mv = rf'(?:{lv})(?:{sep}(?:{lv}))*'
-    #
-    # # build a “legal‐values” alternation: e.g. '1|2|3|4|5|6|7'
-    # lv = '|'.join(map(str, reversed(legal_values)))
-    #
-    # # allow comma **or** hyphen between values, with optional spaces
-    # sep = r'(?:\s*[-,]\s*)'
-    # mv = rf'(?:{lv})(?:{sep}(?:{lv}))*'
-
-    extracted = extract_llm_answer(text, mv, multi=True)
-                 #.replace(',','-').replace(' ', ''))
-    if extracted:
-      # strip any stray whitespace just in case
-      return [True, [v.strip() for v in extracted]]
-
-    log_failures(mode, prompt, text)
-    return [False, text]
-
-  raise ValueError(f'Unknown mode {mode}')
-
-
-def log_failures(mode, prompt, text):
-  args = cli_get_args()
-  path = Path(args.dir) / "errors.txt"
-  # no matches → log failure as before
-  div1 = '=' * 60 + '\n'
-  div2 = '-' * 60 + '\n'
-  with open(path, 'a') as f:
-    f.write(div1)
-    f.write(f'mode = {mode}\n')
-    f.write(div2)
-    f.write(f'prompt\n{prompt}\n')
-    f.write(div2)
-    f.write(f'text\n{text}\n')
-    f.write(div2)
-    f.write(f'Expect\n\n')
+@lru_cache(maxsize=None)
+def answer_extractor(mode: str, legal_values: tuple) -> AnswerExtractor:
+  """The AnswerExtractor for questions without one of their own (see Question.extractor)"""
+  return AnswerExtractor(mode, list(legal_values))
+
+def get_legal_answer(prompt: str, text: str, mode: str, legal_values: dict[str], log: bool = True) -> list:
+  return answer_extractor(mode, tuple(legal_values))(prompt, text, log)
+
+
+# modes where a legal answer can be recognized before the LLM is done talking
+EARLY_STOP_MODES = ('single', 'multi', 'number')
+
+def answer_ready(text: str, mode: str, legal_values: list) -> bool:
+  """Would get_legal_answer already find a legal answer in this (partial) text?"""
+  if mode not in EARLY_STOP_MODES: return False
+  ok, _ = get_legal_answer('', text, mode, legal_values, log=False)
+  return ok
+
+def log_failures(mode: str, prompt: str, text: str, question: str | None = None, signature: list[str] = ()) -> None:
+  """Record a reply no answer could be found in, in the project's failure log (see failures.py)"""
+  failures_log().record(question, mode, prompt, text, list(signature))
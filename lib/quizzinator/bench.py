@@ -0,0 +1,187 @@
+import argparse, json, re, sys, time
+from pathlib import Path
+from statistics import mean, median
+
+from .logging import logger
+from .ollama import Ollama
+from .answers import AnswerExtractor, extractor
+from .questions import parse_questions
+from .store import ExperimentStore
+from .string import clean_text
+from .stream import StreamCleaner
+from .fake_ollama import fake_ollama_reply
+
+def bench_cli_args():
+  p = argparse.ArgumentParser(
+    prog="bench",
+    description="Micro-benchmarks for the hot paths of quizzinator"
+  )
+  sub = p.add_subparsers(dest="bench", required=True)
+
+  p_pty = sub.add_parser("pty", help="Push and pull overhead of the pty backend against a fake ollama REPL")
+  p_pty.add_argument(
+    "--prompt",
+    type=str,
+    default="100,8000,32000",
+    help="Prompt sizes in characters to push, separated by commas"
+  )
+  p_pty.add_argument(
+    "--think",
+    type=str,
+    default="1000,20000,50000",
+    help="Reasoning sizes in characters for the fake REPL to reply with, separated by commas"
+  )
+  p_pty.add_argument(
+    "--turns",
+    type=int,
+    default=20,
+    help="How many turns to time for each size"
+  )
+
+  p_extract = sub.add_parser("extract", help="Answer extraction throughput over the dialogs of saved experiments")
+  p_extract.add_argument(
+    "dirs",
+    nargs="+",
+    help="Survey directories (like data/consent) whose experiments' dialogs to extract answers from"
+  )
+  p_extract.add_argument(
+    "--repeat",
+    type=int,
+    default=3,
+    help="How many times to go over the whole corpus"
+  )
+
+  p_clean = sub.add_parser("clean", help="Normalizing model output: escape sequences, spinners, quotes and the like")
+  p_clean.add_argument(
+    "--think",
+    type=str,
+    default="1000,20000,50000",
+    help="Reasoning sizes in characters of the replies to clean, separated by commas"
+  )
+  p_clean.add_argument(
+    "--chunk",
+    type=int,
+    default=64,
+    help="Characters per piece when cleaning the reply as it streams in"
+  )
+  p_clean.add_argument(
+    "--turns",
+    type=int,
+    default=200,
+    help="How many times to clean each reply"
+  )
+  return p.parse_args()
+
+def bench_sizes(text: str) -> list[int]:
+  return [int(s) for s in text.split(',') if s.strip()]
+
+def bench_report(name: str, times: list[float], size: int) -> None:
+  ms = [t * 1000 for t in times]
+  rate = size / mean(times) / 1e6 if mean(times) else float('inf')
+  logger.info(f"{name:<14} mean {mean(ms):8.3f} ms | median {median(ms):8.3f} ms | {rate:7.1f} MB/s")
+
+def bench_pty(args) -> None:
+  """
+  Time Ollama._push and Ollama._pull against quizzinator.fake_ollama, which
+  answers instantly - so everything measured is our own framing overhead.
+  """
+  for think in bench_sizes(args.think):
+    command = f"{sys.executable} -m quizzinator.fake_ollama --think {think} --chunk 4096"
+    o = Ollama('fake', timeout=30, command=command)
+    try:
+      for size in bench_sizes(args.prompt):
+        # multi-line, like the setup preamble
+        prompt = '"""' + ('x' * 79 + '\n') * (size // 80) + '"""'
+        pushes, pulls = [], []
+        for _ in range(args.turns):
+          t0 = time.perf_counter()
+          o._push(prompt)
+          t1 = time.perf_counter()
+          o._pull()
+          t2 = time.perf_counter()
+          pushes.append(t1 - t0)
+          pulls.append(t2 - t1)
+        with logger.section(f"prompt {size:,} chars, reply {think:,} chars"):
+          bench_report("push", pushes, size)
+          bench_report("pull", pulls, think)
+    finally:
+      o.kill()
+
+def bench_extract_corpus(path_dir: Path) -> list[tuple]:
+  """(question, prompt, reply) for every LLM turn saved in a survey's experiments, old layout or new"""
+  questions = {q.name: q for q in parse_questions(path_dir / 'questions.txt')}
+  histories = []
+  for path in sorted(path_dir.glob('experiments/*/experiment.sqlite')):
+    store = ExperimentStore(path)
+    histories += [store.history(index, texts=False) for index in sorted(store.done())]
+    store.close()
+  for path in sorted(path_dir.glob('experiments/*/quizzes/*/history.json')):
+    with open(path, encoding='utf-8') as f:
+      histories.append(json.load(f))
+  corpus = []
+  for history in histories:
+    prompt = ''
+    for h in history:
+      if h['role'] == 'user': prompt = h['content']
+      elif h['answer']['name'] in questions: corpus.append((questions[h['answer']['name']], prompt, h['content']))
+  return corpus
+
+def bench_extract(args) -> None:
+  """
+  Time get_legal_answer over real replies: with each question's extractor
+  compiled once (as parse_questions does), and compiled afresh for every
+  reply - which is what extraction cost before, whenever re's own cache of
+  compiled patterns was churned by many questions' legal value alternations.
+  """
+  corpus = [turn for d in args.dirs for turn in bench_extract_corpus(Path(d))]
+  if not corpus: logger.critical(f"No saved dialogs under {', '.join(args.dirs)}")
+  size = sum(len(reply) for _, _, reply in corpus)
+  logger.info(f"{len(corpus):,} replies, {size / 1e6:,.1f} MB")
+  for name, fresh in (('compiled', False), ('fresh', True)):
+    times = []
+    for _ in range(args.repeat):
+      t0 = time.perf_counter()
+      for q, prompt, reply in corpus:
+        if fresh:
+          extractor.cache_clear()
+          re.purge()
+          AnswerExtractor(q.mode, [o.code for o in q.options]).scan(prompt, reply, log=False)
+        else:
+          q.extractor.scan(prompt, reply, log=False)
+      times.append(time.perf_counter() - t0)
+    bench_report(name, times, size)
+    logger.info(f"{'':<14} {len(corpus) / mean(times):,.0f} replies/s")
+
+def bench_clean(args) -> None:
+  """
+  Time clean_text on replies like the REPL's - spinners and escape sequences
+  up front, '\r\n' newlines, and some unicode in the reasoning - all at once,
+  and chunk by chunk through a StreamCleaner as the pty backend does
+  """
+  for think in bench_sizes(args.think):
+    reply = fake_ollama_reply(argparse.Namespace(think=think, answer='Answer: 3', loop=False, ramble=0))
+    reply = reply.replace('. ', '’s — ').replace('\n', '\r\n')
+    chunks = [reply[i:i + args.chunk] for i in range(0, len(reply), args.chunk)]
+    whole, streamed = [], []
+    for _ in range(args.turns):
+      t0 = time.perf_counter()
+      clean_text(reply)
+      t1 = time.perf_counter()
+      cleaner = StreamCleaner()
+      for chunk in chunks: cleaner.feed(chunk)
+      cleaner.flush()
+      t2 = time.perf_counter()
+      whole.append(t1 - t0)
+      streamed.append(t2 - t1)
+    with logger.section(f"reply {len(reply):,} chars, streamed {args.chunk:,} at a time"):
+      bench_report("whole", whole, len(reply))
+      bench_report("streamed", streamed, len(reply))
+
+def bench_main():
+  args = bench_cli_args()
+  benches = {
+    'pty': bench_pty,
+    'extract': bench_extract,
+    'clean': bench_clean,
+  }
+  benches[args.bench](args)
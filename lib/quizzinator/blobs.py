@@ -0,0 +1,77 @@
+import fcntl
+import json
+import os
+import threading
+import zlib
+
+from pathlib import Path
+
+class TextBlobs:
+  """
+  Cold storage for the bulky text of an experiment - the LLM's raw output and
+  its reasoning - in one append-only file of zlib-compressed records.
+
+  put() appends a record and returns where it went, (offset, length); the
+  caller keeps that in its own index (the experiment store's turns table) and
+  hands it back to get() when the text is actually wanted. Records are never
+  rewritten: replacing a respondent just leaves their old records unreferenced.
+  Several processes, on several hosts, may append to the same file: each
+  append holds an exclusive lock on it, so offsets never collide.
+  """
+  def __init__(self, path: Path | str):
+    self.path = Path(path)
+    self.path.parent.mkdir(parents=True, exist_ok=True)
+    self._lock = threading.Lock()
+    self._file = open(self.path, 'a+b')
+
+  def put(self, record: dict) -> tuple[int, int]:
+    data = zlib.compress(json.dumps(record, ensure_ascii=False, default=str).encode('utf-8'))
+    with self._lock:
+      fcntl.flock(self._file, fcntl.LOCK_EX)
+      try:
+        self._file.seek(0, os.SEEK_END)
+        offset = self._file.tell()
+        self._file.write(data)
+        self._file.flush()
+      finally:
+        fcntl.flock(self._file, fcntl.LOCK_UN)
+    return offset, len(data)
+
+  def get(self, offset: int, length: int) -> dict:
+    with self._lock:
+      self._file.seek(offset)
+      data = self._file.read(length)
+    return json.loads(zlib.decompress(data))
+
+  def close(self) -> None:
+    with self._lock:
+      self._file.close()
+
+def blobs_pack(entry: dict) -> tuple[dict, dict | None]:
+  """
+  Split a history entry (see Dialog._user and Dialog._llm) into its hot part
+  - everything but raw and think - and the cold record of its text.
+
+  Nothing is stored twice: a user turn's raw is its content, so it needs no
+  record at all, and the reasoning is nearly always a slice of raw, in which
+  case only where it sits in raw is kept.
+  """
+  hot = {k: v for k, v in entry.items() if k not in ('raw', 'think')}
+  raw, think = entry['raw'], entry['think']
+  if not think and raw == entry['content']: return hot, None
+  start = raw.find(think) if think else -1
+  if start >= 0: record = {'raw': raw, 'think_at': [start, start + len(think)]}
+  else: record = {'raw': raw, 'think': think}
+  return hot, record
+
+def blobs_unpack(hot: dict, record: dict | None) -> dict:
+  """The history entry blobs_pack split up, whole again"""
+  if record is None: return {**hot, 'raw': hot['content'], 'think': ''}
+  entry = dict(hot)
+  entry['raw'] = record['raw']
+  if 'think_at' in record:
+    start, end = record['think_at']
+    entry['think'] = record['raw'][start:end]
+  else:
+    entry['think'] = record['think']
+  return entry
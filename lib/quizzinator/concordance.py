@@ -6,6 +6,7 @@ from .utils import pp
 from .cli import cli_log_args, cli_set_args, cli_get_args
 from .questions import parse_questions
 from .answers import evaluate_role_consistency, evaluate_gender_consistency
+from .results import results_load
 
 
 def concordance_cli_args():
@@ -31,6 +32,24 @@ def concordance_cli_args():
   )
   return p.parse_args()
 
+def concordance_responses(path: Path, experiment: str) -> list[dict[str, set[str]]]:
+  """Each respondent's answers, as sets of answer codes"""
+  table = results_load(path / 'experiments' / experiment)
+  if table is not None:
+    return [
+      {name: {str(v) for v in value} if isinstance(value, list) else {'' if value is None else str(value)} for name, value in row.items()}
+      for row in table.to_pylist()
+    ]
+
+  # experiments from before the results table only have the stringified lists of data.json
+  path_data = path / 'html' / experiment / 'data.json'
+  with open(path_data, encoding='utf-8') as f:
+    responses = json.load(f)['responses']
+  return [
+    {name: set(value.replace(',','-').replace('[','').replace(']','').replace("'",'').split('-')) for name, value in row.items()}
+    for row in responses
+  ]
+
 def concordance_main():
   args = concordance_cli_args()
   args.hints = args.hints.split(',')
@@ -47,9 +66,7 @@ def concordance_main():
       humans.append(row)
 
   # Get the answers from the LLM
-  path_data = Path(args.dir) / 'html' / args.experiment / 'data.json'
-  with open(path_data, encoding='utf-8') as f:
-    responses = json.load(f)['responses']
+  responses = concordance_responses(Path(args.dir), args.experiment)
 
   # get the questions
   questions = {}
@@ -63,7 +80,7 @@ def concordance_main():
   for hint in args.hints:
     for llm, human in list(zip(responses, cycled_humans)):
       human_response = set(human[hint].split(','))
-      llm_response = set(llm[hint].replace(',','-').replace('[','').replace(']','').replace("'",'').split('-'))
+      llm_response = llm[hint]
 
       # look for consistency
       if hint == 'Roles':
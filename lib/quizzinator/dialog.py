@@ -1,21 +1,71 @@
 import re, time
 
+from dataclasses import asdict
+
 from .ollama import Ollama
+from .ollama_http import OllamaHttp, AsyncOllamaHttp, model_digest
+from .response_cache import ResponseCache
 from .logging import logger
 
+# the ways we know how to talk to ollama, selected with --backend
+BACKENDS = {
+  'pty': Ollama,
+  'http': OllamaHttp,
+}
+
+# the subset of those that the async engine (--engine async) can drive
+ASYNC_BACKENDS = {
+  'http': AsyncOllamaHttp,
+}
+
+# the backends that can hold the model to a JSON schema (--structured); the
+# pty one only has the REPL, which has no way to pass one
+STRUCTURED_BACKENDS = ('http',)
+
+# the backends that can be handed turns that happened elsewhere (the response
+# store, the turn log) as they were; the REPL would have to be asked them again,
+# which saves nothing and leaves the model with a different conversation than
+# the recorded one
+RESTORING_BACKENDS = ('http',)
+
 class Dialog:
-  def __init__(self, model: str = 'deepseek-r1:1.5b', timeout: float = 10.0, cache=None):
+  def __init__(
+      self,
+      model: str = 'deepseek-r1:1.5b',
+      timeout: float = 10.0,
+      cache=None,
+      backend: str = 'pty',
+      pool=None,
+      store: ResponseCache | None = None,
+      options: dict | None = None,
+      respondent: int | None = None,
+  ):
     """
     Create the dialog object
 
     model - the name of the model passed to ollama
     timeout - how long to wait for the llm
     cache - optional dictionary containing the expected responses from the llm (used for testing)
+    backend - how to talk to ollama: 'pty' drives `ollama run`, 'http' uses the server's chat api
+    pool - optional SessionPool to borrow a warm session from, instead of starting one
+    store - optional project-wide ResponseCache consulted before asking the LLM (see RESTORING_BACKENDS)
+    options - sampling options for the model, like {'seed': 42}
+    respondent - which respondent this is; with options, it tells apart stored responses
     """
+    if backend not in BACKENDS: raise ValueError(f'Unknown backend {backend}')
+
     # details about the model for lazy instantiation
     self._model = model
     self._timeout = timeout
+    self._backend = backend
+    self._pool = pool
     self._ollama = None
+    self._options = options or {}
+
+    # the response store, and the turns it answered that the session has not seen yet
+    self._store = store if backend in RESTORING_BACKENDS else None
+    self._respondent = respondent
+    self._unsent: list[dict[str, str]] = []
 
     # keep track of the total history of the dialog
     self.history = []
@@ -26,12 +76,56 @@ class Dialog:
 
   def ollama(self):
     """Lazy creation of the Ollama client"""
-    self._ollama = self._ollama or Ollama(self._model, self._timeout)
+    if not self._ollama:
+      self._ollama = self._pool.acquire() if self._pool else BACKENDS[self._backend](self._model, self._timeout)
+      if self._options: self._ollama.configure(self._options)
+    return self._ollama
+
+  def aollama(self):
+    """Lazy creation of the asyncio Ollama client"""
+    if self._backend not in ASYNC_BACKENDS:
+      raise ValueError(f'The {self._backend} backend cannot be used asynchronously')
+    if not self._ollama:
+      self._ollama = self._pool.acquire() if self._pool else ASYNC_BACKENDS[self._backend](self._model, self._timeout)
+      if self._options: self._ollama.configure(self._options)
     return self._ollama
 
   def kill(self):
     if self._ollama: self._ollama.kill()
 
+  async def akill(self):
+    if self._ollama: await self._ollama.kill()
+
+  def close(self):
+    """Done with the dialog: hand the session back to the pool, or kill it"""
+    if not self._ollama: return
+    if self._pool: self._pool.release(self._ollama)
+    else: self._ollama.kill()
+    self._ollama = None
+
+  async def aclose(self):
+    if not self._ollama: return
+    if self._pool: await self._pool.release(self._ollama)
+    else: await self._ollama.kill()
+    self._ollama = None
+
+  def restores(self) -> bool:
+    """Whether the session can be handed earlier turns (see RESTORING_BACKENDS)"""
+    return self._use_cache or self._backend in RESTORING_BACKENDS
+
+  def resume(self, history: list[dict]) -> None:
+    """
+    Carry on a conversation from turns recorded earlier, as if they had just
+    happened. The session is handed them before it is next asked anything,
+    which only some backends can do (see restores).
+    """
+    if not self.restores(): raise ValueError(f'The {self._backend} backend cannot resume a conversation')
+    self.history = list(history)
+    for h in history:
+      self._unsent.append({'role': 'user' if h['role'] == 'user' else 'assistant', 'content': h['content']})
+      if h['role'] == 'user': prompt = h['raw']
+      else: self.set_to_cache(prompt, h['raw'])
+
   def get_from_cache(self, key: str) -> str:
     """Query the cache of responses from the LLM"""
     return self.cache.get(key, None)
@@ -75,6 +169,7 @@ class Dialog:
       think: str,
       content: str,
       start: float = None,
+      truncated: bool = False,
   ) -> dict[str, str | float]:
     ret = {
       # mark it as the quizzinator doing this part of the conversation
@@ -86,24 +181,93 @@ class Dialog:
       'think': think,
       'start': start,
       'elapsed': time.time() - start,
+
+      # the generation was cut off as soon as the answer was known
+      'truncated': truncated,
     }
     self.history.append(ret)
     return ret
 
-  def query(self, prompt: str) -> dict[str, str]:
+  def query(self, prompt: str, stop=None, format: dict | None = None) -> dict[str, str]:
+    """
+    Ask the LLM and record both sides in the history.
+
+    stop - optional test of the answer so far; once it passes, the LLM is cut off
+    format - optional JSON schema the reply has to follow (see STRUCTURED_BACKENDS)
+    """
     # record the user part of the conversation
     user = self._user(prompt)
 
     # get the LLM response (or get from the cache)
     t0 = time.time()
-    if not self._use_cache:
-      raw = self.ollama().query(prompt)
-      if not raw:
-        self.kill()
-        raise TimeoutError("Failed to get ollama response")
-      self.set_to_cache(prompt, raw)
+    if self._use_cache: return [user, self._response(prompt, t0)]
+    key = self._store_key(prompt, stop, format)
+    stored = self._stored(prompt, key, t0)
+    if stored: return [user, stored]
+
+    session = self.ollama()
+    if self._unsent:
+      session.prime(self._unsent)
+      self._unsent = []
+    reply = session.chat(prompt, stop=stop, format=format) if format else session.chat(prompt, stop=stop)
+    if not reply.raw:
+      self.kill()
+      raise TimeoutError("Failed to get ollama response")
+    return [user, self._answered(prompt, key, reply, t0)]
+
+  async def aquery(self, prompt: str, stop=None, format: dict | None = None) -> dict[str, str]:
+    """The same as query, but awaiting the model so other dialogs can run meanwhile"""
+    user = self._user(prompt)
+
+    t0 = time.time()
+    if self._use_cache: return [user, self._response(prompt, t0)]
+    key = self._store_key(prompt, stop, format)
+    stored = self._stored(prompt, key, t0)
+    if stored: return [user, stored]
+
+    session = self.aollama()
+    if self._unsent:
+      session.prime(self._unsent)
+      self._unsent = []
+    reply = await (session.chat(prompt, stop=stop, format=format) if format else session.chat(prompt, stop=stop))
+    if not reply.raw:
+      await self.akill()
+      raise TimeoutError("Failed to get ollama response")
+    return [user, self._answered(prompt, key, reply, t0)]
+
+  def _store_key(self, prompt: str, stop, format: dict | None = None) -> str | None:
+    """Where the response to prompt lives in the response store"""
+    if self._store is None: return None
+    # every turn before this one (whose user entry is already in the history)
+    conversation = [(h['role'], h['raw']) for h in self.history[:-1]]
+    sample = {
+      'options': self._options,
+      'respondent': self._respondent,
+      'early_stop': stop is not None,
+    }
+    # only when there is one, so the keys of earlier runs still match
+    if format: sample['format'] = format
+    return ResponseCache.key(model_digest(self._model), conversation, prompt, sample)
+
+  def _stored(self, prompt: str, key: str | None, t0: float) -> dict | None:
+    """The stored response to prompt, recorded in the history, if there is one"""
+    stored = self._store.get(key) if key else None
+    if not stored: return None
+    # the session has to hear about this turn before it is next asked something
+    self._unsent.append({'role': 'user', 'content': prompt})
+    self._unsent.append({'role': 'assistant', 'content': stored['content']})
+    self.set_to_cache(prompt, stored['raw'])
+    return self._llm(stored['raw'], stored['think'], stored['content'], t0, stored['truncated'])
+
+  def _answered(self, prompt: str, key: str | None, reply, t0: float) -> dict:
+    """Record a fresh response from the LLM in the caches and the history"""
+    self.set_to_cache(prompt, reply.raw)
+    if key: self._store.put(key, asdict(reply))
+    return self._llm(reply.raw, reply.think, reply.content, t0, reply.truncated)
+
+  def _response(self, prompt: str, t0: float) -> dict[str, str | float]:
+    """Record the cached LLM response to prompt in the history"""
     raw = self.get_from_cache(prompt)
     if not raw: raise Exception("no proper response in cache")
     think, content = self.think_and_response(raw)
-    llm = self._llm(raw, think, content, t0)
-    return [user, llm]
+    return self._llm(raw, think, content, t0)
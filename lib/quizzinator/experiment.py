@@ -1,7 +1,8 @@
-import argparse, sys, os, time, shutil, csv, json, datetime
+import argparse, asyncio, sys, os, time, shutil, csv, json, datetime
 from zipfile import ZipFile
 
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
 import pandas as pd
@@ -11,8 +12,15 @@ from .utils import pp, timestamp_str
 from .cli import cli_log_args, cli_set_args, cli_get_args
 
 from .parser import parse_questions
-from .questions import load_hints, load_hints, make_full_questions, parse_questions
-from .quiz import quiz_todo, quiz_run_one, quiz_save, quiz_done
+from .questions import load_hints, load_hints, make_full_questions, make_preamble, preamble_key, parse_questions
+from .dialog import BACKENDS, ASYNC_BACKENDS, STRUCTURED_BACKENDS, RESTORING_BACKENDS
+from .pool import SessionPool, AsyncSessionPool
+from .response_cache import ResponseCache
+from .store import ExperimentStore, store_open, export_viewer
+from .ledger import Ledger
+from .results import ResultsTable, results_csv
+from .publisher import Publisher
+from .quiz import quiz_todo, quiz_run_one, aquiz_run_one, quiz_save, quiz_answers, quiz_rescore_all
 
 def experiment_cli_args():
   p = argparse.ArgumentParser(
@@ -59,11 +67,89 @@ def experiment_cli_args():
     default=2,
     help="How many times we will ask the question before giving up"
   )
+  p.add_argument(
+    "--workers",
+    type=int,
+    default=1,
+    help="How many respondents to quiz at the same time"
+  )
+  p.add_argument(
+    "--engine",
+    choices=["threads", "async"],
+    default="threads",
+    help="Run respondents in threads, or as asyncio coroutines on one event loop (needs --backend http)"
+  )
+  p.add_argument(
+    "--pool",
+    type=int,
+    default=0,
+    help="Keep this many warm model sessions and reuse them between respondents [def = a fresh session for each]"
+  )
+  p.add_argument(
+    "--seed",
+    type=int,
+    default=None,
+    help="Give respondent #i the sampling seed SEED + i, so runs can be reproduced [def = ollama picks]"
+  )
+  p.add_argument(
+    "--no-response-cache",
+    action="store_true",
+    help="Always ask the LLM, instead of reusing responses to the very same conversation from earlier runs with the same seed"
+  )
+  p.add_argument(
+    "--response-cache-size",
+    type=int,
+    default=1024,
+    help="Megabytes of responses to keep in the project's response cache before dropping the least recently used"
+  )
+  p.add_argument(
+    "--prefix-reuse",
+    action="store_true",
+    help="Quiz respondents whose setup text is identical one after another, so the model can reuse its reading of it; this only reorders the quizzes, so it only helps when respondents share a hint profile"
+  )
+  p.add_argument(
+    "--early-stop",
+    action="store_true",
+    help="Cut the LLM off as soon as it has given a legal answer to a multiple choice or number question"
+  )
+  p.add_argument(
+    "--structured",
+    action="store_true",
+    help="Hold the LLM to a JSON answer that fits each question, rather than finding the answer in free text (needs --backend http)"
+  )
+  p.add_argument(
+    "--lease",
+    type=float,
+    default=120,
+    help="Seconds a crashed run keeps its respondents leased before another run may take them over"
+  )
+  p.add_argument(
+    "--shared",
+    action="store_true",
+    help="The survey directory is shared between machines over a network file system (NFS, SMB)"
+  )
+  p.add_argument(
+    "--publish-every",
+    type=float,
+    default=30,
+    help="Seconds between updates of the experiment's results and html while the run is going"
+  )
+  p.add_argument(
+    "--legacy-files",
+    action="store_true",
+    help="Also write each quiz out as files in experiments/<experiment>/quizzes, the layout older tools read"
+  )
   p.add_argument(
     "-m", "--model",
     default="",
     help="Ollama model name to use, like deepseek-r1:1.5b"
   )
+  p.add_argument(
+    "--backend",
+    choices=["pty", "http"],
+    default="pty",
+    help="How to talk to ollama: pty drives `ollama run`, http uses the ollama server's chat api"
+  )
   p.add_argument(
     '--from-hints',
     action='store_true',
@@ -94,6 +180,11 @@ def experiment_cli_args():
     action='store_true',
     help='If set, load from cache instead of querying the LLM'
   )
+  p.add_argument(
+    '--replay',
+    action='store_true',
+    help='If set, extract the answers from the saved dialogs again and rebuild the results and html, without the LLM'
+  )
   return p.parse_args()
 
 def experiment_cli_get_n() -> int:
@@ -124,73 +215,238 @@ def experiment_cli_get_reset():
   args.reset = True
   logger.warn("--use-cache implies reset=True")
 
-def experiment_run_csv(quiz_dir, csv_file_path):
-  csv_data = []
-
-  # Iterating over each folder in quiz_dir
-  folders = [folder for folder in os.listdir(quiz_dir) if
-           folder.isdigit() and os.path.isdir(os.path.join(quiz_dir, folder))]
-  for folder in sorted(folders, key=int):
-    json_file_path = os.path.join(quiz_dir, folder, "questions.json")
-
-    # Verifying that json_file_path is an existing file
-    if not os.path.isfile(json_file_path):
-      continue
-
-    with open(json_file_path, 'r') as file:
-      data = json.load(file)
+def experiment_cli_get_replay():
+  """A replay is of the experiment as it was run: take the model, hints and questions from its meta.json"""
+  args = cli_get_args()
+  if not args.replay: return
+  path_meta = experiment_path_meta()
+  if not path_meta.exists(): logger.critical(f"Nothing to replay: {path_meta} is missing")
+  with open(path_meta, 'r') as f:
+    meta = json.load(f)
+  args.model = args.model or meta.get('model', '')
+  args.hints = args.hints or meta.get('hints', [])
+  args.questions = args.questions or meta.get('questions', [])
+
+def experiment_questions() -> list:
+  """The questions this experiment asks, in the order it asks them"""
+  args = cli_get_args()
+  questions = parse_questions(Path(args.dir) / 'questions.txt')
+  if not args.questions: return questions
+  by_name = {q.name: q for q in questions}
+  return [by_name[name] for name in args.questions if name in by_name]
 
-    row_data = OrderedDict({"number": folder})
+def experiment_quiz_inputs(index: int, store: ExperimentStore):
+  """The questions, hint answer and any cached responses for one quiz"""
+  args = cli_get_args()
+  questions, hint_answer = make_full_questions(args.dir, args.hints, index, args.skip_identity, args.skip_setup)
+  cache = store.cache(index) if args.use_cache else None
+  if cache is not None: logger.info("Using a cache")
+  return questions, hint_answer, cache
 
-    for key, value in data.items():
-      row_data[key] = value['answer']
+# the preamble key of each quiz, worked out by experiment_prefix_order
+_prefix_keys: dict[int, str] = {}
 
-    csv_data.append(row_data)
+def experiment_prefix_key(index: int) -> str:
+  """Which shared setup text (preamble) this quiz starts with"""
+  args = cli_get_args()
+  preamble, _ = make_preamble(args.dir, args.hints, index, args.skip_identity, args.skip_setup)
+  return preamble_key(args.model, preamble)
+
+def experiment_prefix_order(todo: list) -> list:
+  """
+  Put quizzes that start with the same preamble next to each other.
+
+  Ollama keeps what it has already read of a prompt and reuses it when the
+  next prompt starts the same way, so this way the preamble is read once per
+  distinct hint profile instead of once per respondent. Respondent i gets
+  profile i % (number of profiles), so each profile's preamble is only made
+  once; the keys are kept for experiment_quiz_meta.
+  """
+  args = cli_get_args()
+  _prefix_keys.clear()
+  profiles = 0
+  if args.hints and not args.skip_identity:
+    hint_text, _ = load_hints(os.path.join(args.dir, "hints.csv"), os.path.join(args.dir, "questions.txt"), columns=tuple(args.hints))
+    profiles = len(hint_text)
+  by_profile = {}
+  for index, _ in todo:
+    profile = index % profiles if profiles else 0
+    if profile not in by_profile: by_profile[profile] = experiment_prefix_key(index)
+    _prefix_keys[index] = by_profile[profile]
+  first = {}
+  for index, _ in todo: first.setdefault(_prefix_keys[index], len(first))
+  logger.info(f"{len(first):,} distinct preambles for {len(todo):,} quizzes")
+  return sorted(todo, key=lambda t: (first[_prefix_keys[t[0]]], t[0]))
+
+def experiment_quiz_meta(index: int, now: str, t0: float) -> dict:
+  """The meta data saved alongside one finished quiz; with --prefix-reuse, which preamble it started with"""
+  args = cli_get_args()
+  meta = {
+    'index': index,
+    'size': args.n,
+    'duration': time.time() - t0,
+    'start': now,
+    'model': args.model,
+    'backend': args.backend,
+    'structured': getattr(args, 'structured', False),
+  }
+  if index in _prefix_keys: meta['prefix'] = _prefix_keys[index]
+  return meta
 
-  keys = csv_data[0].keys()
-  with open(csv_file_path, 'w', newline='') as output_file:
-    dict_writer = csv.DictWriter(output_file, keys)
-    dict_writer.writeheader()
-    dict_writer.writerows(csv_data)
+def experiment_pool(asynchronous: bool = False) -> SessionPool | None:
+  """The warm session pool for this run, if --pool asks for one"""
+  args = cli_get_args()
+  if args.pool < 1 or args.use_cache: return None
+  if asynchronous:
+    pool = AsyncSessionPool(lambda: ASYNC_BACKENDS[args.backend](args.model, args.timeout), args.pool)
+  else:
+    pool = SessionPool(lambda: BACKENDS[args.backend](args.model, args.timeout), args.pool)
+  with logger.section(f"Warming up {args.pool:,} {args.model} sessions"):
+    pool.warm()
+  return pool
+
+def experiment_response_cache() -> ResponseCache | None:
+  """
+  The project-wide response cache, unless it is turned off. Only seeded runs
+  use it: without a seed, every run is meant to be a fresh sample, and two
+  runs with the same settings would otherwise get each other's responses.
+  """
+  args = cli_get_args()
+  if args.no_response_cache or args.use_cache: return None
+  if args.seed is None:
+    logger.info("No --seed, so responses are drawn afresh rather than taken from the response cache")
+    return None
+  if args.backend not in RESTORING_BACKENDS:
+    logger.info(f"The {args.backend} backend cannot pick up stored turns, so the response cache is not used")
+    return None
+  return ResponseCache(Path(args.dir) / 'cache' / 'responses.sqlite', args.response_cache_size << 20, args.shared)
+
+# what a worker hands back instead of a dialog for a quiz another run is doing
+LEASED = 'leased'
+
+def experiment_run_one(index: int, experiment: ExperimentStore, total: int, pool: SessionPool | None = None, store: ResponseCache | None = None, ledger: Ledger | None = None):
+  """
+  Administer one quiz; runs inside a worker thread.
+
+  Workers only ever read the global args, they never change them, and all
+  they write to the experiment is the quiz's lease and turn log: the results
+  go back to experiment_run to be saved.
+  """
+  args = cli_get_args()
+  if ledger and not ledger.acquire(index): return index, LEASED, None
+  questions, hint_answer, cache = experiment_quiz_inputs(index, experiment)
+  now = timestamp_str()
+  t0 = time.time()
+  dialog = quiz_run_one(index, total, hint_answer, questions, cache, args.model, args.timeout, args.verbose, args.attempts, args.backend, pool, store, experiment)
+  if not dialog: return index, None, None
+  return index, dialog, experiment_quiz_meta(index, now, t0)
+
+async def experiment_arun_one(index: int, experiment: ExperimentStore, total: int, semaphore: asyncio.Semaphore, pool: AsyncSessionPool | None = None, store: ResponseCache | None = None, ledger: Ledger | None = None):
+  """Administer one quiz as a coroutine, once the model has a free slot"""
+  args = cli_get_args()
+  async with semaphore:
+    if ledger and not ledger.acquire(index): return index, LEASED, None
+    questions, hint_answer, cache = experiment_quiz_inputs(index, experiment)
+    now = timestamp_str()
+    t0 = time.time()
+    dialog = await aquiz_run_one(index, total, hint_answer, questions, cache, args.model, args.timeout, args.verbose, args.attempts, args.backend, pool, store, experiment)
+  if not dialog: return index, None, None
+  return index, dialog, experiment_quiz_meta(index, now, t0)
+
+def experiment_run_save(prog, experiment: ExperimentStore, publisher: Publisher, ledger: Ledger | None, index: int, dialog, meta: dict) -> None:
+  """Save one finished quiz, and hand it on to be published - only ever called from one thread"""
+  if dialog is LEASED:
+    prog.step(f"Quiz #{index + 1:,} is done or being run elsewhere")
+    return
+  if not dialog:
+    if ledger: ledger.release(index)
+    prog.step(f"Failed for quiz #{index}", "ERROR")
+    return
+  if not quiz_save(experiment, index, dialog, meta, ledger.owner if ledger else None):
+    prog.step(f"Quiz #{index + 1:,} was taken over and saved elsewhere", "WARNING")
+    return
+  questions, _ = quiz_answers(dialog)
+  publisher.push(index, {name: q['answer'] for name, q in questions.items()}, dialog.history)
+  prog.step(f"Finished quiz #{index + 1:,}")
+
+def experiment_run_threads(todo: list, prog, experiment: ExperimentStore, publisher: Publisher, store: ResponseCache | None = None, ledger: Ledger | None = None) -> dict | None:
+  """Run the quizzes in a pool of --workers threads; returns the session pool's meta data"""
+  args = cli_get_args()
+  workers = max(1, min(args.workers, len(todo)))
+  sessions = experiment_pool()
+  # respondents are independent, so run several at once; this thread is the
+  # only one that saves, so quiz_save never races with itself
+  try:
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='quiz') as pool:
+      futures = [pool.submit(experiment_run_one, index, experiment, len(todo), sessions, store, ledger) for index, _ in todo]
+      try:
+        for future in as_completed(futures):
+          experiment_run_save(prog, experiment, publisher, ledger, *future.result())
+      except BaseException:
+        # don't start anything new if we are bailing out
+        pool.shutdown(wait=False, cancel_futures=True)
+        raise
+  finally:
+    if sessions: sessions.close()
+  return sessions.meta() if sessions else None
+
+async def experiment_run_async(todo: list, prog, experiment: ExperimentStore, publisher: Publisher, store: ResponseCache | None = None, ledger: Ledger | None = None) -> dict | None:
+  """Run every quiz as a coroutine on one event loop, --workers at a time"""
+  args = cli_get_args()
+  semaphore = asyncio.Semaphore(max(1, args.workers))
+  sessions = experiment_pool(asynchronous=True)
+  tasks = [asyncio.create_task(experiment_arun_one(index, experiment, len(todo), semaphore, sessions, store, ledger)) for index, _ in todo]
+  try:
+    for task in asyncio.as_completed(tasks):
+      experiment_run_save(prog, experiment, publisher, ledger, *await task)
+  finally:
+    for task in tasks: task.cancel()
+    if sessions: await sessions.close()
+  return sessions.meta() if sessions else None
 
 def experiment_run():
   """Actually run the LLM-based quizzes"""
   args = cli_get_args()
   args.dir = Path(args.dir)
-  todo = quiz_todo(args.dir, args.experiment, args.n, args.reset)
-  todo = [t for t in todo if t[-1]]
-  with logger.section(f"Running {args.dir}/experiments/{args.experiment}", timer=False):
-    with logger.progress("Administering quizzes", steps=len(todo)) as prog:
-      for index, path_quiz, _ in todo:
-        questions, hint_answer = make_full_questions(args.dir, args.hints, index, args.skip_identity, args.skip_setup)
-        path_cache = path_quiz / "cache.json"
-        cache = None
-        if path_cache.exists() and args.use_cache:
-          with path_cache.open("r", encoding='utf-8') as f:
-            logger.info("Using a cache")
-            cache = json.load(f)
-
-        now = timestamp_str()
-        t0 = time.time()
-        dialog = quiz_run_one(index, len(todo), hint_answer, questions, cache, args.model, args.timeout, args.verbose, args.attempts)
-        if not dialog:
-          prog.step(f"Failed for quiz #{index}", "ERROR")
-          continue
-        dt = time.time() - t0
-        meta = {
-          'index': index,
-          'size': args.n,
-          'duration': dt,
-          'start': now,
-          'model': args.model,
-        }
-        quiz_save(path_quiz, dialog, meta)
-        prog.step(f"Finished quiz #{index + 1:,}")
-  experiment_run_post_meta()
-  experiment_run_post_csv()
-  experiment_run_post_quizzes()
-
-def experiment_run_post_meta():
+  experiment = store_open(args.dir / 'experiments' / args.experiment, args.shared)
+  results = ResultsTable(args.dir / 'experiments' / args.experiment, experiment_questions())
+  # the results and html are brought up to date in the background as quizzes finish
+  publisher = Publisher(
+    experiment, results, args.dir / 'html' / args.experiment / 'dialog',
+    lambda table, **extra: experiment_run_refresh(experiment, table, **extra), args.publish_every
+  )
+  try:
+    todo = quiz_todo(experiment, args.n, args.reset)
+    todo = [t for t in todo if t[-1]]
+    if args.prefix_reuse: todo = experiment_prefix_order(todo)
+    store = experiment_response_cache()
+    # other runs, here or on other machines, may be working on this experiment too
+    ledger = Ledger(experiment, args.lease, args.reset)
+    try:
+      publisher.start()
+      with logger.section(f"Running {args.dir}/experiments/{args.experiment}", timer=False), ledger:
+        with logger.progress("Administering quizzes", steps=len(todo)) as prog:
+          if args.engine == 'async':
+            pool_meta = asyncio.run(experiment_run_async(todo, prog, experiment, publisher, store, ledger))
+          else:
+            pool_meta = experiment_run_threads(todo, prog, experiment, publisher, store, ledger)
+    except BaseException:
+      # keep what was finished; the next run publishes it
+      publisher.stop()
+      results.close()
+      raise
+    finally:
+      if store is not None: store.close()
+    if store is not None:
+      stats = store.stats()
+      logger.info(f"Response cache: {stats['hits']:,} hits, {stats['misses']:,} misses, {stats['evictions']:,} evicted")
+    publisher.close(pool_meta=pool_meta, cache_meta=store.stats() if store is not None else None)
+    if args.legacy_files:
+      experiment.export_legacy(args.dir / 'experiments' / args.experiment / 'quizzes')
+  finally:
+    experiment.close()
+
+def experiment_run_post_meta(experiment: ExperimentStore, pool_meta: dict | None = None, cache_meta: dict | None = None):
   args = cli_get_args()
 
   # update the meta
@@ -203,54 +459,60 @@ def experiment_run_post_meta():
       meta = json.load(f)
 
   # upodate with data on the start and end times
-  done_quizzes = quiz_done(args.dir, args.experiment)
-  start_times = []
-  end_times = []
-  for _, path_quiz, done in done_quizzes:
-    if done:
-      with open(path_quiz / 'history.json', 'r') as f:
-        history_list = json.load(f)
-        for history in history_list:
-          start = history['start']
-          elapsed = history['elapsed']
-          start_times.append(start)
-          end_times.append(start + elapsed)
-  # Save start and end times to the existing meta dictionary and save it to meta.json
-  meta['start'] = min(start_times) if start_times else 'N/A'
-  meta['end'] = max(end_times) if end_times else 'N/A'
+  span = experiment.span()
+  meta['start'] = span[0] if span else 'N/A'
+  meta['end'] = span[1] if span else 'N/A'
+
+  # how long the session pool spent spawning and resetting sessions
+  if pool_meta: meta['pool'] = pool_meta
+
+  # how much the response cache saved us
+  if cache_meta: meta['response_cache'] = cache_meta
   path_meta = experiment_path_meta()
   with open(path_meta, 'w') as f:
     json.dump(meta, f, indent=4)
 
-def experiment_run_post_csv():
-  """save the csv file"""
+def experiment_run_refresh(experiment: ExperimentStore, table, pool_meta: dict | None = None, cache_meta: dict | None = None):
+  """Bring meta.json, data.csv, the experiment's html and the project report up to date with the results so far"""
   args = cli_get_args()
-  path_quizzes = args.dir / 'experiments' / args.experiment / 'quizzes'
-  path_csv = args.dir / 'experiments' / args.experiment / 'data.csv'
-  experiment_run_csv( path_quizzes, path_csv)
-
-def experiment_run_post_quizzes():
-  """save the quiz html inside the info/quizzes dir"""
+  experiment_run_post_meta(experiment, pool_meta, cache_meta)
+  results_csv(table, args.dir / 'experiments' / args.experiment / 'data.csv')
+  experiment_html(args.dir / 'experiments' / args.experiment)
+  experiment_publish()
+
+def experiment_replay():
+  """
+  Extract every saved respondent's answers again - after the extraction
+  rules changed, say - and rebuild the results, meta data and html from them.
+
+  No model is involved: only the stored dialogs are read, and without their
+  raw output and reasoning, which extraction doesn't look at. The extraction
+  runs in a pool of processes, one per core unless --workers says otherwise.
+  """
   args = cli_get_args()
-  args_dir = Path(os.path.abspath(args.dir))
-
-  path_quizzes = args_dir / 'experiments' / args.experiment / 'quizzes'
-  path_info_quizzes = args_dir / 'html' / args.experiment / 'quizzes'
-  path_info_quizzes.mkdir(parents=True, exist_ok=True)  # make directory, ignore if it already exists
-  for child in path_quizzes.iterdir():
-    if not child.is_dir(): continue
-    bn = os.path.basename(child)
-    if not bn.isdigit(): continue
-    # where to save the files
-    dst_dir = path_info_quizzes / bn  # create equivalent directory in path_info_quizzes
-    dst_dir.mkdir(parents=True, exist_ok=True)  # make directory, ignore if it already exists
-    for file in child.glob('*'):  # go through all files in folder
-      if file.suffix in ['.js', '.html', '.css']:  # if file ends with '.js', '.html', or '.css'
-        # print(file)
-        # print("===> " + str(dst_dir))
-        # print()
-        shutil.copy2(file, dst_dir)  # copy the file
-
+  args.dir = Path(args.dir)
+  path_experiment = args.dir / 'experiments' / args.experiment
+  experiment = store_open(path_experiment, args.shared)
+  try:
+    specs = {q.name: (q.mode, [o.code for o in q.options]) for q in parse_questions(args.dir / 'questions.txt')}
+    workers = args.workers if args.workers > 1 else os.cpu_count() or 1
+    results = ResultsTable(path_experiment, experiment_questions())
+    results.clear()
+    replayed = changed = 0
+    with logger.section(f"Replaying {path_experiment} in {workers:,} processes"):
+      for index, before, questions, history in quiz_rescore_all(experiment, specs, workers, results):
+        replayed += 1
+        changed += sum(
+          json.dumps(q['answer'], default=str) != json.dumps(before.get(name, {}).get('answer'), default=str)
+          for name, q in questions.items()
+        )
+      logger.info(f"Replayed {replayed:,} quizzes: {changed:,} answers changed")
+      export_viewer(Path(os.path.abspath(args.dir)) / 'html' / args.experiment / 'dialog', experiment, workers=workers)
+      experiment_run_refresh(experiment, results.compact(experiment))
+    if args.legacy_files:
+      experiment.export_legacy(path_experiment / 'quizzes')
+  finally:
+    experiment.close()
 
 def experiment_from_hints():
   """Create an experiment folder based on the hints file"""
@@ -293,7 +555,6 @@ def copytree(source_dir, target_dir, ignore=None):
       shutil.copy2(str(source), str(target))
 
 def experiment_html(dir_path):
-  print("in experiment_html")
   args = cli_get_args()
 
   # Copy the templates/experiment files
@@ -374,6 +635,54 @@ def experiment_html(dir_path):
     json.dump(data, f, indent=4)
 
 
+def experiment_report_shard(path_html: Path, name: str, data: dict) -> dict:
+  """Write one experiment's report data as a compact shard of its own; returns its manifest entry"""
+  path_shards = path_html / 'shards'
+  path_shards.mkdir(parents=True, exist_ok=True)
+  with open(path_shards / f'{name}.js', 'w') as f:
+    f.write(f'document.quizzinator.data[{json.dumps(name)}] = ')
+    json.dump(data, f, separators=(',', ':'))
+    f.write(';\n')
+  responses = data.get('responses', [])
+  meta = data.get('meta', {})
+  return {
+    'shard': f'shards/{name}.js',
+    'size': len(responses),
+    'model': meta.get('model'),
+    'start': meta.get('start'),
+    'end': meta.get('end'),
+    'questions': sorted({k for r in responses for k in r if k != 'number'}),
+  }
+
+def experiment_report(path_html: Path, name: str) -> None:
+  """
+  Bring the project report up to date after experiment name has run.
+
+  Each experiment's data lives in its own shard (html/shards/<name>.js) that
+  the project page loads when the experiment is ticked; html/data.js is just
+  the manifest of experiments with a few summary stats. Only name's shard and
+  the manifest are rewritten - plus shards for experiments reported before
+  there were shards, the first time round.
+  """
+  path_manifest = path_html / 'manifest.json'
+  manifest = {}
+  if path_manifest.exists():
+    with open(path_manifest, 'r') as f:
+      manifest = json.load(f)
+
+  # drop experiments whose html is gone
+  manifest = {k: v for k, v in manifest.items() if (path_html / k / 'data.json').exists()}
+  for path_data in sorted(path_html.glob('*/data.json')):
+    other = path_data.parent.name
+    if other != name and other in manifest: continue
+    with open(path_data, 'r') as f:
+      manifest[other] = experiment_report_shard(path_html, other, json.load(f))
+
+  with open(path_manifest, 'w') as f:
+    json.dump(manifest, f, indent=2, sort_keys=True)
+  with open(path_html / 'data.js', 'w') as f:
+    f.write('document.quizzinator.manifest = ' + json.dumps(manifest, sort_keys=True) + ';\n')
+
 def experiment_check():
   """Check that the required files and directories are present"""
   args = cli_get_args()
@@ -392,6 +701,11 @@ def experiment_check():
     if not os.path.exists(src_setup):
       logger.critical(f"Couldn't find file: {src} - needed in setup dir, see README.md for details")
 
+  if args.engine == 'async' and args.backend not in ASYNC_BACKENDS and not args.use_cache:
+    logger.critical(f"--engine async needs one of these backends: {', '.join(ASYNC_BACKENDS)}")
+  if getattr(args, 'structured', False) and args.backend not in STRUCTURED_BACKENDS and not args.use_cache:
+    logger.critical(f"--structured needs one of these backends: {', '.join(STRUCTURED_BACKENDS)}")
+
   # make sure we have directories used by this code for output
   os.makedirs(root / 'experiments', exist_ok=True)
   os.makedirs(root / 'experiments' / args.experiment, exist_ok=True)
@@ -471,6 +785,7 @@ def experiment_main():
   # Handle some changes to the command-line args
   experiment_cli_get_n()
   experiment_cli_get_reset()
+  experiment_cli_get_replay()
 
   # make sure the directory structure is OK
   experiment_check()
@@ -480,12 +795,17 @@ def experiment_main():
   # then backfill the actual data
   # fill in the experiment template
 
-  # Remove the "info" directory if it exists
+  # a replay or the hints make the html over from scratch; a run leaves it be,
+  # since other runs of the experiment may be publishing to it right now, and
+  # its html and viewer are refreshed in place as quizzes finish
   target_dir = Path(args.dir) / "html" / args.experiment
-  if target_dir.exists() and target_dir.is_dir():
+  if (args.replay or args.from_hints) and target_dir.is_dir():
     shutil.rmtree(target_dir)
 
-  if args.from_hints:
+  if args.replay:
+    # everything from what was saved last time
+    experiment_replay()
+  elif args.from_hints:
     # create the results from the hints
     meta['start'] = time.time()
     experiment_from_hints()
@@ -494,33 +814,25 @@ def experiment_main():
       json.dump(meta, f, indent=4)
     # note this goes AFTER for from_hints
     experiment_html(Path(args.dir) / 'experiments' / args.experiment)
+    experiment_publish()
   else:
-    # note this goes BEFORE for not from_hints
+    # publishes the html as quizzes finish
     experiment_run()
-    experiment_html(Path(args.dir) / 'experiments' / args.experiment)
+
+def experiment_publish():
+  """Put the experiment's data.csv in its html, and bring the project report up to date"""
+  args = cli_get_args()
+  target_dir = Path(args.dir) / "html" / args.experiment
+
   # make sure we copy the data.csv file into info
   shutil.copy(
     Path(args.dir) / "experiments" / args.experiment / 'data.csv',
     target_dir / 'data.csv',
   )
 
-  # make html/data.json
-  # Temporary dictionary to hold all our data
+  # update this experiment's part of the project report (html/data.js and html/shards)
   path_html = Path(args.dir) / "html"
-  dict_data = {}
-
-  # Traverse all directories under `path_html`
-  for root, dirs, files in os.walk(path_html):
-    for file in files:
-      # Process all `data.json` files
-      if file == 'data.json':
-        name = os.path.basename(root)  # Get the name of the base directory
-        with open(os.path.join(root, file), 'r') as f:
-          dict_data[name] = json.load(f)
-
-  # Write dictionary to `data.js` file
-  with open(path_html / 'data.js', 'w') as f:
-    f.write('document.quizzinator.data = ' + json.dumps(dict_data, indent=4) + ';')
+  experiment_report(path_html, args.experiment)
 
   # write the js, html, and css files
   src_dir = Path(__file__).parent / "templates" / "project"
@@ -0,0 +1,171 @@
+import argparse, atexit, fcntl, hashlib, json, os, queue, threading, time
+from collections import Counter
+from pathlib import Path
+
+from .logging import logger
+from .cli import cli_log_args, cli_set_args, cli_get_args
+
+class FailureLog:
+  """
+  The replies the answer rules could not make sense of, for a project in
+  <dir>/failures: one compact JSON line per failure in failures.jsonl, and
+  each distinct prompt - which starts with the whole setup text - once, in
+  prompts/<hash>.txt, where the lines point to it.
+
+  record() only queues the failure; a single writer thread appends what has
+  queued up in one write, holding a lock on the file so that other runs
+  sharing the project don't interleave with it. Whatever is still queued is
+  written when the process exits.
+  """
+  def __init__(self, path: Path | str):
+    self.path = Path(path)
+    (self.path / 'prompts').mkdir(parents=True, exist_ok=True)
+    self._queue = queue.Queue()
+    self._seen = set()
+    self._thread = threading.Thread(target=self._work, name='failures', daemon=True)
+    self._thread.start()
+
+  def record(self, question: str | None, mode: str, prompt: str, text: str, signature: list[str]) -> None:
+    args = cli_get_args()
+    self._queue.put(({
+      'time': time.time(),
+      'experiment': getattr(args, 'experiment', None),
+      'question': question,
+      'mode': mode,
+      'prompt': prompt_hash(prompt),
+      'signature': signature,
+      'text': text,
+    }, prompt))
+
+  def _work(self) -> None:
+    while True:
+      batch = [self._queue.get()]
+      while len(batch) < 256:
+        try:
+          batch.append(self._queue.get_nowait())
+        except queue.Empty:
+          break
+      done = None in batch
+      records = [item for item in batch if item is not None]
+      try:
+        if records: self._write(records)
+      except OSError as e:
+        logger.warning(f"Could not record {len(records):,} failed answers: {e}")
+      for _ in batch: self._queue.task_done()
+      if done: return
+
+  def _write(self, records: list[tuple[dict, str]]) -> None:
+    for record, prompt in records:
+      if record['prompt'] in self._seen: continue
+      self._seen.add(record['prompt'])
+      path = self.path / 'prompts' / f"{record['prompt']}.txt"
+      if path.exists(): continue
+      tmp = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+      tmp.write_text(prompt, encoding='utf-8')
+      os.replace(tmp, path)
+    data = ''.join(json.dumps(record, ensure_ascii=False) + '\n' for record, _ in records)
+    with open(self.path / 'failures.jsonl', 'a', encoding='utf-8') as f:
+      fcntl.flock(f, fcntl.LOCK_EX)
+      try:
+        f.write(data)
+        f.flush()
+      finally:
+        fcntl.flock(f, fcntl.LOCK_UN)
+
+  def flush(self) -> None:
+    """Wait until everything recorded so far is written"""
+    self._queue.join()
+
+  def close(self) -> None:
+    if not self._thread.is_alive(): return
+    self._queue.put(None)
+    self._thread.join()
+
+def prompt_hash(prompt: str) -> str:
+  return hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:16]
+
+# one log per project directory, made the first time a failure comes up
+_logs: dict[Path, FailureLog] = {}
+_logs_lock = threading.Lock()
+
+def failures_log() -> FailureLog:
+  args = cli_get_args()
+  path = Path(args.dir) / 'failures'
+  with _logs_lock:
+    if path not in _logs:
+      _logs[path] = FailureLog(path)
+      atexit.register(_logs[path].close)
+    return _logs[path]
+
+def failures_cli_args():
+  p = argparse.ArgumentParser(
+    prog="failures",
+    description="Report the answers that could not be extracted, grouped by question, mode and the rules that came close"
+  )
+  p.add_argument(
+    "dir",
+    help="Path to survey directory"
+  )
+  p.add_argument(
+    "--experiment",
+    type=str,
+    default="",
+    help="Only report these experiments, separated by commas [def = all of them]"
+  )
+  p.add_argument(
+    "--top",
+    type=int,
+    default=20,
+    help="How many of the largest groups to report"
+  )
+  p.add_argument(
+    "--examples",
+    type=int,
+    default=1,
+    help="How many replies of each group to show"
+  )
+  return p.parse_args()
+
+def failures_load(path: Path, experiments: list[str] = ()) -> list[dict]:
+  """The failures recorded in a project's failures.jsonl, optionally just for some experiments"""
+  path = Path(path) / 'failures' / 'failures.jsonl'
+  if not path.exists(): return []
+  failures = []
+  with open(path, encoding='utf-8') as f:
+    for line in f:
+      # a run that died mid-write leaves half a line
+      try:
+        record = json.loads(line)
+      except ValueError:
+        continue
+      if experiments and record.get('experiment') not in experiments: continue
+      failures.append(record)
+  return failures
+
+def failures_clusters(failures: list[dict]) -> list[tuple[tuple, list[dict]]]:
+  """The failures grouped by (question, mode, signature), largest group first"""
+  groups = {}
+  for record in failures:
+    key = (record.get('question'), record['mode'], ','.join(record['signature']) or 'none')
+    groups.setdefault(key, []).append(record)
+  return sorted(groups.items(), key=lambda g: (-len(g[1]), str(g[0])))
+
+def failures_main():
+  args = failures_cli_args()
+  args.experiment = [e for e in args.experiment.split(',') if e]
+  cli_set_args(args)
+  cli_log_args(args)
+
+  failures = failures_load(args.dir, args.experiment)
+  if not failures:
+    logger.info(f"No failed answers recorded under {args.dir}")
+    return
+  clusters = failures_clusters(failures)
+  prompts = Counter(record['prompt'] for record in failures)
+  logger.info(f"{len(failures):,} failed answers in {len(clusters):,} groups, to {len(prompts):,} distinct prompts")
+  for (question, mode, signature), records in clusters[:args.top]:
+    with logger.section(f"{len(records):>6,} x {question or '?'} ({mode}) rules {signature}"):
+      for record in records[-args.examples:]:
+        text = record['text'].strip().replace('\n', ' | ').replace('[', '(')
+        logger.info(f"{text[-200:]}")
+        logger.info(f"prompt: failures/prompts/{record['prompt']}.txt")
@@ -0,0 +1,108 @@
+"""
+A stand-in for `ollama run <model>` used by the tests and benchmarks.
+
+It puts its terminal in raw mode the way ollama does, shows the '>>> '
+prompt, understands '/set' commands and \"\"\"-quoted multi-line prompts,
+and answers every prompt with a canned '<think>...</think> answer' reply
+(wrapped in the same spinner and escape-sequence noise the real thing makes).
+A ^C while it is replying cuts the reply short, as it does in ollama; one
+at the idle prompt drops what was typed so far and gets a hint and another
+prompt.
+
+  python -m quizzinator.fake_ollama --think 20000 --answer 'Answer: 3'
+"""
+import argparse
+import os
+import select
+import sys
+import time
+import tty
+
+PROMPT = b'>>> '
+IDLE_INTERRUPT = b'\nUse Ctrl + d or /bye to exit.\n'
+SPINNER = '⠋⠙⠹⠸'
+
+def fake_ollama_args():
+  p = argparse.ArgumentParser(prog="fake_ollama", description="Pretend to be `ollama run`")
+  p.add_argument("model", nargs="?", default="fake", help="Ignored, like the model name")
+  p.add_argument("--think", type=int, default=200, help="How many characters of reasoning to emit")
+  p.add_argument("--answer", default="Answer: 1", help="The answer given after the reasoning")
+  p.add_argument("--loop", action="store_true", help="Reason by saying the same thing over and over")
+  p.add_argument("--ramble", type=int, default=0, help="How many characters of chatter to emit after the answer")
+  p.add_argument("--chunk", type=int, default=64, help="Emit the reply in pieces of this many characters")
+  p.add_argument("--delay", type=float, default=0.0, help="Seconds to wait between pieces, and before answering a ^C at the prompt")
+  return p.parse_args()
+
+def fake_ollama_reply(args) -> str:
+  noise = ''.join(f'{c}\x1b[K\x1b[D' for c in SPINNER) + '\x1b[?25h'
+  if args.loop:
+    think = ('The user wants an answer. ' * (args.think // 26 + 1))[:args.think]
+  else:
+    think = ''.join(f'Thought {i} is new. ' for i in range(args.think // 14 + 1))[:args.think]
+  ramble = ('And that is my final answer. ' * (args.ramble // 29 + 1))[:args.ramble]
+  if ramble: ramble = '\n' + ramble
+  return f"{noise}<think>\n{think}\n</think>\n\n{args.answer}{ramble}\n\n"
+
+def fake_ollama_write(data: bytes) -> None:
+  while data:
+    data = data[os.write(1, data):]
+
+def fake_ollama_messages(buffer: bytes):
+  """Split complete messages off the front of buffer, returning (messages, rest)"""
+  messages = []
+  while True:
+    if buffer.startswith(b'"""'):
+      end = buffer.find(b'"""\n', 3)
+      if end < 0: break
+      messages.append(buffer[3:end])
+      buffer = buffer[end + 4:]
+    else:
+      end = buffer.find(b'\n')
+      if end < 0: break
+      messages.append(buffer[:end])
+      buffer = buffer[end + 1:]
+  return messages, buffer
+
+def fake_ollama_interrupt() -> bytes | None:
+  """
+  Anything typed while we were replying: None if nothing, b'' for a ^C (which
+  is swallowed), otherwise the bytes, to be read as the next message.
+  """
+  readable, _, _ = select.select([0], [], [], 0)
+  if not readable: return None
+  data = os.read(0, 65536)
+  if data.startswith(b'\x03'):
+    fake_ollama_write(b'\n\n')
+    return b''
+  return data
+
+def fake_ollama_main():
+  args = fake_ollama_args()
+  reply = fake_ollama_reply(args).encode('utf-8')
+  if os.isatty(0): tty.setraw(0)
+
+  fake_ollama_write(PROMPT)
+  buffer = b''
+  while True:
+    data = os.read(0, 65536)
+    if not data: return
+    buffer += data
+    while b'\x03' in buffer:
+      buffer = buffer[buffer.index(b'\x03') + 1:]
+      if args.delay: time.sleep(args.delay)
+      fake_ollama_write(IDLE_INTERRUPT + PROMPT)
+    messages, buffer = fake_ollama_messages(buffer)
+    for message in messages:
+      if message.startswith(b'/bye'): return
+      if not message.startswith(b'/'):
+        for i in range(0, len(reply), args.chunk):
+          fake_ollama_write(reply[i:i + args.chunk])
+          if args.delay: time.sleep(args.delay)
+          typed = fake_ollama_interrupt()
+          if typed is None: continue
+          buffer += typed
+          if not typed: break
+      fake_ollama_write(PROMPT)
+
+if __name__ == "__main__":
+  fake_ollama_main()
@@ -0,0 +1,70 @@
+import os
+import socket
+import threading
+import time
+import uuid
+
+from .logging import logger
+from .store import ExperimentStore
+
+class Ledger:
+  """
+  Who is quizzing which respondent, so several runs - on one machine or on
+  several sharing the project directory - can work through one experiment
+  together without redoing each other's respondents.
+
+  A worker leases a respondent before quizzing it (acquire) and the lease is
+  given up when the respondent is saved, which only succeeds while the lease
+  is still held: a respondent is recorded once, by whoever finished it. A
+  heartbeat thread renews this run's leases every ttl/3 seconds, so a lease
+  only runs out when its run has crashed or lost touch with the project; the
+  next run to want that respondent then takes it over, and carries on from
+  its checkpoint log.
+
+  With redo (--reset), respondents saved before this ledger was made are
+  quizzed again, but not those another run has saved since; and each
+  respondent's checkpoint log is dropped as it is leased, so it starts from
+  scratch - never one that another run is still writing to.
+  """
+  def __init__(self, store: ExperimentStore, ttl: float = 120, redo: bool = False):
+    self.store = store
+    self.ttl = ttl
+    self.owner = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+    self.since = time.time() if redo else None
+    self._stop = threading.Event()
+    self._thread = None
+
+  def acquire(self, index: int) -> bool:
+    """Lease a respondent for this run; False if it is done or someone else has it"""
+    if not self.store.lease(index, self.owner, self.ttl, self.since): return False
+    if self.since is not None: self.store.log_clear(index)
+    return True
+
+  def release(self, index: int) -> None:
+    """Give a respondent back without saving it, e.g. because quizzing it failed"""
+    self.store.release(index, self.owner)
+
+  def start(self) -> None:
+    self._stop.clear()
+    self._thread = threading.Thread(target=self._heartbeat, name='ledger', daemon=True)
+    self._thread.start()
+
+  def stop(self) -> None:
+    self._stop.set()
+    if self._thread is not None: self._thread.join()
+    self._thread = None
+
+  def _heartbeat(self) -> None:
+    while not self._stop.wait(self.ttl / 3):
+      try:
+        self.store.renew(self.owner, self.ttl)
+      except Exception as e:
+        # a busy or briefly unreachable database; the next beat will try again
+        logger.warning(f"Could not renew the leases of {self.owner}: {e}")
+
+  def __enter__(self):
+    self.start()
+    return self
+
+  def __exit__(self, *exc):
+    self.stop()
@@ -1,7 +1,7 @@
 from datetime import datetime
 from contextlib import contextmanager
 from rich.console import Console
-import sys, time, inspect
+import sys, time, inspect, threading
 from typing import Optional
 
 from .utils import human_duration
@@ -24,6 +24,11 @@ class Progress:
         return self
 
     def step(self, message: str, level: str = "INFO"):
+        # steps may come in from several worker threads at once
+        with self.logger.lock:
+            self._step(message, level)
+
+    def _step(self, message: str, level: str):
         self.current += 1
         elapsed = time.time() - self.start
 
@@ -81,11 +86,26 @@ class Logger:
         # highlight=True  => let Rich colorize numbers/strings/booleans in the message
         # markup=True     => let [bold], [red] tags be honored
         self.console      = Console(highlight=True, markup=True)
-        self.indent_level = 0
         self.indent_step  = indent_step
         # default per-call markup
         self._use_markup  = True
 
+        # each thread keeps its own indent, starting from wherever the main
+        # thread was; the lock keeps the lines of concurrent messages together
+        self.lock          = threading.RLock()
+        self._local        = threading.local()
+        self._indent_main  = 0
+
+    @property
+    def indent_level(self) -> int:
+        return getattr(self._local, 'indent_level', self._indent_main)
+
+    @indent_level.setter
+    def indent_level(self, value: int):
+        self._local.indent_level = value
+        if threading.current_thread() is threading.main_thread():
+            self._indent_main = value
+
     def _format_parts(self, level: str, message: str):
         """
         Returns (prefix, msg) where prefix is timestamp│LEVEL│indent
@@ -108,12 +128,13 @@ class Logger:
         markup=False => disable all [tags] on this call
         """
         use_markup = self._use_markup if markup is None else markup
-        for line in str(message).splitlines() or [""]:
-            prefix, msg = self._format_parts(level, line)
-            # print prefix as plain text (no highlight, but still allow our [LEVEL] tags)
-            self.console.print(prefix, end="", highlight=False, markup=True)
-            # print msg with highlight and per-call markup setting
-            self.console.print(msg,    highlight=True,  markup=use_markup)
+        with self.lock:
+            for line in str(message).splitlines() or [""]:
+                prefix, msg = self._format_parts(level, line)
+                # print prefix as plain text (no highlight, but still allow our [LEVEL] tags)
+                self.console.print(prefix, end="", highlight=False, markup=True)
+                # print msg with highlight and per-call markup setting
+                self.console.print(msg,    highlight=True,  markup=use_markup)
 
     def debug(self,   message: str, *, markup: Optional[bool] = None):
         self.log("DEBUG",   message, markup=markup)
@@ -0,0 +1,209 @@
+import argparse, hashlib, json, os, shutil, tarfile, tempfile, zipfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from .logging import logger
+from .cli import cli_log_args, cli_set_args, cli_get_args
+from .questions import load_hints
+from .store import ExperimentStore, store_copy, export_viewer
+from .results import ResultsTable, results_csv
+from .experiment import experiment_questions, experiment_html, experiment_publish
+
+# meta data that has to agree between the experiments being merged
+MERGE_MUST_AGREE = ('model', 'hints', 'questions')
+
+# meta data about one particular run, which means nothing for the merged experiment
+MERGE_RUN_ONLY = ('pool', 'response_cache')
+
+def merge_cli_args():
+  p = argparse.ArgumentParser(
+    prog="merge",
+    description="Merge the respondents of several runs of an experiment into one experiment"
+  )
+  p.add_argument(
+    "dir",
+    help="Path to survey directory"
+  )
+  p.add_argument(
+    "sources",
+    nargs="+",
+    help="Experiment directories (experiments/<name>), or zip or tar archives of them, to merge"
+  )
+  p.add_argument(
+    "--experiment",
+    type=str,
+    default="merged",
+    help="The name of the experiment to create"
+  )
+  p.add_argument(
+    "--workers",
+    type=int,
+    default=8,
+    help="How many files to read and write at the same time"
+  )
+  p.add_argument(
+    '-r', '--reset',
+    action='store_true',
+    help='If set, replace the experiment if it already exists'
+  )
+  return p.parse_args()
+
+def merge_unpack(path: Path, path_tmp: Path) -> Path:
+  """A source as a directory, unpacking it first if it is an archive"""
+  if path.is_dir(): return path
+  target = path_tmp / hashlib.sha256(str(path.resolve()).encode('utf-8')).hexdigest()[:16]
+  if zipfile.is_zipfile(path):
+    with zipfile.ZipFile(path) as z: z.extractall(target)
+  elif tarfile.is_tarfile(path):
+    with tarfile.open(path) as t: t.extractall(target, filter='data')
+  else:
+    logger.critical(f"Not an experiment directory or an archive: {path}")
+  return target
+
+def merge_find(path: Path) -> list[Path]:
+  """The experiment directories at or under path: those with a store or old-style quizzes"""
+  if (path / 'experiment.sqlite').exists() or (path / 'quizzes').is_dir(): return [path]
+  found = {p.parent for p in path.rglob('experiment.sqlite')} | {p.parent for p in path.rglob('quizzes') if p.is_dir()}
+  return sorted(found)
+
+def merge_open(path: Path, path_tmp: Path) -> ExperimentStore:
+  """
+  A scratch copy of a source experiment's store, in path_tmp; old-style
+  quizzes are imported into it. The sources are only ever read: opening one
+  as a store would change its journal mode, migrate it and make its
+  experiment.blob, which fails on a read-only source and changes any other.
+  """
+  path_copy = path_tmp / f"{hashlib.sha256(str(path).encode('utf-8')).hexdigest()[:16]}.sqlite"
+  if (path / 'experiment.sqlite').exists(): return store_copy(path / 'experiment.sqlite', path_copy)
+  store = ExperimentStore(path_copy)
+  store.import_legacy(path / 'quizzes')
+  return store
+
+def merge_meta(paths: list[Path]) -> dict:
+  """The meta data the sources share; they have to be runs of the same experiment"""
+  merged = {}
+  for path in paths:
+    path_meta = path / 'meta.json'
+    if not path_meta.exists(): continue
+    with open(path_meta, 'r') as f:
+      meta = json.load(f)
+    for key in MERGE_MUST_AGREE:
+      if key in merged and key in meta and merged[key] != meta[key]:
+        logger.critical(f"{path} has a different {key} to the experiments before it: {meta[key]} vs {merged[key]}")
+    for key, value in meta.items(): merged.setdefault(key, value)
+  for key in MERGE_RUN_ONLY + ('start', 'end'): merged.pop(key, None)
+  return merged
+
+def merge_hint_profiles(meta: dict) -> int:
+  """How many hint profiles respondents cycle through (respondent i gets profile i % that); 0 without hints"""
+  args = cli_get_args()
+  if not meta.get('hints'): return 0
+  hint_text, _ = load_hints(
+    os.path.join(args.dir, "hints.csv"),
+    os.path.join(args.dir, "questions.txt"),
+    columns=tuple(meta['hints'])
+  )
+  return len(hint_text)
+
+def merge_digest(history: list[dict]) -> str:
+  """What a respondent said and was told; the same respondent copied into two runs has the same digest"""
+  text = json.dumps([[h['role'], h['raw']] for h in history], ensure_ascii=False)
+  return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def merge_load(store: ExperimentStore, index: int) -> dict:
+  """Everything about one respondent, read in a worker thread"""
+  history = store.history(index)
+  meta = store.meta(index) or {}
+  return {
+    'index': meta.get('index', index),
+    'history': history,
+    'questions': store.questions(index),
+    'cache': store.cache(index),
+    'meta': meta,
+    'digest': merge_digest(history),
+  }
+
+def merge_respondents(stores: list[ExperimentStore], profiles: int):
+  """
+  Every distinct respondent of the sources, in order, with their new number.
+
+  Respondents are duplicates if they had the same hint profile and the same
+  dialog. The rest are renumbered so each keeps its hint profile: with P
+  profiles, those on profile h become h, h + P, h + 2P, ...
+  """
+  args = cli_get_args()
+  jobs = [(store, index) for store in stores for index in sorted(store.done())]
+  seen = set()
+  taken = {}
+  with ThreadPoolExecutor(max_workers=max(1, args.workers), thread_name_prefix='merge') as pool:
+    for respondent in pool.map(lambda job: merge_load(*job), jobs):
+      profile = respondent['index'] % profiles if profiles else 0
+      key = (profile, respondent['digest'])
+      if key in seen: continue
+      seen.add(key)
+      count = taken.get(profile, 0)
+      taken[profile] = count + 1
+      yield (profile + count * profiles if profiles else count), respondent
+
+def merge_run():
+  """Merge the sources into experiments/<experiment>, and rebuild its results and html"""
+  args = cli_get_args()
+  args.dir = Path(args.dir)
+  path_experiment = args.dir / 'experiments' / args.experiment
+  for source in args.sources:
+    if Path(source).resolve() == path_experiment.resolve():
+      logger.critical(f"Can't merge {source} into itself; pick another --experiment")
+  if path_experiment.exists():
+    if not args.reset:
+      logger.critical(f"{path_experiment} already exists; use --reset to replace it")
+    shutil.rmtree(path_experiment)
+
+  with tempfile.TemporaryDirectory(prefix='merge-') as tmp:
+    path_tmp = Path(tmp)
+    paths, origins = [], []
+    for source in args.sources:
+      root = merge_unpack(Path(source), path_tmp)
+      found = merge_find(root)
+      if not found: logger.critical(f"No experiment in {source}")
+      paths += found
+      origins += [str(Path(source) / path.relative_to(root)) for path in found]
+    logger.info(f"Merging {len(paths):,} experiments into {path_experiment}")
+
+    meta = merge_meta(paths)
+    args.questions = meta.get('questions', [])
+    stores = [merge_open(path, path_tmp) for path in paths]
+    merged = ExperimentStore(path_experiment / 'experiment.sqlite')
+    try:
+      total = 0
+      for index, respondent in merge_respondents(stores, merge_hint_profiles(meta)):
+        merged.save(index, respondent['history'], respondent['questions'], respondent['cache'], dict(respondent['meta'], index=index))
+        total += 1
+      found = sum(len(store.done()) for store in stores)
+      logger.info(f"Kept {total:,} of {found:,} respondents, dropping {found - total:,} duplicates")
+
+      # the meta data, results and csv as a run of this experiment would have left them
+      span = merged.span()
+      meta['start'] = span[0] if span else 'N/A'
+      meta['end'] = span[1] if span else 'N/A'
+      meta['merged_from'] = origins
+      with open(path_experiment / 'meta.json', 'w') as f:
+        json.dump(meta, f, indent=4)
+      results = ResultsTable(path_experiment, experiment_questions())
+      results_csv(results.compact(merged), path_experiment / 'data.csv')
+
+      # and the html
+      path_html = args.dir / 'html' / args.experiment
+      if path_html.exists(): shutil.rmtree(path_html)
+      export_viewer(path_html / 'dialog', merged, workers=args.workers)
+      experiment_html(path_experiment)
+      experiment_publish()
+    finally:
+      merged.close()
+      for store in stores: store.close()
+
+def merge_main():
+  args = merge_cli_args()
+  args.from_hints = False
+  cli_set_args(args)
+  cli_log_args(args)
+  merge_run()
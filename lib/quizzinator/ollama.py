@@ -5,21 +5,34 @@ import sys
 import time
 
 
-from .string import pythonify_string, remove_escape_sequences
+from .string import clean_text
 from .logging import logger
-from .utils import ngram_repeat
+from .utils import RepeatDetector, RepetitionError, repeat_limits
+from .pty_transport import PtyTransport
+from .stream import StreamParser, Reply
+
+# what the REPL says to a ^C that finds it idle at its prompt, before
+# showing the prompt again
+IDLE_INTERRUPT = 'Use Ctrl + d or /bye to exit.'
+
+# how long after a ^C to listen for that, before sending anything else
+INTERRUPT_GRACE = 0.2
 
 class Ollama:
-  def __init__(self, model: str = 'deepseek-r1:1.5b', timeout: float = 120.0):
+  def __init__(self, model: str = 'deepseek-r1:1.5b', timeout: float = 120.0, command: str | None = None):
     """
     model:    the ollama model name to run
     timeout:  how long (in seconds) to wait for each response
+    command:  what to run instead of `ollama run <model>` (used by tests and benchmarks)
     """
     self.model = model
     self.timeout = timeout
+    self.command = command or f"ollama run {self.model}"
 
     # Start the command-line process
     self.child: pexpect.spawn | None = None
+    self.transport: PtyTransport | None = None
+    self._interrupted = False
     self.spawn()
 
   def spawn(self) -> None:
@@ -28,7 +41,7 @@ class Ollama:
     if self.alive(): return
 
     #logger.info(f"Spawning '{self.model}'")
-    cmd = f"ollama run {self.model}"
+    cmd = self.command
     try:
       self.child = pexpect.spawn(cmd, encoding='utf-8', timeout=self.timeout, maxread=1000000)
       self.child.expect('>>> ')
@@ -45,6 +58,10 @@ class Ollama:
     self.child.sendline('/set nowordwrap')
     self.child.expect('>>> ')
 
+    # from here on we talk to the pty directly
+    self.transport = PtyTransport(self.child.child_fd)
+    self._interrupted = False
+
   def kill(self) -> None:
     """Make sure any child process is dead"""
     if self.alive():
@@ -56,6 +73,7 @@ class Ollama:
           raise Exception("Could not kill ollama after ")
         time.sleep(0.01)  # Check every 10 milliseconds
       self.child = None
+      self.transport = None
 
   def alive(self) -> bool:
     if self.child and self.child.isalive(): return True
@@ -66,106 +84,128 @@ class Ollama:
     self.kill()
     self.spawn()
 
+  def reset(self) -> None:
+    """Forget the conversation but keep the model loaded (see SessionPool)"""
+    self._push('/clear')
+    self._pull()
+
+  def configure(self, options: dict) -> None:
+    """Set sampling options, like the seed, for the rest of the conversation"""
+    for name, value in options.items():
+      self._push(f'/set parameter {name} {value}')
+      self._pull()
+
   def _push(self, prompt):
+    if self._interrupted: self._settle()
     if not prompt.endswith("\n"): prompt += "\n"
-    chunk_size = 64
-    for i in range(0, len(prompt), chunk_size):
-      part = prompt[i:i + chunk_size]
-      self.child.send(part)
-      # Immediately drain any output so the pty master buffer frees up
+    # anything the REPL says while we type (continuation prompts, etc.) is noise
+    try:
+      self.transport.write(prompt, self.timeout)
+    except EOFError:
+      self.kill()
+      raise TimeoutError("Failed on push - ollama exited")
+
+  def _interrupt(self) -> None:
+    """^C the generation; _settle then makes sure the ^C didn't come too late"""
+    self.transport.write('\x03', self.timeout)
+    self._interrupted = True
+
+  def _settle(self) -> None:
+    """
+    A ^C that reached the REPL only after the reply was over finds it idle,
+    and gets a hint and another prompt - which would be taken for the end of
+    the next reply. Listen briefly for that, and skip past it.
+    """
+    self._interrupted = False
+    seen = ''
+    deadline = time.time() + INTERRUPT_GRACE
+    while True:
+      i = seen.find(IDLE_INTERRUPT)
+      if i >= 0:
+        if '>>> ' in seen[i:]: return
+        deadline = max(deadline, time.time() + self.timeout)
+      wait = deadline - time.time()
+      if wait <= 0: return
       try:
-        # maxread is by default ~2000 bytes, so this will
-        # gobble up all waiting data without blocking.
-        self.child.read_nonblocking(size=self.child.maxread, timeout=100)
-      except pexpect.exceptions.TIMEOUT:
-        pass
-      time.sleep(0.01)
-
-  def _pull(self):
-    buffer = ""
-    start = time.time()
+        seen += self.transport.read(wait)
+      except EOFError:
+        # the next push finds out
+        return
+
+  def _pull(self, parser: StreamParser | None = None) -> Reply:
+    """Read the response as it streams in, until the REPL shows its prompt again"""
+    parser = parser or StreamParser()
+    interrupted = False
     last_size = 0
-    last_time = start_time = time.time()
+    last_time = start_time = start = time.time()
     while True:
+      # sleep until there is output, or until it is time to check on progress
+      now = time.time()
+      wait = min(last_time + self.timeout, start + self.timeout * 3) - now
+      try:
+        chunk = self.transport.read(wait)
+      except EOFError:
+        self.kill()
+        raise TimeoutError("Failed on pull - ollama exited")
+
+      # if you see your prompt marker, we are done for now
       try:
-        chunk = self.child.read_nonblocking(size=1024, timeout=0.1)
-        buffer += chunk
-        if '<think>' in buffer:
-          buffer = '<think>' + buffer.split('<think>')[1]
-        if (time.time() - last_time > self.timeout):
-          logger.info(f"delay in reading response; now up to {len(buffer):,} characters after {int(time.time() - start_time):,} seconds")
-
-          # if we've stalled for the timeout AND there is no new data, then we should just bail out
-          if len(buffer) == last_size:
-            logger.error("No response after timeout period")
-            self.kill()
-            raise TimeoutError("Timed out on pull - no response after timeout")
-
-          # it might still be very repetitious
-          repeat, count = ngram_repeat(self._clean(buffer), L=30, K=2)
-          if count > 3:
-            logger.warning(f"{count:,} repetitions of string [red]'{repeat.replace('\n', '-')}[/red]")
-            raise TimeoutError("Timed out on pull - LLM repetitiously")
-            # TODO: should save buffer for a post-mortem
-
-          last_size = len(buffer)
-          last_time = time.time()
-
-        # if you see your prompt marker in buffer, we are done for now
-        if ">>> " in buffer: break
-      except pexpect.exceptions.TIMEOUT:
-        pass
+        if parser.feed(chunk): break
+      except RepetitionError as e:
+        logger.warning(f"{e.count:,} repetitions of string [red]'{e.repeat.replace('\n', '-')}'[/red]")
+        self.kill()
+        raise
+
+      # we already have the answer and the model is still going, so ^C the rest
+      if parser.truncated and not interrupted:
+        self._interrupt()
+        interrupted = True
+
+      if (time.time() - last_time > self.timeout):
+        logger.info(f"delay in reading response; now up to {parser.size:,} characters after {int(time.time() - start_time):,} seconds")
+
+        # if we've stalled for the timeout AND there is no new data, then we should just bail out
+        if parser.size == last_size:
+          logger.error("No response after timeout period")
+          self.kill()
+          raise TimeoutError("Timed out on pull - no response after timeout")
+
+        last_size = parser.size
+        last_time = time.time()
+
       # safety net - if the LLM keeps talking forever, we should just bail on it
       if time.time() - start > self.timeout * 3:
         logger.error("Response is taking too long")
-        #print(buffer)
         self.kill()
         raise TimeoutError("Timed out on pull -LLM talked forever")
-    #logger.info(f"got response after {int(time.time() - start_time):,} secs")
-    # strip off everything *after* the last prompt, so buffer.before…
-    return buffer.split(">>> ")[0]
+    return parser.result()
 
   @classmethod
   def _clean(cls, response: str) -> str:
     # there is a LOT of crap in this feed!
-
-    # remove all the terrible terminal escape sequences
-    response = remove_escape_sequences(response)
-
-    # unicode quotes
-    response = response.replace("\u0022", '"')
-    response = response.replace("\u0027", "'")
-    response = response.replace("\u201C", '"')
-    response = response.replace("\u201D", '"')
-    response = response.replace("\u2018", "'")
-    response = response.replace("\u2019", "'")
-
-    # fix m-dash and unicode quotes
-    response = response.replace('\u2014', '-')
-    response = response.replace('\u2013', '-')
-
-    # fix brail progress indicators
-    response = ''.join(c for c in response if not 0x2800 <= ord(c) <= 0x28ff)
-
-    # the funny newline stuff
-    response = response.replace('\r\n', '\n')
-
-    # make sure any strange unicode and white space ASCII is made visible
-    response = pythonify_string(response.strip())
+    response = clean_text(response).strip()
 
     # there is a bunch of leading crap that usually gets erased by the terminal escape sequences
     if '<think>' in response:
       response = '<think>' + response.split('<think>')[1]
 
     return response
+
   def query(self, prompt: str) -> str:
     """
-    Safely send even huge prompts by breaking them into small byte chunks.
+    Send a prompt (multi-line ones wrapped in triple quotes) and read the reply.
+
+    The transport drains output while it writes, which is what keeps huge
+    prompts from hanging on a full pty buffer.
+    """
+    return self.chat(prompt).raw
+
+  def chat(self, prompt: str, stop=None) -> Reply:
+    """
+    Like query, but returns the response already split into think and content.
 
-    Not doing this causes mysterious hangs and vast amounts of debugging :(
+    stop - optional test of the answer so far; once it passes, the rest of the generation is cancelled
     """
     if '\n' in prompt: prompt = '"""' + prompt + '"""'
     self._push(prompt)
-    response = self._pull()
-    response = self._clean(response)
-    return response
\ No newline at end of file
+    return self._pull(StreamParser(stop=stop, repeats=RepeatDetector(*repeat_limits(self.model))))
\ No newline at end of file
@@ -0,0 +1,253 @@
+import os
+import time
+
+from functools import lru_cache
+
+import httpx
+import ollama
+
+from .logging import logger
+from .stream import StreamParser, Reply
+from .utils import RepeatDetector, RepetitionError, repeat_limits
+
+@lru_cache(maxsize=None)
+def model_digest(model: str, host: str | None = None) -> str:
+  """
+  The digest of the model as the ollama server has it, so that a model that
+  has been pulled again counts as a different model. Falls back to the name
+  if the server cannot tell us.
+  """
+  host = host or os.environ.get('OLLAMA_HOST') or 'http://127.0.0.1:11434'
+  name = model.lower() if ':' in model else f'{model.lower()}:latest'
+  try:
+    for m in ollama.Client(host=host, timeout=5).list().models:
+      if (m.model or '').lower() == name: return m.digest or model
+  except (httpx.HTTPError, ollama.ResponseError, ConnectionError) as e:
+    logger.warning(f"Could not get the digest of {model} from ollama: {e}")
+  return model
+
+class OllamaHttp:
+  """
+  Talk to a running ollama server through its /api/chat endpoint.
+
+  This is a drop-in replacement for the pty-driven Ollama class: same
+  spawn/kill/alive/restart/query surface, and query() returns the same raw
+  '<think>...</think> answer' text that Dialog.think_and_response splits.
+  The server is stateless, so the conversation is kept here in self.messages.
+  """
+  def __init__(self, model: str = 'deepseek-r1:1.5b', timeout: float = 120.0, host: str | None = None):
+    """
+    model:    the ollama model name to run
+    timeout:  how long (in seconds) to wait for each chunk of the response
+    host:     url of the ollama server [def = $OLLAMA_HOST or http://127.0.0.1:11434]
+    """
+    self.model = model
+    self.timeout = timeout
+    self.host = host or os.environ.get('OLLAMA_HOST') or 'http://127.0.0.1:11434'
+
+    # the conversation so far, as the chat api wants it
+    self.messages: list[dict[str, str]] = []
+
+    # sampling options (seed, temperature, ...) sent with every request
+    self.options: dict = {}
+
+    # one client per session so the connection is kept alive between turns
+    self.client: ollama.Client | None = None
+    self.spawn()
+
+  def spawn(self) -> None:
+    """Open the (keep-alive) connection to the ollama server."""
+    if self.alive(): return
+    self.client = ollama.Client(host=self.host, timeout=self.timeout)
+
+  def kill(self) -> None:
+    """Drop the connection and forget the conversation."""
+    if self.client is not None:
+      self.client.close()
+    self.client = None
+    self.messages = []
+
+  def alive(self) -> bool:
+    return self.client is not None
+
+  def restart(self) -> None:
+    """Drop the connection, clear history, and reconnect."""
+    self.kill()
+    self.spawn()
+
+  def reset(self) -> None:
+    """Forget the conversation but keep the connection (see SessionPool)"""
+    self.messages = []
+    self.options = {}
+
+  def configure(self, options: dict) -> None:
+    """Set sampling options, like the seed, for the rest of the conversation"""
+    self.options.update(options)
+
+  def prime(self, messages: list[dict[str, str]]) -> None:
+    """Continue from turns that happened elsewhere (the response store, the turn log)"""
+    self.messages.extend(messages)
+
+  def _stream(self, format: dict | None = None):
+    """Yield (thinking, content) deltas from the server as they arrive."""
+    try:
+      for part in self.client.chat(
+          model=self.model,
+          messages=self.messages,
+          stream=True,
+          keep_alive=-1,
+          options=self.options or None,
+          format=format,
+      ):
+        yield part.message.thinking or '', part.message.content or ''
+    except (httpx.HTTPError, ollama.ResponseError, ConnectionError) as e:
+      logger.error(f"ollama server error: {e}")
+      self.kill()
+      raise TimeoutError(f"Failed on pull - {e}")
+
+  def _feed(self, parser: StreamParser, think: str, content: str) -> None:
+    """
+    Put reasoning the server hands back separately inline, the way the REPL
+    prints it, so the rest of quizzinator (and the caches) cannot tell which
+    backend produced a response.
+    """
+    if think:
+      if not self._thinking: parser.feed('<think>\n')
+      self._thinking = True
+      parser.feed(think)
+    if content:
+      if self._thinking: parser.feed('\n</think>\n\n')
+      self._thinking = False
+      parser.feed(content)
+
+  def _finish(self, parser: StreamParser) -> Reply:
+    if self._thinking: parser.feed('\n</think>\n\n')
+    self._thinking = False
+    return parser.finish()
+
+  def _pull(self, stop=None, format: dict | None = None) -> tuple[Reply, str]:
+    """The parsed reply, and the content as the server sent it (for the history)"""
+    parser = StreamParser(prompt=None, stop=stop, repeats=RepeatDetector(*repeat_limits(self.model)))
+    self._thinking = False
+    content = []
+    start = time.time()
+    stream = self._stream(format)
+    try:
+      for t, c in stream:
+        self._feed(parser, t, c)
+        content.append(c)
+        # we already have the answer; leaving the stream aborts the generation
+        if parser.truncated: break
+        # safety net - if the LLM keeps talking forever, we should just bail on it
+        if time.time() - start > self.timeout * 3:
+          logger.error("Response is taking too long")
+          self.kill()
+          raise TimeoutError("Timed out on pull -LLM talked forever")
+    except RepetitionError as e:
+      logger.warning(f"{e.count:,} repetitions of string [red]'{e.repeat.replace('\n', '-')}'[/red]")
+      self.kill()
+      raise
+    finally:
+      # closing the generator aborts the request if we bailed out early
+      stream.close()
+    return self._finish(parser), ''.join(content)
+
+  def query(self, prompt: str) -> str:
+    """Send one user turn and return the raw response with any <think> section inline."""
+    return self.chat(prompt).raw
+
+  def chat(self, prompt: str, stop=None, format: dict | None = None) -> Reply:
+    """
+    Like query, but returns the response already split into think and content.
+
+    stop - optional test of the answer so far; once it passes, the rest of the generation is cancelled
+    format - optional JSON schema; the server only lets the model say what fits it
+    """
+    self.spawn()
+    self.messages.append({'role': 'user', 'content': prompt})
+    reply, content = self._pull(stop, format)
+    # a reply we cut short goes into the history only up to the answer
+    if reply.truncated: content = reply.content
+    self.messages.append({'role': 'assistant', 'content': content})
+    return reply
+
+class AsyncOllamaHttp(OllamaHttp):
+  """
+  The asyncio flavor of OllamaHttp, for the async quiz engine.
+
+  kill, restart and query are coroutines; everything else is shared.
+  """
+  def spawn(self) -> None:
+    """Open the (keep-alive) connection to the ollama server."""
+    if self.alive(): return
+    self.client = ollama.AsyncClient(host=self.host, timeout=self.timeout)
+
+  async def kill(self) -> None:
+    """Drop the connection and forget the conversation."""
+    client, self.client = self.client, None
+    self.messages = []
+    if client is not None:
+      await client.close()
+
+  async def restart(self) -> None:
+    """Drop the connection, clear history, and reconnect."""
+    await self.kill()
+    self.spawn()
+
+  async def _stream(self, format: dict | None = None):
+    """Yield (thinking, content) deltas from the server as they arrive."""
+    try:
+      async for part in await self.client.chat(
+          model=self.model,
+          messages=self.messages,
+          stream=True,
+          keep_alive=-1,
+          options=self.options or None,
+          format=format,
+      ):
+        yield part.message.thinking or '', part.message.content or ''
+    except (httpx.HTTPError, ollama.ResponseError, ConnectionError) as e:
+      logger.error(f"ollama server error: {e}")
+      await self.kill()
+      raise TimeoutError(f"Failed on pull - {e}")
+
+  async def _pull(self, stop=None, format: dict | None = None) -> tuple[Reply, str]:
+    """The parsed reply, and the content as the server sent it (for the history)"""
+    parser = StreamParser(prompt=None, stop=stop, repeats=RepeatDetector(*repeat_limits(self.model)))
+    self._thinking = False
+    content = []
+    start = time.time()
+    stream = self._stream(format)
+    try:
+      async for t, c in stream:
+        self._feed(parser, t, c)
+        content.append(c)
+        # we already have the answer; leaving the stream aborts the generation
+        if parser.truncated: break
+        # safety net - if the LLM keeps talking forever, we should just bail on it
+        if time.time() - start > self.timeout * 3:
+          logger.error("Response is taking too long")
+          await self.kill()
+          raise TimeoutError("Timed out on pull -LLM talked forever")
+    except RepetitionError as e:
+      logger.warning(f"{e.count:,} repetitions of string [red]'{e.repeat.replace('\n', '-')}'[/red]")
+      await self.kill()
+      raise
+    finally:
+      # closing the generator aborts the request if we bailed out early
+      await stream.aclose()
+    return self._finish(parser), ''.join(content)
+
+  async def query(self, prompt: str) -> str:
+    """Send one user turn and return the raw response with any <think> section inline."""
+    return (await self.chat(prompt)).raw
+
+  async def chat(self, prompt: str, stop=None, format: dict | None = None) -> Reply:
+    """Like query, but returns the response already split into think and content"""
+    self.spawn()
+    self.messages.append({'role': 'user', 'content': prompt})
+    reply, content = await self._pull(stop, format)
+    # a reply we cut short goes into the history only up to the answer
+    if reply.truncated: content = reply.content
+    self.messages.append({'role': 'assistant', 'content': content})
+    return reply
@@ -0,0 +1,108 @@
+import threading
+import time
+
+from .logging import logger
+
+class SessionPool:
+  """
+  Warm model sessions shared by one run's respondents.
+
+  Starting a session means spawning `ollama run`, waiting for the model to
+  load and configuring the REPL, which for big models takes far longer than a
+  short survey. The pool keeps up to size sessions alive: a dialog acquires
+  one, and releasing it clears the conversation (the reset doubles as a health
+  check) and puts it back for the next respondent. Sessions that died, or that
+  fail their reset, are dropped and replaced with fresh ones only when needed.
+
+  factory() must return a new, ready-to-use session (an Ollama or OllamaHttp).
+  """
+  def __init__(self, factory, size: int):
+    self.factory = factory
+    self.size = size
+    self._idle = []
+    self._lock = threading.Lock()
+
+    # what the pool has done so far, for the run meta data
+    self.spawns = 0
+    self.spawn_time = 0.0
+    self.resets = 0
+    self.reset_time = 0.0
+    self.failures = 0
+
+  def warm(self) -> None:
+    """Spawn sessions until size of them are waiting"""
+    while len(self._idle) < self.size:
+      session = self._spawn()
+      with self._lock: self._idle.append(session)
+
+  def _spawn(self):
+    t0 = time.time()
+    session = self.factory()
+    with self._lock:
+      self.spawns += 1
+      self.spawn_time += time.time() - t0
+    return session
+
+  def acquire(self):
+    """A healthy session, spawning a new one if none are waiting"""
+    with self._lock:
+      session = self._idle.pop() if self._idle else None
+    if session is not None and session.alive(): return session
+    return self._spawn()
+
+  def _reset(self, session) -> bool:
+    """Clear the conversation; False if the session is no longer usable"""
+    if not session.alive():
+      with self._lock: self.failures += 1
+      return False
+    t0 = time.time()
+    try:
+      session.reset()
+    except (TimeoutError, EOFError) as e:
+      logger.warning(f"Dropping a pooled session that failed to reset: {e}")
+      with self._lock: self.failures += 1
+      return False
+    with self._lock:
+      self.resets += 1
+      self.reset_time += time.time() - t0
+    return True
+
+  def _keep(self, session) -> bool:
+    """Put a reset session back; False if the pool is already full"""
+    with self._lock:
+      if len(self._idle) >= self.size: return False
+      self._idle.append(session)
+      return True
+
+  def release(self, session) -> None:
+    """Hand a session back once its respondent is done with it"""
+    if self._reset(session) and self._keep(session): return
+    session.kill()
+
+  def close(self) -> None:
+    """Kill every waiting session"""
+    with self._lock:
+      idle, self._idle = self._idle, []
+    for session in idle: session.kill()
+
+  def meta(self) -> dict:
+    """Spawn and reset counts and times, for the run meta data"""
+    return {
+      'size': self.size,
+      'spawns': self.spawns,
+      'spawn_time': self.spawn_time,
+      'resets': self.resets,
+      'reset_time': self.reset_time,
+      'failures': self.failures,
+    }
+
+class AsyncSessionPool(SessionPool):
+  """The same pool for the asyncio engine, whose sessions are killed with await"""
+  async def release(self, session) -> None:
+    if self._reset(session) and self._keep(session): return
+    await session.kill()
+
+  async def close(self) -> None:
+    with self._lock:
+      idle, self._idle = self._idle, []
+    for session in idle: await session.kill()
@@ -0,0 +1,67 @@
+import codecs
+import errno
+import os
+import select
+import time
+
+class PtyTransport:
+  """
+  Full-duplex reads and writes on the master side of a pty.
+
+  Everything waits in select() on the file descriptor, so writes go out as
+  fast as the other side takes them (the kernel's pty buffer is the flow
+  control) and reads wake up the moment output arrives - no fixed sleeps or
+  polling intervals anywhere.
+  """
+  def __init__(self, fd: int, encoding: str = 'utf-8'):
+    self.fd = fd
+    # output can split a multi-byte character across two reads
+    self._decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+    self._encoding = encoding
+
+  def _read(self, size: int = 65536) -> str:
+    """One read of whatever is waiting; raises EOFError if the other side is gone."""
+    try:
+      data = os.read(self.fd, size)
+    except OSError as e:
+      # linux reports a closed pty as EIO rather than an empty read
+      if e.errno != errno.EIO: raise
+      data = b''
+    if not data: raise EOFError("pty closed")
+    return self._decoder.decode(data)
+
+  def write(self, text: str, timeout: float) -> str:
+    """
+    Write all of text, draining output while we wait so neither side of the
+    pty can fill up and deadlock. Returns whatever output was drained.
+    """
+    pending = memoryview(text.encode(self._encoding))
+    drained = []
+    deadline = time.time() + timeout
+    # non-blocking so a write takes only what fits and we go back to draining
+    blocking = os.get_blocking(self.fd)
+    os.set_blocking(self.fd, False)
+    try:
+      while pending:
+        wait = deadline - time.time()
+        if wait <= 0: raise TimeoutError(f"Timed out on push - {len(pending):,} bytes unsent")
+        readable, writable, _ = select.select([self.fd], [self.fd], [], wait)
+        if readable:
+          try:
+            drained.append(self._read())
+          except BlockingIOError:
+            pass
+        if writable:
+          try:
+            pending = pending[os.write(self.fd, pending):]
+          except BlockingIOError:
+            pass
+    finally:
+      os.set_blocking(self.fd, blocking)
+    return ''.join(drained)
+
+  def read(self, timeout: float) -> str:
+    """Wait up to timeout seconds for output; returns '' if nothing arrived."""
+    readable, _, _ = select.select([self.fd], [], [], max(0.0, timeout))
+    if not readable: return ''
+    return self._read()
@@ -0,0 +1,80 @@
+import queue
+import threading
+import time
+
+from pathlib import Path
+
+from .logging import logger
+from .results import ResultsTable
+from .store import ExperimentStore, VIEWER_SHARD_SIZE, export_viewer
+
+class Publisher:
+  """
+  The background stage of a run: finished respondents are pushed to it as
+  they are saved, and it keeps the experiment's results and html current
+  while the model carries on with the next ones.
+
+  Each respondent is added to the results table and marks its shard of the
+  dialog viewer as out of date. At most every interval seconds - and once
+  more when the run is over - the out of date shards are rewritten and
+  refresh(table, **extra) is called with the results so far, to bring the
+  meta data, csv and report up to date. Nothing is rescanned: the table is
+  kept in memory, and only shards with new respondents are written.
+  """
+  def __init__(self, store: ExperimentStore, results: ResultsTable, path_viewer: Path, refresh, interval: float = 30, shard_size: int = VIEWER_SHARD_SIZE):
+    self.store = store
+    self.results = results
+    self.path_viewer = Path(path_viewer)
+    self.refresh = refresh
+    self.interval = interval
+    self.shard_size = shard_size
+    self._queue = queue.Queue()
+    self._thread = None
+    self._last = 0.0
+    # the first publish writes the viewer for respondents from earlier runs too
+    self._dirty = None
+
+  def start(self) -> None:
+    self._thread = threading.Thread(target=self._work, name='publisher', daemon=True)
+    self._thread.start()
+
+  def push(self, index: int, answers: dict, history: list[dict]) -> None:
+    """A respondent has been saved; called from the thread that saves them"""
+    self._queue.put((index, answers, history))
+
+  def _work(self) -> None:
+    while True:
+      try:
+        item = self._queue.get(timeout=max(0.1, self.interval))
+      except queue.Empty:
+        item = False
+      if item is None: return
+      if item:
+        index, answers, history = item
+        self.results.append(index, answers, history)
+        if self._dirty is not None: self._dirty.add(index // self.shard_size)
+      if time.time() - self._last >= self.interval and self._dirty != set():
+        try:
+          self.publish()
+        except Exception as e:
+          # the report will catch up next time, or when the run is over
+          logger.warning(f"Could not update the report: {e}")
+
+  def publish(self, table=None, **extra) -> None:
+    """Rewrite the out of date viewer shards, then refresh the rest"""
+    dirty, self._dirty = self._dirty, set()
+    export_viewer(self.path_viewer, self.store, self.shard_size, shards=dirty)
+    self.refresh(self.results.snapshot(self.store) if table is None else table, **extra)
+    self._last = time.time()
+
+  def stop(self) -> None:
+    """Take in what is still queued, and stop"""
+    if self._thread is None: return
+    self._queue.put(None)
+    self._thread.join()
+    self._thread = None
+
+  def close(self, **extra) -> None:
+    """Stop, fold the results into results.parquet and publish one last time"""
+    self.stop()
+    self.publish(self.results.compact(self.store), **extra)
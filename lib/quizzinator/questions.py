@@ -1,12 +1,13 @@
-import re, os, csv, copy
+import re, os, csv, copy, hashlib
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import List, Optional, Tuple
 from functools import lru_cache
 
 from .utils import pp
 from .logging import logger
 from .cli import cli_log_args, cli_set_args, cli_get_args
+from .answers import AnswerExtractor
 
 @dataclass
 class Option:
@@ -21,6 +22,8 @@ class Question:
     options: List[Option]
     multi: bool
     mode: str
+    # get_legal_answer for this question, compiled once by parse_questions
+    extractor: Optional[AnswerExtractor] = field(default=None, compare=False, repr=False)
 
 @lru_cache
 def parse_questions(path: str) -> List[Question]:
@@ -72,7 +75,8 @@ def parse_questions(path: str) -> List[Question]:
                                   prompt_text=prompt,
                                   options=opts,
                                   multi=multi,
-                                  mode=mode
+                                  mode=mode,
+                                  extractor=AnswerExtractor(mode, [o.code for o in opts])
                                   ))
     return questions
 
@@ -165,9 +169,10 @@ def build_question(question):
         lines.append(f"({opt.code}) {opt.text}\n")
     return lines
 
-def build_prompt(question, redo=False):
+def build_prompt(question, redo=False, structured=False):
     """
     Given a question and the setup text, build the full prompt string.
+    With structured, the model is also asked for JSON (see answer_schema).
     """
     lines = build_question(question)
     lines.append("\n\n")
@@ -212,6 +217,12 @@ def build_prompt(question, redo=False):
             "number you want to select."
         )
 
+    if structured and question.mode not in ('free', 'ignore'):
+        lines.append(
+            'Give your final answer as JSON, like {"answer": X}, '
+            'with X in the form asked for above.'
+        )
+
     if redo:
         lines.insert(
             0,
@@ -224,16 +235,17 @@ def build_prompt(question, redo=False):
         )
     return "\n".join(lines)
 
-def make_full_questions(
+def make_preamble(
     dir: str,
     hints: list[str],
     index: int,  # which quiz number we are on
     skip_identity: bool = False,
     skip_setup: bool = False
 ):
-    # locate files
-    qfile = os.path.join(dir, "questions.txt")
-
+    """
+    The context text that goes in front of the first question, and the hint
+    answers it was built from (None without hints).
+    """
     # get the hints and the answers
     hint_text, hint_answers = load_hints(
         os.path.join(dir, "hints.csv"),
@@ -265,8 +277,27 @@ def make_full_questions(
         prompt = open(os.path.join(dir, "setup", "consent.txt"), encoding="utf-8").read()
         q0.append(prompt)
 
+    return "\n".join(q0) + ("\n====================\n\n"), hint_answer
+
+def preamble_key(model: str, preamble: str) -> str:
+    """
+    Respondents with the same key start their conversation with exactly the
+    same text, so the model can reuse the work it did reading it.
+    """
+    return hashlib.sha256(f'{model}\n{preamble}'.encode('utf-8')).hexdigest()[:16]
+
+def make_full_questions(
+    dir: str,
+    hints: list[str],
+    index: int,  # which quiz number we are on
+    skip_identity: bool = False,
+    skip_setup: bool = False
+):
+    # locate files
+    qfile = os.path.join(dir, "questions.txt")
+
     # put the context inside the first question - this is an efficiency thing
-    q0 = "\n".join(q0) + ("\n====================\n\n")
+    q0, hint_answer = make_preamble(dir, hints, index, skip_identity, skip_setup)
     questions = copy.deepcopy(parse_questions(qfile))
     questions[0].prompt_text = q0 + questions[0].prompt_text
 
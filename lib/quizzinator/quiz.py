@@ -8,18 +8,19 @@ import shutil
 import platform
 import subprocess
 
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor
 
 from rich.console import Console
 
 from .ollama import Ollama
-from .utils import timestamp_str, pp
+from .utils import timestamp_str, pp, RepetitionError
 from .logging import logger
 from .questions import build_question, build_prompt, load_hints, load_hints, make_full_questions, Question
 from .dialog import Dialog
-from .answers import get_legal_answer
+from .store import ExperimentStore
+from .answers import answer_extractor, answer_ready, EARLY_STOP_MODES
 from .cli import cli_log_args, cli_set_args, cli_get_args
 
 def quiz_truncate(msg, max_len: int = 50) -> str:
@@ -36,9 +37,13 @@ def quiz_truncate(msg, max_len: int = 50) -> str:
     return truncated
 
 def quiz_answers(dialog: Dialog) -> dict:
+    return quiz_history_answers(dialog.history)
+
+def quiz_history_answers(history: list[dict]) -> dict:
+    """[{name: {name, number, answer, ok}}, how many turns were answered] for a dialog history"""
     questions = {}
     answers = 0
-    for q in dialog.history:
+    for q in history:
         name = q['answer']['name']
         questions[name] = questions.get(name, {
             'name': name,
@@ -51,69 +56,156 @@ def quiz_answers(dialog: Dialog) -> dict:
         answers += 1
     return [questions, answers]
 
-def quiz_save(path: Path, dialog: Dialog, meta: dict) -> None:
-
-    # the quiz dialog html
-    root = Path(__file__).resolve().parent / "templates" / "dialog"
-    shutil.copy(root / "index.html", path / 'index.html')
-    shutil.copy(root / "styles.css", path / 'styles.css')
-    shutil.copy(root / "scripts.js", path / 'scripts.js')
-    with open(path / 'dialog.js', "w", encoding="utf-8") as f:
-      f.write("document.quizzinator.dialog = ")
-      json.dump(dialog.history, f, indent=2, sort_keys=True)
-      f.write(';\n')
-
-      f.write("document.quizzinator.meta = ")
-      json.dump(meta, f, indent=2, sort_keys=True)
-      f.write(';\n')
-    # if we are on darwin, open this
-    # if platform.system() == "Darwin": subprocess.run(["open", path / 'index.html'], check=True)
-
-    # extract the questions summary
+def quiz_save(store: ExperimentStore, index: int, dialog: Dialog, meta: dict, owner: str | None = None) -> bool:
+    """
+    Record one finished quiz - history, answers, cache and meta - in a single
+    transaction; with an owner, only if it still holds the quiz's lease
+    """
     questions, _ = quiz_answers(dialog)
+    return store.save(index, dialog.history, questions, dialog.cache, meta, owner)
+
+def quiz_rescore(history: list[dict], specs: dict[str, tuple[str, list]]) -> tuple[dict[int, dict], dict]:
+    """
+    Extract the answers of a stored history again, e.g. after the extraction
+    rules changed; specs is {question name: (mode, legal codes)}.
+
+    Returns the new answer of each LLM turn, {turn: answer}, and the answers
+    to the questions they add up to (as quiz_answers); the history itself is
+    updated too. Turns for questions no longer in specs are left as they were.
+    """
+    prompt = ''
+    turns = {}
+    for turn, h in enumerate(history):
+        if h['role'] == 'user':
+            prompt = h['content']
+            continue
+        if h['answer']['name'] not in specs: continue
+        mode, codes = specs[h['answer']['name']]
+        ok, answer, rule = answer_extractor(mode, tuple(codes)).scan(prompt, h['content'], log=False)
+        h['answer'] = turns[turn] = dict(h['answer'], ok=ok, answer=answer, rule=rule)
+    questions, _ = quiz_history_answers(history)
+    return turns, questions
+
+# the question specs of the process pool's workers, see quiz_rescore_init
+_rescore_specs = {}
+
+def quiz_rescore_init(specs: dict[str, tuple[str, list]]) -> None:
+    """Runs once in each worker process, so the specs aren't sent with every respondent"""
+    global _rescore_specs
+    _rescore_specs = specs
+
+def quiz_rescore_one(job: tuple[int, list[dict]]):
+    """quiz_rescore for one (index, history) in a worker process: (index, turns, questions, history)"""
+    index, history = job
+    turns, questions = quiz_rescore(history, _rescore_specs)
+    return index, turns, questions, history
+
+def quiz_rescore_all(experiment: ExperimentStore, specs: dict[str, tuple[str, list]], workers: int, results=None):
+    """
+    Extract the answers of every saved respondent of experiment again, in a
+    pool of workers processes, and yield (index, before, questions, history)
+    for each: the answers to its questions before and after (as quiz_answers)
+    and its rescored history. Given a ResultsTable, the new answers are also
+    saved in the experiment and appended to the table.
+    """
+    done = sorted(experiment.done())
+    with ProcessPoolExecutor(max_workers=workers, initializer=quiz_rescore_init, initargs=(specs,)) as pool:
+        jobs = [(index, experiment.history(index, texts=False)) for index in done]
+        for index, turns, questions, history in pool.map(quiz_rescore_one, jobs, chunksize=16):
+            before = experiment.questions(index)
+            if results is not None:
+                experiment.rescore(index, turns, questions)
+                results.append(index, {name: q['answer'] for name, q in questions.items()}, history)
+            yield index, before, questions, history
 
-    # the json for later
-    with (path / 'cache.json').open('w',encoding='utf') as f: json.dump(dialog.cache, f, indent=4)
-    with (path / 'history.json').open('w',encoding='utf') as f: json.dump(dialog.history, f, indent=4)
-    with (path / 'questions.json').open('w',encoding='utf') as f: json.dump(questions, f, indent=4)
+def quiz_enough_answers(dialog: Dialog) -> bool:
+    """Did the respondent answer enough of the questions for us to keep the quiz?"""
+    qs, successes = quiz_answers(dialog)
+    if successes / len(qs) < 0.8:
+        logger.warning(f'only had answers to {successes} of {len(qs)} -> retrying')
+        return False
+    return True
 
-    # the file signal
-    with (path / 'done').open('w',encoding='utf') as f: f.write('')
+def quiz_postmortem(index: int, model: str, error: RepetitionError) -> Path:
+    """Save what a looping LLM said, so we can see later what set it off"""
+    args = cli_get_args()
+    path = Path(args.dir) / 'experiments' / args.experiment / 'postmortem'
+    path.mkdir(parents=True, exist_ok=True)
+    path = path / f'{index}-{time.time_ns()}.txt'
+    div = '-' * 60 + '\n'
+    with path.open('w', encoding='utf-8') as f:
+        f.write(f'quiz = {index}\n')
+        f.write(f'model = {model}\n')
+        f.write(f'time = {timestamp_str()}\n')
+        f.write(f'repeats = {error.count:,}\n')
+        f.write(div)
+        f.write(f'repeat\n{error.repeat}\n')
+        f.write(div)
+        f.write(f'buffer\n{error.buffer}\n')
+    logger.warning(f"Quiz #{index} got stuck in a loop - see {path}")
+    return path
 
-def quiz_run_one(index: int, total: int, hint_answers: str|None, questions: list[Question], cache: dict, model: str, timeout: float, verbose: bool, attempts: int) -> None:
+def quiz_run_one(index: int, total: int, hint_answers: str|None, questions: list[Question], cache: dict, model: str, timeout: float, verbose: bool, attempts: int, backend: str = 'pty', pool=None, store=None, experiment=None) -> None:
+    """
+    Quiz one respondent, retrying until enough questions are answered. With the
+    experiment store, every turn is checkpointed as it comes in, so a retry (or a
+    later run) only asks the questions that are still unanswered.
+    """
     dialog = None
     i = 0
     while i < attempts:
         try:
-            dialog = _quiz_run_one(index, total, hint_answers, questions, cache, model, timeout, verbose, attempts)
+            dialog = _quiz_run_one(index, total, hint_answers, questions, cache, model, timeout, verbose, attempts, backend, pool, store, i, experiment)
             if dialog is None:
-                logger.warn(f'got no response from quiz -> retrying')
+                logger.warning(f'got no response from quiz -> retrying')
                 continue
 
             # check how much is completed
-            qs, successes = quiz_answers(dialog)
-            if successes / len(qs) < 0.8:
-                logger.warning(f'only had answers to {successes} of {len(qs)} -> retrying')
+            if not quiz_enough_answers(dialog):
                 i += 1
                 continue
 
             # actually successful
             return dialog
+        except RepetitionError as e:
+            quiz_postmortem(index, model, e)
+            logger.error(f"Quiz #{index} repeated itself - reattempting {i} of {attempts - 1}" )
+            i += 1
         except TimeoutError:
             logger.error(f"Quiz #{index} timed out - reattempting {i} of {attempts - 1}" )
             i += 1
     return dialog
 
-def _quiz_run_one(index: int, total: int, hint_answers: str|None, questions: list[Question], cache: dict, model: str, timeout: float, verbose: bool, attempts: int) -> None:
-    """
-    Run exactly one respondent through the survey:
-      - Prints each raw prompt
-      - Calls client.query()
-      - Prints question name + extracted answer
-      - Pretty-prints the full entry (sans 'think')
-    """
+async def aquiz_run_one(index: int, total: int, hint_answers: str|None, questions: list[Question], cache: dict, model: str, timeout: float, verbose: bool, attempts: int, backend: str = 'http', pool=None, store=None, experiment=None) -> None:
+    """The asyncio counterpart of quiz_run_one, with the same retry rules"""
+    dialog = None
+    i = 0
+    while i < attempts:
+        try:
+            dialog = await _aquiz_run_one(index, total, hint_answers, questions, cache, model, timeout, verbose, attempts, backend, pool, store, i, experiment)
+            if dialog is None:
+                logger.warning(f'got no response from quiz -> retrying')
+                continue
+
+            # check how much is completed
+            if not quiz_enough_answers(dialog):
+                i += 1
+                continue
+
+            # actually successful
+            return dialog
+        except RepetitionError as e:
+            quiz_postmortem(index, model, e)
+            logger.error(f"Quiz #{index} repeated itself - reattempting {i} of {attempts - 1}" )
+            i += 1
+        except TimeoutError:
+            logger.error(f"Quiz #{index} timed out - reattempting {i} of {attempts - 1}" )
+            i += 1
+    return dialog
+
+def quiz_hints(hint_answers: str|None) -> dict[str, str]:
+    """The answers we told the LLM it gave in the past, by question name"""
     hint_final = {}
-    msgs = []
     if hint_answers is not None:
         q_name, ha = [a.strip() for a in hint_answers.split(':',1)]
         for h in [a.strip() for a in ha.split("\n") if a.strip()]:
@@ -121,7 +213,162 @@ def _quiz_run_one(index: int, total: int, hint_answers: str|None, questions: lis
             name = name.strip()
             num = num.replace('(','').replace(')','').replace(',','').strip()
             hint_final[q_name] = num
-            msgs.append(f"{q_name}: {num} = {name}")
+    return hint_final
+
+def quiz_options(index: int, attempt: int = 0) -> dict:
+    """
+    The model's sampling options for one respondent: with --seed, each gets
+    their own seed (and a new one for each retry, or it would fail the same way)
+    """
+    args = cli_get_args()
+    seed = getattr(args, 'seed', None)
+    if seed is None: return {}
+    return {'seed': seed + index + attempt * 1_000_000}
+
+def quiz_resume(index: int, dialog: Dialog, experiment: ExperimentStore | None) -> set[str]:
+    """
+    Pick up from the respondent's turn log; returns the questions it already
+    answered.
+
+    Only the turns with a legal answer are carried on with - failed answers
+    and the re-asks after them are dropped - and the very first turn, whose
+    prompt holds the preamble, if its question was answered at all. A
+    backend that cannot be handed the turns (pty) starts afresh instead.
+    """
+    if experiment is None: return set()
+    history = experiment.log(index)
+    if not history: return set()
+    if not dialog.restores():
+        logger.info(f"Quiz #{index} starts afresh, as its backend cannot resume the {len(history) // 2:,} logged turns")
+        experiment.log_clear(index)
+        return set()
+    answered = {h['answer']['name'] for h in history if h['role'] == 'llm' and h['answer']['ok']}
+    kept = []
+    for i in range(0, len(history) - 1, 2):
+        user, llm = history[i], history[i + 1]
+        if llm['answer']['ok'] or (i == 0 and llm['answer']['name'] in answered):
+            kept += [user, llm]
+    dialog.resume(kept)
+    logger.info(f"Quiz #{index} resumes with {len(answered):,} questions already answered")
+    return answered
+
+def quiz_checkpoint(index: int, experiment: ExperimentStore | None):
+    """Where quiz_turns appends each finished turn, if anywhere"""
+    if experiment is None: return None
+    return lambda entries: experiment.log_append(index, entries)
+
+def quiz_turns(questions: list[Question], todo: list[str], hint_final: dict[str, str], verbose: bool, attempts: int, prog=None, early_stop: bool = False, answered: set[str] = frozenset(), checkpoint=None, structured: bool = False):
+    """
+    The question-and-answer loop for one respondent.
+
+    This is a generator so that the sync and async engines share it: it yields
+    each (prompt, stop, schema) to send to the LLM and expects the (user, llm)
+    history entries of Dialog.query (or Dialog.aquery) to be sent back in.
+
+    With early_stop, stop is a test that tells the backend when the answer so
+    far already holds a legal answer, so the rest of the generation can be cut
+    off. It is None for free-text questions, and without early_stop.
+
+    With structured, schema is the JSON schema the backend should hold the
+    reply to (see answer_schema); it is None for free-text questions, and
+    without structured. Replies that don't follow it still go through the
+    answer rules.
+
+    Questions in answered (see quiz_resume) are skipped, and checkpoint, if
+    given, is called with the (user, llm) entries of every turn once its
+    answer has been extracted.
+    """
+    for i, name in enumerate(todo):
+        if name in answered:
+            if prog: prog.step(f"√ question {name}")
+            continue
+        qs = [q for q in questions if q.name == name]
+        if len(qs) == 0:
+            logger.critical(f"Illegal question {name} requested")
+        if len(qs) > 1:
+            logger.critical(f"question {name} appears multiple times in questions")
+        q = qs[0]
+        prompt = build_prompt(q, structured=structured)
+        codes = [o.code for o in q.options]
+        extractor = q.extractor or answer_extractor(q.mode, tuple(codes))
+        schema = extractor.schema if structured else None
+        stop = None
+        if early_stop and q.mode in EARLY_STOP_MODES:
+            stop = lambda text, q=q, codes=codes: answer_ready(text, q.mode, codes)
+        if verbose:
+            logger.info(f"[bold]Question #{i+1:,} of {len(todo):,}: {q.name}[/bold]")
+            logger.info("  [bold magenta]Quizzinator[/bold magenta]:")
+            msg = quiz_truncate(prompt)
+            logger.info(f'  [magenta]{msg}[/magenta]')
+
+        # should iterate up to n times until we get an OK for entry
+        current_prompt = prompt
+        count = 0
+        ok = False
+        while count < attempts:
+            t0 = time.time()
+            user, llm = yield current_prompt, stop, schema
+            user['answer'] = {
+                'name': q.name,
+                'number': i,
+                'count': count,
+                'ok': False,
+                'answer': None,
+            }
+            ok, answer, rule = extractor.scan(current_prompt, llm['content'], question=q.name)
+            llm['answer'] = {
+                'name': q.name,
+                'number': i,
+                'count': count,
+                'ok': ok,
+                'answer': answer,
+                # which of ANSWER_RULES found it
+                'rule': rule,
+            }
+            if checkpoint: checkpoint([user, llm])
+            dt = int(time.time() - t0)
+
+            # If we succeed on extracting a good answer, get out of this loop!
+            if ok:
+                if verbose:
+                    if type(answer) is list: answer = ','.join(answer)
+                    msg = quiz_truncate(answer)
+                    logger.info(f"  [bold green]LLM good answer after {dt:,} seconds[/bold green]")
+
+                    if name in hint_final:
+                        if answer != hint_final[name]:
+                            logger.info(f"  [bold red]{msg}[/bold red]: hint was {hint_final[name]}")
+                        else:
+                            logger.info(f"  [green]{msg} √[/green]")
+                    else:
+                        logger.info(f"  [green]{msg}[/green]")
+
+                break
+
+            # If we failed, then take care of logging that
+            if verbose:
+                msg = quiz_truncate(llm['content'])
+                logger.info(f"  [bold red]LLM bad answer after {dt:,} seconds[/bold red]")
+                logger.info(f"  [red]{msg}[/red]")
+
+            current_prompt = build_prompt(q, True, structured)
+            if verbose and count + 1 < attempts:
+                logger.info("  [bold magenta]Quizzinator REPEATS:[/bold magenta]")
+                msg = quiz_truncate(current_prompt)
+                logger.info(f"  [magenta]{msg}[/magenta]")
+            count += 1
+
+        if prog: prog.step(f"{'√' if ok else 'x'} question {q.name}")
+
+def _quiz_run_one(index: int, total: int, hint_answers: str|None, questions: list[Question], cache: dict, model: str, timeout: float, verbose: bool, attempts: int, backend: str = 'pty', pool=None, store=None, attempt: int = 0, experiment=None) -> None:
+    """
+    Run exactly one respondent through the survey:
+      - Prints each raw prompt
+      - Calls client.query()
+      - Prints question name + extracted answer
+      - Pretty-prints the full entry (sans 'think')
+    """
+    hint_final = quiz_hints(hint_answers)
 
     # get the questions to ask the LLM
     args = cli_get_args()
@@ -133,121 +380,53 @@ def _quiz_run_one(index: int, total: int, hint_answers: str|None, questions: lis
         show_steps=False,
         silent = verbose
     ) as prog):
-        if msgs and False:
-            with logger.section("Hint Answers"):
-                for msg in msgs:
-                    logger.info(msg)
-        div1 = '=' * 33
-        div2 = '-' * 33
-        dialog = Dialog(model=model, timeout=timeout, cache=cache)
-        ret = []
-        for i, name in enumerate(todo):
-            qs = [q for q in questions if q.name == name]
-            if len(qs) == 0:
-                logger.critical(f"Illegal question {name} requested")
-            if len(qs) > 1:
-                logger.critical(f"question {name} appears multiple times in questions")
-            q = qs[0]
-            prompt = build_prompt(q)
-            if verbose:
-                #logger.info(div1)
-                logger.info(f"[bold]Question #{i+1:,} of {len(todo):,}: {q.name}[/bold]")
-                logger.info("  [bold magenta]Quizzinator[/bold magenta]:")
-                msg = quiz_truncate(prompt)
-                #print(['quiz_run_one, line 77', msg])
-                logger.info(f'  [magenta]{msg}[/magenta]')
-
-            # should iterate up to n times until we get an OK for entry
-            current_prompt = prompt
-            count = 0
-            ok = False
-            while count < attempts:
-                t0 = time.time()
-                user, llm = dialog.query(current_prompt)
-                user['answer'] = {
-                    'name': q.name,
-                    'number': i,
-                    'count': count,
-                    'ok': False,
-                    'answer': None,
-                }
-                ret.append(user)
-                ok, answer = get_legal_answer(current_prompt, llm['content'], q.mode, [o.code for o in q.options])
-                #print(['answer = ', answer])
-                llm['answer'] = {
-                    'name': q.name,
-                    'number': i,
-                    'count': count,
-                    'ok': ok,
-                    'answer': answer,
-                }
-                ret.append(llm)
-                dt = int(time.time() - t0)
-
-                # If we succeed on extracting a good answer, get out of this loop!
-                if ok:
-                    if verbose:
-                        #logger.info(div2)
-                        if type(answer) is list: answer = ','.join(answer)
-                        msg = quiz_truncate(answer)
-                        logger.info(f"  [bold green]LLM good answer after {dt:,} seconds[/bold green]")
-
-                        if name in hint_final:
-                            #print([answer, hint_final[name]])
-                            if answer != hint_final[name]:
-                                logger.info(f"  [bold red]{msg}[/bold red]: hint was {hint_final[name]}")
-                            else:
-                                logger.info(f"  [green]{msg} √[/green]")
-                        else:
-                            logger.info(f"  [green]{msg}[/green]")
-
-                    break
-
-                # If we failed, then take care of logging that
-                if verbose:
-                    #logger.info(div2)
-                    msg = quiz_truncate(llm['content'])
-                    logger.info(f"  [bold red]LLM bad answer after {dt:,} seconds[/bold red]")
-                    logger.info(f"  [red]{msg}[/red]")
-
-                current_prompt = build_prompt(q, True)
-                if verbose and count + 1 < attempts:
-                    #logger.info(div2)
-                    logger.info("  [bold magenta]Quizzinator REPEATS:[/bold magenta]")
-                    msg = quiz_truncate(current_prompt)
-                    logger.info(f"  [magenta]{msg}[/magenta]")
-                    #logger.info(div2)
-                count += 1
-
-            prog.step(f"{'√' if ok else 'x'} question {q.name}")
-        dialog.kill()
+        dialog = Dialog(model=model, timeout=timeout, cache=cache, backend=backend, pool=pool, store=store, options=quiz_options(index, attempt), respondent=[index, attempt])
+        answered = quiz_resume(index, dialog, experiment)
+        turns = quiz_turns(questions, todo, hint_final, verbose, attempts, prog, getattr(args, 'early_stop', False), answered, quiz_checkpoint(index, experiment), getattr(args, 'structured', False))
+        try:
+            prompt, stop, schema = next(turns)
+            while True:
+                prompt, stop, schema = turns.send(dialog.query(prompt, stop=stop, format=schema))
+        except StopIteration:
+            pass
+        finally:
+            dialog.close()
         return dialog
 
-def quiz_todo(path: str, experiment: str, n: int, reset: bool) -> list[list[int, Path, bool]]:
-    path_experiment = Path(os.path.join(path, 'experiments', experiment))
-    path_experiment.mkdir(parents=True, exist_ok=True)
-
-    path_quizzes = path_experiment / 'quizzes'
-    path_quizzes.mkdir(parents=True, exist_ok=True)
-
-    todo = [
-        [i, path_quizzes / str(i), not (path_quizzes / str(i) / 'done').exists() or reset]
-        for i in range(n)
-    ]
-    for t in todo:
-        t[1].mkdir(parents=True, exist_ok=True)
-
-    return todo
-
-def quiz_done(path: str, experiment: str) -> list[tuple[int, Path, bool]]:
-  path_experiment = Path(os.path.join(path, 'experiments', experiment))
-  path_experiment.mkdir(parents=True, exist_ok=True)
+async def _aquiz_run_one(index: int, total: int, hint_answers: str|None, questions: list[Question], cache: dict, model: str, timeout: float, verbose: bool, attempts: int, backend: str = 'http', pool=None, store=None, attempt: int = 0, experiment=None) -> None:
+    """
+    The asyncio counterpart of _quiz_run_one.
 
-  path_quizzes = path_experiment / 'quizzes'
+    Hundreds of these share one event loop, so there is no per-quiz progress
+    bar; the caller reports each finished quiz instead.
+    """
+    hint_final = quiz_hints(hint_answers)
 
-  # Get all numerically named directories in path_quizzes that have a 'history.json' file
-  done_quizzes = [(int(folder), path_quizzes / folder, (path_quizzes / folder / "history.json").exists())
-                 for folder in os.listdir(path_quizzes)
-                 if folder.isdigit() and os.path.isdir(path_quizzes / folder)]
+    args = cli_get_args()
+    todo = args.questions
+    dialog = Dialog(model=model, timeout=timeout, cache=cache, backend=backend, pool=pool, store=store, options=quiz_options(index, attempt), respondent=[index, attempt])
+    answered = quiz_resume(index, dialog, experiment)
+    turns = quiz_turns(
+        questions, todo, hint_final, verbose, attempts,
+        early_stop=getattr(args, 'early_stop', False),
+        answered=answered,
+        checkpoint=quiz_checkpoint(index, experiment),
+        structured=getattr(args, 'structured', False),
+    )
+    try:
+        prompt, stop, schema = next(turns)
+        while True:
+            prompt, stop, schema = turns.send(await dialog.aquery(prompt, stop=stop, format=schema))
+    except StopIteration:
+        pass
+    finally:
+        await dialog.aclose()
+    return dialog
 
-  return done_quizzes
+def quiz_todo(store: ExperimentStore, n: int, reset: bool) -> list[list[int, bool]]:
+    """
+    [index, needs running] for each of the n quizzes; a reset runs them all
+    (their checkpoints are dropped as they are leased, see Ledger)
+    """
+    done = store.done()
+    return [[i, i not in done or reset] for i in range(n)]
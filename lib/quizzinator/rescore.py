@@ -0,0 +1,158 @@
+import argparse, json, os, tempfile
+from glob import glob
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from .logging import logger
+from .cli import cli_log_args, cli_set_args, cli_get_args
+from .questions import parse_questions
+from .store import ExperimentStore, store_copy, export_viewer
+from .results import ResultsTable
+from .quiz import quiz_rescore_all
+from .experiment import experiment_run_refresh
+
+def rescore_cli_args():
+  p = argparse.ArgumentParser(
+    prog="rescore",
+    description="Extract the answers of saved experiments again, and report what changed"
+  )
+  p.add_argument(
+    "dirs",
+    nargs="*",
+    help="Survey directories to rescore [def = every one under data/]"
+  )
+  p.add_argument(
+    "--experiment",
+    type=str,
+    default="",
+    help="Only rescore these experiments, separated by commas [def = all of them]"
+  )
+  p.add_argument(
+    "--in-place",
+    action="store_true",
+    help="Save the new answers in the experiments, and rebuild their results table, data.csv and html"
+  )
+  p.add_argument(
+    "--version",
+    type=str,
+    default="",
+    help="Leave the experiments alone, and write the new results to experiments/<experiment>/results-VERSION.parquet"
+  )
+  p.add_argument(
+    "--workers",
+    type=int,
+    default=0,
+    help="How many processes to extract answers in [def = one per core]"
+  )
+  return p.parse_args()
+
+def rescore_diff(before: dict, after: dict, counts: dict) -> None:
+  """
+  Tally one respondent's answers, {name: {answer, ...}} before and after, into
+  counts[name]; a question is answered when its answer is not None (the 'ok'
+  of quiz_answers is never set)
+  """
+  for name, q in after.items():
+    old = before.get(name, {'answer': None})
+    c = counts.setdefault(name, {'respondents': 0, 'parsed': 0, 'changed': 0, 'lost': 0})
+    c['respondents'] += 1
+    was, now = old['answer'] is not None, q['answer'] is not None
+    same = json.dumps(old['answer'], default=str) == json.dumps(q['answer'], default=str)
+    if now and not was: c['parsed'] += 1
+    elif was and not now: c['lost'] += 1
+    elif now and not same: c['changed'] += 1
+
+def rescore_experiment(path_dir: Path, path_experiment: Path, specs: dict, workers: int) -> dict:
+  """
+  Rescore one experiment; returns the counts of rescore_diff, by question.
+  Only --in-place writes to its store: otherwise the answers are extracted
+  from a scratch copy (see store_copy), leaving the experiment as it was.
+  """
+  args = cli_get_args()
+  counts = {}
+  scratch = None
+  if args.in_place:
+    experiment = ExperimentStore(path_experiment / 'experiment.sqlite')
+  else:
+    scratch = tempfile.TemporaryDirectory(prefix='rescore-')
+    # extraction doesn't look at the raw output and reasoning
+    experiment = store_copy(path_experiment / 'experiment.sqlite', Path(scratch.name) / 'experiment.sqlite', texts=False)
+  try:
+    meta = {}
+    if (path_experiment / 'meta.json').exists():
+      with open(path_experiment / 'meta.json', 'r') as f:
+        meta = json.load(f)
+    asked = meta.get('questions') or list(specs)
+    results = ResultsTable(path_experiment, [q for q in parse_questions(path_dir / 'questions.txt') if q.name in asked])
+    rows = []
+    if args.in_place: results.clear()
+    for index, before, questions, history in quiz_rescore_all(experiment, specs, workers, results if args.in_place else None):
+      rescore_diff(before, questions, counts)
+      if args.version:
+        rows.append(results.row(index, {name: q['answer'] for name, q in questions.items()}, history))
+
+    if args.in_place:
+      rescore_refresh(path_dir, path_experiment, experiment, results, workers)
+    elif args.version:
+      table = pa.Table.from_pylist(rows, schema=results.schema)
+      pq.write_table(table, path_experiment / f'results-{args.version}.parquet')
+  finally:
+    experiment.close()
+    if scratch: scratch.cleanup()
+  return counts
+
+def rescore_refresh(path_dir: Path, path_experiment: Path, experiment, results: ResultsTable, workers: int) -> None:
+  """
+  Bring what is made from an experiment's answers up to date after they were
+  rescored in place: its data.csv and meta.json, its html and dialog viewer,
+  and the project report - the same as a run or --replay does.
+  """
+  args = cli_get_args()
+  cli_set_args(argparse.Namespace(dir=path_dir, experiment=path_experiment.name, from_hints=False))
+  try:
+    export_viewer(Path(os.path.abspath(path_dir)) / 'html' / path_experiment.name / 'dialog', experiment, workers=workers)
+    experiment_run_refresh(experiment, results.compact(experiment))
+  finally:
+    cli_set_args(args)
+
+def rescore_report(name: str, counts: dict) -> None:
+  with logger.section(name):
+    for question, c in counts.items():
+      logger.info(
+        f"{question:<24} {c['respondents']:>7,} respondents | {c['parsed']:>6,} newly parsed"
+        f" | {c['changed']:>6,} changed | {c['lost']:>6,} lost"
+      )
+
+def rescore_main():
+  args = rescore_cli_args()
+  args.experiment = [e for e in args.experiment.split(',') if e]
+  if args.in_place and args.version:
+    logger.critical("Pick one of --in-place and --version")
+  cli_set_args(args)
+  cli_log_args(args)
+
+  dirs = [Path(d) for d in args.dirs] or [Path(d) for d in sorted(glob('data/*')) if os.path.isfile(Path(d) / 'questions.txt')]
+  workers = args.workers or os.cpu_count() or 1
+  experiments = []
+  for path_dir in dirs:
+    for path_experiment in sorted(p for p in (path_dir / 'experiments').glob('*') if p.is_dir()):
+      if args.experiment and path_experiment.name not in args.experiment: continue
+      if (path_experiment / 'experiment.sqlite').exists():
+        experiments.append((path_dir, path_experiment))
+      elif (path_experiment / 'quizzes').is_dir():
+        # converting it is up to a run of the experiment, not a rescore
+        logger.critical(f"{path_experiment} is still in the old layout: run it with --replay once to give it a store")
+
+  totals = {}
+  for path_dir, path_experiment in experiments:
+    specs = {q.name: (q.mode, [o.code for o in q.options]) for q in parse_questions(path_dir / 'questions.txt')}
+    counts = rescore_experiment(path_dir, path_experiment, specs, workers)
+    rescore_report(f"{path_dir.name}/{path_experiment.name}", counts)
+    for question, c in counts.items():
+      t = totals.setdefault(question, dict.fromkeys(c, 0))
+      for k, v in c.items(): t[k] += v
+  rescore_report("All experiments", totals)
+  if not (args.in_place or args.version):
+    logger.info("Nothing was saved: use --in-place or --version to keep the new answers")
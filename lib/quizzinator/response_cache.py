@@ -0,0 +1,108 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+from pathlib import Path
+
+class ResponseCache:
+  """
+  Project-wide store of LLM responses, shared by every experiment.
+
+  A response is only reusable if the model would have been asked exactly the
+  same thing in exactly the same state, so the key (see ResponseCache.key)
+  covers the model digest, the whole conversation up to and including the
+  prompt, and the sampling parameters. Entries live in one SQLite file; once
+  it grows past max_bytes the least recently used ones are evicted. Like the
+  experiment store, it drops WAL mode when shared between hosts.
+  """
+  def __init__(self, path: Path | str, max_bytes: int = 1 << 30, shared: bool = False):
+    self.path = Path(path)
+    self.path.parent.mkdir(parents=True, exist_ok=True)
+    self.max_bytes = max_bytes
+
+    # one connection shared by all the worker threads
+    self._lock = threading.Lock()
+    self._db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+    self._db.execute(f"PRAGMA journal_mode={'DELETE' if shared else 'WAL'}")
+    self._db.execute(
+      'CREATE TABLE IF NOT EXISTS responses ('
+      ' key TEXT PRIMARY KEY,'
+      ' value TEXT NOT NULL,'
+      ' size INTEGER NOT NULL,'
+      ' used REAL NOT NULL)'
+    )
+    self._db.execute('CREATE INDEX IF NOT EXISTS responses_used ON responses (used)')
+    self._db.commit()
+    self._size = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    # how the cache did during this run
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+  @staticmethod
+  def key(model: str, conversation: list[tuple[str, str]], prompt: str, sample: dict) -> str:
+    """
+    model - the model's digest (or name, if the digest is unknown)
+    conversation - (role, raw) of every earlier turn
+    prompt - what is being asked now
+    sample - everything else that shapes the response: seed, other options, respondent
+    """
+    text = json.dumps([model, conversation, prompt, sample], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+  def get(self, key: str) -> dict | None:
+    with self._lock:
+      row = self._db.execute('SELECT value FROM responses WHERE key = ?', (key,)).fetchone()
+      if row is None:
+        self.misses += 1
+        return None
+      self.hits += 1
+      self._db.execute('UPDATE responses SET used = ? WHERE key = ?', (time.time(), key))
+      self._db.commit()
+    return json.loads(row[0])
+
+  def put(self, key: str, value: dict) -> None:
+    text = json.dumps(value, ensure_ascii=False)
+    size = len(text.encode('utf-8'))
+    with self._lock:
+      old = self._db.execute('SELECT size FROM responses WHERE key = ?', (key,)).fetchone()
+      self._db.execute(
+        'INSERT OR REPLACE INTO responses (key, value, size, used) VALUES (?, ?, ?, ?)',
+        (key, text, size, time.time())
+      )
+      self._size += size - (old[0] if old else 0)
+      self._evict()
+      self._db.commit()
+
+  def _evict(self) -> None:
+    """Drop the least recently used entries until we are back under max_bytes"""
+    while self._size > self.max_bytes:
+      rows = self._db.execute('SELECT key, size FROM responses ORDER BY used LIMIT 64').fetchall()
+      if not rows: break
+      for key, size in rows:
+        self._db.execute('DELETE FROM responses WHERE key = ?', (key,))
+        self._size -= size
+        self.evictions += 1
+        if self._size <= self.max_bytes: break
+
+  def __len__(self) -> int:
+    with self._lock:
+      return self._db.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+
+  def stats(self) -> dict:
+    """Hit/miss statistics for the run meta data"""
+    lookups = self.hits + self.misses
+    return {
+      'hits': self.hits,
+      'misses': self.misses,
+      'hit_rate': self.hits / lookups if lookups else 0.0,
+      'evictions': self.evictions,
+      'bytes': self._size,
+    }
+
+  def close(self) -> None:
+    with self._lock:
+      self._db.close()
@@ -0,0 +1,184 @@
+import csv
+import os
+import time
+
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from .logging import logger
+from .questions import Question
+
+# who the respondent was and when they were quizzed, ahead of one column per question
+RESULTS_COLUMNS = [
+  ('number', pa.int32()),
+  ('start', pa.float64()),
+  ('end', pa.float64()),
+  ('llm_time', pa.float64()),
+]
+
+def results_type(mode: str) -> pa.DataType:
+  """The column type for answers to a question of this mode"""
+  if mode == 'single': return pa.int16()
+  # named the way parquet names list items, so tables read back compare equal
+  if mode == 'multi': return pa.list_(pa.field('element', pa.int16()))
+  if mode == 'number': return pa.float64()
+  return pa.string()
+
+def results_value(mode: str, answer):
+  """An extracted answer (see get_legal_answer) as a value of its column's type"""
+  if answer is None: return None
+  try:
+    if mode == 'single': return int(answer)
+    if mode == 'multi': return [int(a) for a in answer]
+    if mode == 'number': return float(str(answer).replace(',', ''))
+  except ValueError:
+    return None
+  return str(answer)
+
+def results_schema(questions: list[Question]) -> pa.Schema:
+  return pa.schema(RESULTS_COLUMNS + [(q.name, results_type(q.mode)) for q in questions])
+
+class ResultsTable:
+  """
+  The experiment's answers as one typed table, experiments/<experiment>/results.parquet:
+  a row per respondent with integer codes for single choice questions, lists
+  of codes for multiple choice, floats for numbers and text for the rest,
+  plus when the respondent was quizzed.
+
+  Rows are appended as respondents finish, batch rows at a time, to a part
+  file of this run under results/. compact() folds the parts into
+  results.parquet once the run is over; whatever the parts missed (a crash,
+  an experiment from before this table) is filled in from the store.
+  snapshot() is the table so far, for reports made while the run goes on.
+  """
+  def __init__(self, path_experiment: Path, questions: list[Question], batch: int = 64):
+    self.path = Path(path_experiment) / 'results.parquet'
+    self.path_parts = Path(path_experiment) / 'results'
+    self.questions = questions
+    self.schema = results_schema(questions)
+    self.batch = batch
+    self._rows = []
+    self._writer = None
+    # every row, once snapshot() has been asked for them
+    self._all = None
+
+  def row(self, index: int, answers: dict, history: list[dict]) -> dict:
+    """One respondent's row, from their answers by question name and their dialog"""
+    starts = [h['start'] for h in history if h.get('start') is not None]
+    ends = [h['start'] + (h.get('elapsed') or 0) for h in history if h.get('start') is not None]
+    row = {
+      'number': index,
+      'start': min(starts) if starts else None,
+      'end': max(ends) if ends else None,
+      'llm_time': sum(h.get('elapsed') or 0 for h in history if h['role'] == 'llm'),
+    }
+    for q in self.questions:
+      row[q.name] = results_value(q.mode, answers.get(q.name))
+    return row
+
+  def append(self, index: int, answers: dict, history: list[dict]) -> None:
+    row = self.row(index, answers, history)
+    self._rows.append(row)
+    if self._all is not None: self._all[index] = row
+    if len(self._rows) >= self.batch: self.flush()
+
+  def flush(self) -> None:
+    """Write the rows appended so far as a row group of this run's part file"""
+    if not self._rows: return
+    if self._writer is None:
+      self.path_parts.mkdir(parents=True, exist_ok=True)
+      self._writer = pq.ParquetWriter(self.path_parts / f'part-{time.time_ns()}.parquet', self.schema)
+    self._writer.write_table(pa.Table.from_pylist(self._rows, schema=self.schema))
+    self._rows = []
+
+  def close(self) -> None:
+    self.flush()
+    if self._writer is not None:
+      self._writer.close()
+      self._writer = None
+
+  def clear(self) -> None:
+    """Throw away the table on disk, so it is made again from just the rows appended from now on"""
+    self.close()
+    self.path.unlink(missing_ok=True)
+    for path in self.path_parts.glob('part-*.parquet') if self.path_parts.is_dir() else []: path.unlink()
+    self._all = {}
+
+  def _fold(self) -> tuple[dict, list[Path]]:
+    """Every row in results.parquet and the parts, by respondent, and the parts they came from"""
+    rows = {}
+    parts = sorted(self.path_parts.glob('part-*.parquet')) if self.path_parts.is_dir() else []
+    # a part another run is still writing can't be read yet; it is left for that run to fold in
+    folded = []
+    for path in [self.path] + parts:
+      table = results_read(path)
+      if table is None: continue
+      if path != self.path: folded.append(path)
+      if table.schema != self.schema: continue
+      for row in table.to_pylist(): rows[row['number']] = row
+    return rows, folded
+
+  def _table(self, rows: dict, store) -> pa.Table:
+    """One row for each respondent in the store, in order; whatever rows is missing comes from the store"""
+    done = store.done()
+    missing = done - set(rows)
+    if missing: logger.info(f"Adding {len(missing):,} quizzes to the results table from the experiment store")
+    for index in missing:
+      answers = {name: q['answer'] for name, q in store.questions(index).items()}
+      rows[index] = self.row(index, answers, store.history(index, texts=False))
+    return pa.Table.from_pylist([rows[i] for i in sorted(done)], schema=self.schema)
+
+  def snapshot(self, store) -> pa.Table:
+    """
+    The table as it stands, for reports made while the run is going: the
+    files are only read the first time, after that it is kept in memory
+    """
+    if self._all is None: self._all, _ = self._fold()
+    return self._table(self._all, store)
+
+  def compact(self, store) -> pa.Table:
+    """Fold every part into results.parquet: one row for each respondent in the store, in order"""
+    self.close()
+    rows, folded = self._fold()
+    table = self._table(rows, store)
+    path_tmp = self.path.with_suffix(f'.{os.getpid()}-{time.time_ns()}.tmp')
+    pq.write_table(table, path_tmp)
+    os.replace(path_tmp, self.path)
+    for path in folded: path.unlink(missing_ok=True)
+    return table
+
+def results_read(path: Path) -> pa.Table | None:
+  """A results file, or None if it is missing or still being written"""
+  try:
+    return pq.read_table(path)
+  except (FileNotFoundError, pa.ArrowInvalid, OSError):
+    return None
+
+def results_load(path_experiment: Path) -> pa.Table | None:
+  """An experiment's results table, including rows still in part files"""
+  path_experiment = Path(path_experiment)
+  paths = [path_experiment / 'results.parquet'] + sorted((path_experiment / 'results').glob('part-*.parquet'))
+  tables = [t for t in (results_read(p) for p in paths) if t is not None]
+  if not tables: return None
+  rows = {}
+  for table in tables:
+    if table.schema != tables[0].schema: continue
+    for row in table.to_pylist(): rows[row['number']] = row
+  return pa.Table.from_pylist([rows[i] for i in sorted(rows)], schema=tables[0].schema)
+
+def results_csv_value(value) -> str | None:
+  """How data.csv has always shown an answer: lists of codes as "['3', '9']" """
+  if isinstance(value, list): return str([str(v) for v in value])
+  if isinstance(value, float): return str(int(value)) if value.is_integer() else str(value)
+  return value
+
+def results_csv(table: pa.Table, path_csv: Path) -> None:
+  """The data.csv view of the results table: the respondent and their answers"""
+  names = ['number'] + [n for n in table.column_names if n not in dict(RESULTS_COLUMNS)]
+  with open(path_csv, 'w', newline='') as f:
+    writer = csv.DictWriter(f, names, extrasaction='ignore')
+    writer.writeheader()
+    for row in table.to_pylist():
+      writer.writerow({name: results_csv_value(row[name]) for name in names})
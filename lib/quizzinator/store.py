@@ -0,0 +1,428 @@
+import base64
+import gzip
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from .blobs import TextBlobs, blobs_pack, blobs_unpack
+from .logging import logger
+
+# the per-respondent viewer, copied next to each exported dialog.js
+DIALOG_TEMPLATES = Path(__file__).resolve().parent / "templates" / "dialog"
+
+# the one viewer an experiment's html shares between all its respondents
+VIEWER_TEMPLATES = Path(__file__).resolve().parent / "templates" / "viewer"
+
+# how many respondents' dialogs go in one shard of the shared viewer
+VIEWER_SHARD_SIZE = 64
+
+class ExperimentStore:
+  """
+  Everything one experiment has collected, in a single SQLite database
+  (experiments/<experiment>/experiment.sqlite) instead of a directory of
+  files per respondent.
+
+    respondents - one row per finished respondent: its meta data and cache
+    turns       - every entry of every respondent's dialog history, in order,
+                  without its raw output and reasoning: those are in cold
+                  storage (see TextBlobs), experiment.blob, at blob_offset
+    answers     - the answer extracted for each question, one row per respondent and question
+    log         - the turns of respondents still being quizzed, appended as each one comes in
+    leases      - which worker is quizzing which respondent, and until when (see Ledger)
+
+  A respondent is saved in one transaction, so it is either all there or not
+  at all; that replaces the old 'done' marker file. Until then the log is its
+  checkpoint: a respondent that was interrupted, or is being retried, picks up
+  from what is logged instead of starting over. The database runs in WAL mode
+  so readers (the html export, the csv) never block the writers - unless it
+  is shared between hosts over a network file system, where WAL does not
+  work and the classic rollback journal is used instead.
+  """
+  def __init__(self, path: Path | str, shared: bool = False):
+    self.path = Path(path)
+    self.path.parent.mkdir(parents=True, exist_ok=True)
+    self._lock = threading.RLock()
+    self._db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+    self._db.execute(f"PRAGMA journal_mode={'DELETE' if shared else 'WAL'}")
+    self._db.execute('PRAGMA synchronous=NORMAL')
+    self._db.executescript('''
+      CREATE TABLE IF NOT EXISTS respondents (
+        idx INTEGER PRIMARY KEY,
+        meta TEXT NOT NULL,
+        cache TEXT NOT NULL
+      );
+      CREATE TABLE IF NOT EXISTS turns (
+        idx INTEGER NOT NULL,
+        turn INTEGER NOT NULL,
+        role TEXT NOT NULL,
+        start REAL,
+        elapsed REAL,
+        entry TEXT NOT NULL,
+        PRIMARY KEY (idx, turn)
+      );
+      CREATE TABLE IF NOT EXISTS answers (
+        idx INTEGER NOT NULL,
+        name TEXT NOT NULL,
+        number INTEGER NOT NULL,
+        ok INTEGER NOT NULL,
+        answer TEXT,
+        PRIMARY KEY (idx, name)
+      );
+      CREATE TABLE IF NOT EXISTS log (
+        idx INTEGER NOT NULL,
+        seq INTEGER NOT NULL,
+        entry TEXT NOT NULL,
+        PRIMARY KEY (idx, seq)
+      );
+      CREATE TABLE IF NOT EXISTS leases (
+        idx INTEGER PRIMARY KEY,
+        owner TEXT NOT NULL,
+        expires REAL NOT NULL
+      );
+      CREATE INDEX IF NOT EXISTS turns_start ON turns (start);
+      CREATE INDEX IF NOT EXISTS answers_name ON answers (name);
+    ''')
+    columns = [row[1] for row in self._db.execute('PRAGMA table_info(turns)')]
+    if 'blob_offset' not in columns:
+      self._db.execute('ALTER TABLE turns ADD COLUMN blob_offset INTEGER')
+      self._db.execute('ALTER TABLE turns ADD COLUMN blob_length INTEGER')
+    columns = [row[1] for row in self._db.execute('PRAGMA table_info(respondents)')]
+    if 'saved' not in columns:
+      self._db.execute('ALTER TABLE respondents ADD COLUMN saved REAL')
+    self._db.commit()
+    self.blobs = TextBlobs(self.path.with_suffix('.blob'))
+
+  def close(self) -> None:
+    with self._lock:
+      self._db.close()
+      self.blobs.close()
+
+  def save(self, index: int, history: list[dict], questions: dict, cache: dict, meta: dict, owner: str | None = None) -> bool:
+    """
+    Record one finished respondent, replacing whatever was there for it before.
+
+    With an owner, the respondent is only saved if that owner still holds its
+    lease, which is given up in the same transaction; returns whether it was.
+    """
+    with self._lock:
+      turns = []
+      for i, h in enumerate(history):
+        hot, record = blobs_pack(h)
+        offset, length = self.blobs.put(record) if record else (None, None)
+        turns.append((index, i, h['role'], h.get('start'), h.get('elapsed'), json.dumps(hot, default=str), offset, length))
+      # the cache is just the prompts and raw replies of the history, unless it came from elsewhere
+      if cache == history_cache(history): cache = None
+      with self._db:
+        self._db.execute('BEGIN IMMEDIATE')
+        if owner is not None:
+          row = self._db.execute('SELECT owner FROM leases WHERE idx = ?', (index,)).fetchone()
+          if not row or row[0] != owner: return False
+        for table in ('respondents', 'turns', 'answers', 'log', 'leases'):
+          self._db.execute(f'DELETE FROM {table} WHERE idx = ?', (index,))
+        self._db.executemany(
+          'INSERT INTO turns (idx, turn, role, start, elapsed, entry, blob_offset, blob_length) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+          turns
+        )
+        self._insert_answers(index, questions)
+        self._db.execute(
+          'INSERT INTO respondents (idx, meta, cache, saved) VALUES (?, ?, ?, ?)',
+          (index, json.dumps(meta, default=str), json.dumps(cache, default=str), time.time())
+        )
+    return True
+
+  def _insert_answers(self, index: int, questions: dict) -> None:
+    self._db.executemany(
+      'INSERT INTO answers (idx, name, number, ok, answer) VALUES (?, ?, ?, ?, ?)',
+      [
+        (index, q['name'], q['number'], int(q['ok']), json.dumps(q['answer'], default=str))
+        for q in questions.values()
+      ]
+    )
+
+  def rescore(self, index: int, turns: dict[int, dict], questions: dict) -> None:
+    """
+    Replace the answers extracted from a respondent's turns, {turn: answer},
+    and the answers to the questions they add up to; the text is left alone
+    """
+    with self._lock, self._db:
+      for turn, answer in turns.items():
+        row = self._db.execute('SELECT entry FROM turns WHERE idx = ? AND turn = ?', (index, turn)).fetchone()
+        if not row: continue
+        entry = json.loads(row[0])
+        entry['answer'] = answer
+        self._db.execute(
+          'UPDATE turns SET entry = ? WHERE idx = ? AND turn = ?', (json.dumps(entry, default=str), index, turn)
+        )
+      self._db.execute('DELETE FROM answers WHERE idx = ?', (index,))
+      self._insert_answers(index, questions)
+
+  def lease(self, index: int, owner: str, ttl: float, since: float | None = None) -> bool:
+    """
+    Claim a respondent for owner for the next ttl seconds; False if it is
+    already saved (since the time given, if any) or someone else holds an
+    unexpired lease on it. A lease that ran out - its owner crashed or lost
+    touch - is taken over.
+    """
+    now = time.time()
+    with self._lock, self._db:
+      # take the write lock up front, so two workers can't both see the respondent as free
+      self._db.execute('BEGIN IMMEDIATE')
+      row = self._db.execute('SELECT saved FROM respondents WHERE idx = ?', (index,)).fetchone()
+      if row and (since is None or (row[0] or 0) >= since): return False
+      row = self._db.execute('SELECT owner, expires FROM leases WHERE idx = ?', (index,)).fetchone()
+      if row and row[0] != owner:
+        if row[1] > now: return False
+        logger.warning(f"Taking over quiz #{index} from {row[0]}, whose lease ran out")
+      self._db.execute(
+        'INSERT OR REPLACE INTO leases (idx, owner, expires) VALUES (?, ?, ?)', (index, owner, now + ttl)
+      )
+    return True
+
+  def renew(self, owner: str, ttl: float) -> int:
+    """Extend every lease owner holds by another ttl seconds; returns how many it holds"""
+    with self._lock, self._db:
+      return self._db.execute(
+        'UPDATE leases SET expires = ? WHERE owner = ?', (time.time() + ttl, owner)
+      ).rowcount
+
+  def release(self, index: int, owner: str) -> None:
+    """Give up owner's lease on a respondent without saving it"""
+    with self._lock, self._db:
+      self._db.execute('DELETE FROM leases WHERE idx = ? AND owner = ?', (index, owner))
+
+  def leases(self) -> dict[int, tuple[str, float]]:
+    """{index: (owner, expires)} for every respondent being quizzed right now"""
+    with self._lock:
+      return {idx: (owner, expires) for idx, owner, expires in self._db.execute('SELECT idx, owner, expires FROM leases')}
+
+  def log_append(self, index: int, entries: list[dict]) -> None:
+    """Checkpoint the latest turns of a respondent that is not finished yet"""
+    with self._lock, self._db:
+      seq = self._db.execute('SELECT COALESCE(MAX(seq) + 1, 0) FROM log WHERE idx = ?', (index,)).fetchone()[0]
+      self._db.executemany(
+        'INSERT INTO log (idx, seq, entry) VALUES (?, ?, ?)',
+        [(index, seq + i, json.dumps(e, default=str)) for i, e in enumerate(entries)]
+      )
+
+  def log(self, index: int) -> list[dict]:
+    """Every turn checkpointed for a respondent since it was last saved"""
+    with self._lock:
+      rows = self._db.execute('SELECT entry FROM log WHERE idx = ? ORDER BY seq', (index,)).fetchall()
+    return [json.loads(r[0]) for r in rows]
+
+  def log_clear(self, index: int) -> None:
+    """Forget a respondent's checkpoint, so it starts from scratch"""
+    with self._lock, self._db:
+      self._db.execute('DELETE FROM log WHERE idx = ?', (index,))
+
+  def done(self) -> set[int]:
+    """The respondents that have been saved"""
+    with self._lock:
+      return {row[0] for row in self._db.execute('SELECT idx FROM respondents')}
+
+  def history(self, index: int, texts: bool = True) -> list[dict]:
+    """
+    A respondent's dialog history; without texts, just the hot part of each
+    entry (answers and timing, but no raw or think), which skips cold storage
+    """
+    with self._lock:
+      rows = self._db.execute(
+        'SELECT entry, blob_offset, blob_length FROM turns WHERE idx = ? ORDER BY turn', (index,)
+      ).fetchall()
+    if not texts: return [json.loads(r[0]) for r in rows]
+    return [self._unpack(*r) for r in rows]
+
+  def text(self, index: int, turn: int) -> dict:
+    """One entry of a respondent's history, with its raw output and reasoning"""
+    with self._lock:
+      row = self._db.execute(
+        'SELECT entry, blob_offset, blob_length FROM turns WHERE idx = ? AND turn = ?', (index, turn)
+      ).fetchone()
+    return self._unpack(*row)
+
+  def _unpack(self, entry: str, offset: int | None, length: int | None) -> dict:
+    hot = json.loads(entry)
+    # turns saved before there was cold storage still have their text
+    if 'raw' in hot: return hot
+    return blobs_unpack(hot, self.blobs.get(offset, length) if offset is not None else None)
+
+  def questions(self, index: int) -> dict:
+    """The same {name: {name, number, answer, ok}} that quiz_answers makes"""
+    with self._lock:
+      rows = self._db.execute(
+        'SELECT name, number, ok, answer FROM answers WHERE idx = ? ORDER BY number', (index,)
+      ).fetchall()
+    return {
+      name: {'name': name, 'number': number, 'answer': json.loads(answer), 'ok': bool(ok)}
+      for name, number, ok, answer in rows
+    }
+
+  def cache(self, index: int) -> dict | None:
+    with self._lock:
+      row = self._db.execute('SELECT cache FROM respondents WHERE idx = ?', (index,)).fetchone()
+    if not row: return None
+    cache = json.loads(row[0])
+    return history_cache(self.history(index)) if cache is None else cache
+
+  def meta(self, index: int) -> dict | None:
+    with self._lock:
+      row = self._db.execute('SELECT meta FROM respondents WHERE idx = ?', (index,)).fetchone()
+    return json.loads(row[0]) if row else None
+
+  def answers(self):
+    """(index, {question name: answer}) for every respondent, in order"""
+    with self._lock:
+      rows = self._db.execute(
+        'SELECT a.idx, a.name, a.answer FROM answers a JOIN respondents r ON r.idx = a.idx ORDER BY a.idx, a.number'
+      ).fetchall()
+    index, row = None, {}
+    for idx, name, answer in rows:
+      if idx != index:
+        if index is not None: yield index, row
+        index, row = idx, {}
+      row[name] = json.loads(answer)
+    if index is not None: yield index, row
+
+  def span(self) -> tuple[float, float] | None:
+    """When the first turn started and the last one ended, over all respondents"""
+    with self._lock:
+      row = self._db.execute('SELECT MIN(start), MAX(start + elapsed) FROM turns').fetchone()
+    return None if row[0] is None else (row[0], row[1])
+
+  def import_legacy(self, path_quizzes: Path) -> int:
+    """Load respondents saved in the old quizzes/<n>/ layout; returns how many"""
+    count = 0
+    for folder in sorted(os.listdir(path_quizzes)) if path_quizzes.is_dir() else []:
+      path = path_quizzes / folder
+      if not folder.isdigit() or not (path / 'done').exists(): continue
+      with (path / 'history.json').open(encoding='utf-8') as f: history = json.load(f)
+      with (path / 'questions.json').open(encoding='utf-8') as f: questions = json.load(f)
+      cache = {}
+      if (path / 'cache.json').exists():
+        with (path / 'cache.json').open(encoding='utf-8') as f: cache = json.load(f)
+      self.save(int(folder), history, questions, cache, legacy_meta(path))
+      count += 1
+    return count
+
+  def export_legacy(self, path_quizzes: Path, indexes=None) -> None:
+    """Write respondents out in the old quizzes/<n>/ layout"""
+    for index in sorted(self.done() if indexes is None else indexes):
+      path = path_quizzes / str(index)
+      export_dialog(path, self.history(index), self.meta(index))
+      with (path / 'cache.json').open('w', encoding='utf-8') as f: json.dump(self.cache(index), f, indent=4)
+      with (path / 'history.json').open('w', encoding='utf-8') as f: json.dump(self.history(index), f, indent=4)
+      with (path / 'questions.json').open('w', encoding='utf-8') as f: json.dump(self.questions(index), f, indent=4)
+      with (path / 'done').open('w', encoding='utf-8') as f: f.write('')
+
+def history_cache(history: list[dict]) -> dict:
+  """The prompt => raw reply cache (see Dialog.cache) that a dialog's history amounts to"""
+  cache, prompt = {}, None
+  for h in history:
+    if h['role'] == 'user': prompt = h['raw']
+    elif prompt is not None: cache[prompt] = h['raw']
+  return cache
+
+def legacy_meta(path: Path) -> dict:
+  """The meta data an old-style quiz kept at the end of its dialog.js"""
+  path_js = path / 'dialog.js'
+  if not path_js.exists(): return {}
+  text = path_js.read_text(encoding='utf-8')
+  marker = 'document.quizzinator.meta = '
+  if marker not in text: return {}
+  return json.loads(text.split(marker, 1)[1].strip().rstrip(';'))
+
+def export_dialog(path: Path, history: list[dict], meta: dict) -> None:
+  """The html viewer for one respondent's dialog"""
+  path.mkdir(parents=True, exist_ok=True)
+  for name in ('index.html', 'styles.css', 'scripts.js'):
+    shutil.copy(DIALOG_TEMPLATES / name, path / name)
+  with open(path / 'dialog.js', "w", encoding="utf-8") as f:
+    f.write("document.quizzinator.dialog = ")
+    json.dump(history, f, indent=2, sort_keys=True)
+    f.write(';\n')
+
+    f.write("document.quizzinator.meta = ")
+    json.dump(meta, f, indent=2, sort_keys=True)
+    f.write(';\n')
+
+def viewer_pack(value) -> str:
+  """JSON, gzipped and base64-encoded so it can sit in a js string"""
+  text = json.dumps(value, separators=(',', ':'), default=str)
+  return base64.b64encode(gzip.compress(text.encode('utf-8'), mtime=0)).decode('ascii')
+
+def export_viewer(path: Path, store: ExperimentStore, shard_size: int = VIEWER_SHARD_SIZE, workers: int = 1, shards=None) -> None:
+  """
+  The shared dialog viewer for an experiment's html: one copy of the page,
+  which shows the respondent given as index.html?id=N, and every respondent's
+  dialog and meta data packed by viewer_pack, shard_size respondents to a
+  shard (shards/<N // shard_size>.js), fetched only when someone looks.
+  Shards are independent of each other, so workers of them are written at
+  once; given shards, only those are rewritten.
+  """
+  path_shards = path / 'shards'
+  path_shards.mkdir(parents=True, exist_ok=True)
+  for name in ('index.html', 'styles.css', 'scripts.js'):
+    shutil.copy(VIEWER_TEMPLATES / name, path / name)
+  with open(path / 'manifest.js', 'w', encoding='utf-8') as f:
+    f.write(f"document.quizzinator.viewer = {json.dumps({'shard_size': shard_size})};\n")
+
+  indexes = {}
+  for index in sorted(store.done()):
+    if shards is None or index // shard_size in shards:
+      indexes.setdefault(index // shard_size, []).append(index)
+
+  def write(shard):
+    packed = {str(i): viewer_pack({'dialog': store.history(i), 'meta': store.meta(i)}) for i in indexes[shard]}
+    # written aside and moved into place, so the page never loads half a shard
+    path_tmp = path_shards / f'{shard}.js.{os.getpid()}.tmp'
+    with open(path_tmp, 'w', encoding='utf-8') as f:
+      f.write(f'document.quizzinator.shards[{shard}] = ')
+      json.dump(packed, f, separators=(',', ':'))
+      f.write(';\n')
+    os.replace(path_tmp, path_shards / f'{shard}.js')
+
+  with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+    for future in [pool.submit(write, shard) for shard in indexes]: future.result()
+
+def store_open(path_experiment: Path, shared: bool = False) -> ExperimentStore:
+  """The experiment's store, bringing in any respondents from the old layout the first time"""
+  path = path_experiment / 'experiment.sqlite'
+  fresh = not path.exists()
+  store = ExperimentStore(path, shared)
+  if fresh and (path_experiment / 'quizzes').is_dir():
+    count = store.import_legacy(path_experiment / 'quizzes')
+    if count: logger.info(f"Imported {count:,} finished quizzes from {path_experiment / 'quizzes'}")
+  return store
+
+def store_copy(path: Path, path_copy: Path, texts: bool = True) -> ExperimentStore:
+  """
+  A store on a copy, at path_copy, of the experiment.sqlite at path - and,
+  with texts, of its experiment.blob - made over a read-only connection, so
+  the original is only ever read: opening it as a store would change its
+  journal mode and migrate it, which fails on a read-only experiment and
+  changes any other.
+  """
+  path, path_copy = Path(path), Path(path_copy)
+  uri = path.resolve().as_uri()
+  try:
+    source = sqlite3.connect(f'{uri}?mode=ro', uri=True)
+    source.execute('SELECT 1 FROM sqlite_master').fetchall()
+  except sqlite3.OperationalError:
+    # a WAL database whose directory we can't write in can't be opened for
+    # reading either (there is nowhere for its -shm); nobody can be writing it
+    source = sqlite3.connect(f'{uri}?immutable=1', uri=True)
+  copy = sqlite3.connect(path_copy)
+  try:
+    source.backup(copy)
+  finally:
+    source.close()
+    copy.close()
+  if texts and path.with_suffix('.blob').exists():
+    shutil.copyfile(path.with_suffix('.blob'), path_copy.with_suffix('.blob'))
+  return ExperimentStore(path_copy)
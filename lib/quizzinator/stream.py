@@ -0,0 +1,242 @@
+import re
+
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from .string import clean_text
+from .utils import RepeatDetector, RepetitionError
+
+@dataclass
+class Reply:
+  """One response from the LLM, already split into its sections"""
+  raw: str
+  think: str
+  content: str
+  # the model was still going once the answer was known, and was cut off (--early-stop)
+  truncated: bool = False
+
+# the tail of a chunk that might be the start of an escape sequence
+_PARTIAL_ESCAPE = re.compile(r'(?:\x9B|\x1B\[?)[0-?]*[ -/]*\Z')
+
+class StreamCleaner:
+  """
+  Apply string.clean_text to a stream, one chunk at a time.
+
+  The only rules that can straddle two chunks are escape sequences and
+  '\r\n', so the cleaner holds back a partial escape sequence or a trailing
+  '\r' until the next chunk (or flush) shows how it ends.
+  """
+  def __init__(self):
+    self._carry = ''
+
+  def feed(self, chunk: str) -> str:
+    text = self._carry + chunk
+    self._carry = ''
+    tail = max(0, len(text) - 64)
+    m = _PARTIAL_ESCAPE.search(text, tail) if text.find('\x1b', tail) >= 0 or text.find('\x9b', tail) >= 0 else None
+    if m:
+      self._carry = text[m.start():]
+      text = text[:m.start()]
+    text = clean_text(text)
+    if text.endswith('\r'):
+      self._carry = '\r' + self._carry
+      text = text[:-1]
+    return text
+
+  def flush(self) -> str:
+    text, self._carry = self._carry, ''
+    return clean_text(text)
+
+class StreamParser:
+  """
+  Incremental parser for the stream of text coming back from the LLM.
+
+  Each chunk is cleaned and scanned exactly once. The parser tracks which
+  section it is in - the noise before '<think>', the reasoning, the answer -
+  and stops at the REPL's '>>> ' prompt marker. It reproduces what
+  Ollama._clean followed by Dialog.think_and_response would make of the whole
+  buffer, without ever rescanning it.
+
+  on_token(section, text) is called with each new piece of 'think' or
+  'answer' text, and on_section(section) whenever the parser moves into a new
+  section ('think', 'answer' or 'done').
+
+  stop(answer) is asked, each time a line of the answer is complete, whether
+  the answer so far is all we need. Once it says yes the parser is settled:
+  it ignores everything else up to the prompt marker. If the model carries on
+  after that, the parser is truncated, and the caller should cancel the
+  generation; a reply that simply ends with the answer is not.
+
+  repeats, if given, watches the reasoning and the answer as they come in;
+  feed raises RepetitionError as soon as the LLM is caught going in circles.
+  """
+  PREAMBLE = 'preamble'
+  THINK = 'think'
+  ANSWER = 'answer'
+  DONE = 'done'
+
+  THINK_OPEN = '<think>'
+  THINK_CLOSE = '</think>'
+
+  def __init__(
+      self,
+      prompt: str | None = '>>> ',
+      on_token: Optional[Callable[[str, str], None]] = None,
+      on_section: Optional[Callable[[str], None]] = None,
+      stop: Optional[Callable[[str], bool]] = None,
+      repeats: Optional[RepeatDetector] = None,
+  ):
+    """
+    prompt - the marker that ends the response; None for streams that just end
+    """
+    self.prompt = prompt
+    self.on_token = on_token
+    self.on_section = on_section
+    self.stop = stop
+    self.repeats = repeats
+
+    self.state = self.PREAMBLE
+    self.settled = False
+    self.truncated = False
+    self.size = 0
+    self._cleaner = StreamCleaner()
+    self._markers = [m for m in (self.THINK_OPEN, self.THINK_CLOSE, prompt) if m]
+    self._hold = max(len(m) for m in self._markers) - 1
+    self._pending = ''
+
+    # the cleaned text of each section, and of the whole response
+    self._preamble: list[str] = []
+    self._think: list[str] = []
+    self._answer: list[str] = []
+    self._raw: list[str] = []
+
+  @property
+  def done(self) -> bool:
+    return self.state == self.DONE
+
+  def text(self) -> str:
+    """The cleaned response so far"""
+    return ''.join(self._raw)
+
+  def feed(self, chunk: str) -> bool:
+    """Consume the next chunk of output; returns True once the response is over"""
+    if self.done: return True
+    self.size += len(chunk)
+    self._scan(self._cleaner.feed(chunk), final=False)
+    self._check_repeats()
+    return self.done
+
+  def finish(self) -> Reply:
+    """The stream has ended - use everything left over and return the reply"""
+    if not self.done:
+      self._scan(self._cleaner.flush(), final=True)
+      self._check_repeats()
+      if not self.done: self._enter(self.DONE)
+    return self.result()
+
+  def _check_repeats(self) -> None:
+    if self.repeats and self.repeats.tripped:
+      r = self.repeats
+      raise RepetitionError(
+        f"LLM is repeating itself - {r.count:,} times '{r.repeat}'",
+        r.repeat, r.count, self.text()
+      )
+
+  def result(self) -> Reply:
+    think = ''.join(self._think).strip()
+    content = ''.join(self._answer).strip()
+    if self.state == self.DONE and not self._think and not self._answer:
+      # never saw a tag at all, so it is all answer
+      content = ''.join(self._preamble).strip()
+    return Reply(raw=''.join(self._raw).strip(), think=think, content=content, truncated=self.truncated)
+
+  def _enter(self, state: str) -> None:
+    if state == self.DONE and self._unclosed:
+      # a <think> that was never closed is, like think_and_response says, all answer
+      self._answer = [self.THINK_OPEN] + self._think
+      self._think = []
+    self.state = state
+    if self.on_section: self.on_section(state)
+
+  @property
+  def _unclosed(self) -> bool:
+    return self.state == self.THINK
+
+  def _emit(self, text: str) -> None:
+    if not text: return
+    if self.settled:
+      # all that matters now is whether the model is still saying anything
+      if text.strip(): self.truncated = True
+      return
+    if self.stop and self.state == self.ANSWER:
+      # only whole lines are checked, so 'Answer: 1' is not taken from
+      # 'Answer: 12', and nothing after the line that settles it is kept
+      while '\n' in text:
+        line, text = text.split('\n', 1)
+        self._add(line + '\n')
+        if self.stop(''.join(self._answer)[:-1]):
+          self.settled = True
+          self._emit(text)
+          return
+    self._add(text)
+
+  def _add(self, text: str) -> None:
+    if not text: return
+    self._raw.append(text)
+    if self.state == self.PREAMBLE:
+      self._preamble.append(text)
+      return
+    target = self._think if self.state == self.THINK else self._answer
+    target.append(text)
+    if self.repeats: self.repeats.feed(text)
+    if self.on_token: self.on_token(self.state, text)
+
+  def _scan(self, text: str, final: bool) -> None:
+    text = self._pending + text
+    self._pending = ''
+    pos = 0
+    while not self.done:
+      # the earliest marker still ahead of us
+      found, marker = -1, None
+      for m in self._markers:
+        i = text.find(m, pos)
+        if i >= 0 and (found < 0 or i < found):
+          found, marker = i, m
+      if marker is None:
+        # keep back anything that could be the start of a marker
+        keep = 0 if final else min(self._hold, len(text) - pos)
+        self._emit(text[pos:len(text) - keep])
+        self._pending = text[len(text) - keep:]
+        return
+      self._emit(text[pos:found])
+      pos = found + len(marker)
+      self._marker(marker)
+
+  def _marker(self, marker: str) -> None:
+    if marker == self.prompt:
+      self._enter(self.DONE)
+    elif self.settled:
+      self.truncated = True
+    elif marker == self.THINK_OPEN:
+      if self.state == self.PREAMBLE:
+        # everything before <think> is terminal noise
+        self._preamble = []
+        self._raw = [marker]
+        self._enter(self.THINK)
+      elif self.state == self.ANSWER:
+        self._emit(marker)
+      else:
+        self._raw.append(marker)
+    elif marker == self.THINK_CLOSE:
+      self._raw.append(marker)
+      if self.state == self.PREAMBLE:
+        # no opening tag (it was part of the prompt), so it was all reasoning
+        self._think = self._preamble
+        self._preamble = []
+        self._enter(self.ANSWER)
+      elif self.state == self.THINK:
+        self._enter(self.ANSWER)
+      else:
+        # another </think>: what we took for the answer was still reasoning
+        self._think += self._answer
+        self._answer = []
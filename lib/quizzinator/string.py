@@ -1,18 +1,31 @@
 import re, string
+
+# characters pythonify_string leaves alone; so is anything str.isspace()
+_PRINTABLE = frozenset(string.ascii_letters + string.digits + string.punctuation)
+
+class _Visible(dict):
+  """
+  The str.translate table of pythonify_string. There are too many unicode
+  characters to list, so each is looked up the first time it turns up and
+  remembered: after that, translating is all in C.
+  """
+  def __missing__(self, key: int) -> str:
+    c = chr(key)
+    value = c if c in _PRINTABLE or c.isspace() else '\\0' + oct(key)[2:]
+    self[key] = value
+    return value
+
+_VISIBLE = _Visible()
+
 def pythonify_string(s):
-  ret = ""
-  for char in s:
-    if char in string.ascii_letters or char in string.digits or \
-        char in string.punctuation or char.isspace():
-      ret += char
-    else:
-      ret += '\\0' + oct(ord(char))[2:]
-  return ret
+  return s.translate(_VISIBLE)
+
+# a terminal escape sequence
+_ESCAPES = re.compile(r'(?:\x9B|\x1B\[)[0-?]*[ -\/]*[@-~]')
 
 def remove_escape_sequences(text):
     """Removes any terminal escape sequences from a string"""
-    ansi_escape = re.compile(r'(\x9B|\x1B\[)[0-?]*[ -\/]*[@-~]')
-    return ansi_escape.sub('', text)
+    return _ESCAPES.sub('', text)
 
 
 def unicode_replacement(match):
@@ -21,3 +34,44 @@ def unicode_replacement(match):
 def escape_unicode(text):
   return re.sub(r'[^\x0d\x0a\x20-\x7E]', unicode_replacement, text)
 
+# the rules of clean_text that work on single characters: fold unicode quotes
+# and dashes to ASCII, drop braille progress spinners, and make the rest visible
+_FOLDS = {0x201C: '"', 0x201D: '"', 0x2018: "'", 0x2019: "'", 0x2014: '-', 0x2013: '-'}
+_CLEAN = _Visible({**_FOLDS, **dict.fromkeys(range(0x2800, 0x2900))})
+
+# str.translate goes through ASCII text in C, but any other text is looked up
+# in _CLEAN a character at a time; so the folds, which LLMs use all the time,
+# are made first, and what is left is translated in blocks, most of which are
+# then ASCII again
+_FOLD_PAIRS = [(chr(k), v) for k, v in _FOLDS.items()]
+_BLOCK = 256
+
+# the REPL's noise: escape sequences and the spinners drawn between them
+_NOISE = re.compile(r'(?:\x9B|\x1B\[)[0-?]*[ -\/]*[@-~]|[\u2800-\u28ff]+')
+
+def clean_text(text):
+  """
+  Normalize text coming back from the LLM: drop terminal escape sequences and
+  braille progress spinners, fold unicode quotes and dashes to ASCII, fix
+  newlines, and make any remaining strange characters visible.
+
+  The noise is one regex pass, over the text up to the last escape
+  character (it comes before the reply); the characters are one
+  str.translate; and then '\r\n' - including one that only came together
+  when escape sequences or spinners between them went - becomes '\n'.
+
+  Every rule works on single characters or on escape sequences, so this can
+  be applied to a stream chunk by chunk (see stream.StreamCleaner).
+  """
+  last = max(text.rfind('\x1b'), text.rfind('\x9b'))
+  if last >= 0:
+    # no escape sequence can run on past another escape character
+    m = _ESCAPES.match(text, last)
+    text = _NOISE.sub('', text[:last]) + text[m.end() if m else last:]
+  if not text.isascii():
+    for a, b in _FOLD_PAIRS: text = text.replace(a, b)
+  if text.isascii():
+    text = text.translate(_CLEAN)
+  else:
+    text = ''.join([text[i:i + _BLOCK].translate(_CLEAN) for i in range(0, len(text), _BLOCK)])
+  return text.replace('\r\n', '\n')
@@ -31,7 +31,7 @@ function renderQuizLinks() {
 
   quizIds.forEach(id => {
     const a = document.createElement("a");
-    a.href = `quizzes/${id}/index.html`;
+    a.href = `dialog/index.html?id=${id}`;
     a.textContent = id;
     a.style.marginRight = '0.5rem';
     quizLinks.appendChild(a);
@@ -6,9 +6,45 @@ window.onload = window.onload = function() {
   // ────────────────────────────────────────────────
   document.quizzinator = document.quizzinator || {};
   document.quizzinator.questions_selected = [];
+  document.quizzinator.data = document.quizzinator.data || {};
   main();
 }
 
+// ────────────────────────────────────────────────
+// 2) data.js only lists the experiments (the manifest);
+//    each experiment's responses are in their own shard,
+//    loaded the first time the experiment is ticked
+// ────────────────────────────────────────────────
+const shardsLoading = {};
+
+function loadExperiment(name) {
+  if (document.quizzinator.data[name]) return Promise.resolve();
+  if (!shardsLoading[name]) {
+    shardsLoading[name] = new Promise((resolve, reject) => {
+      // a <script> rather than fetch(), so the report also works from file://
+      const script = document.createElement('script');
+      script.src = document.quizzinator.manifest[name].shard;
+      script.onload = () => resolve();
+      script.onerror = () => {
+        delete shardsLoading[name];
+        reject(new Error(`Could not load ${script.src}`));
+      };
+      document.head.appendChild(script);
+    });
+  }
+  return shardsLoading[name];
+}
+
+function loadExperiments(names) {
+  return Promise.all(names.map(loadExperiment));
+}
+
+function checkedExperiments() {
+  return Array.from(
+    document.querySelectorAll('#experiments-container input[type=checkbox]:checked')
+  ).map(cb => cb.id.substring(2));
+}
+
 // ────────────────────────────────────────────────
 // 3) “Experiments” wiring is unchanged:
 //    clicking any of these re-runs update_comparisons()
@@ -23,7 +59,7 @@ window.onload = window.onload = function() {
 // -------------------------------------------------------------
 // Global array holding the fully sorted list of experiment keys.
 function main() {
-  const allKeys = Object.keys(document.quizzinator.data);
+  const allKeys = Object.keys(document.quizzinator.manifest || {});
 
   // 1) Anything starting with “humans” (case‐insensitive) goes to the bottom:
   const humanKeys = allKeys.filter(k => k.toLowerCase().startsWith('humans'));
@@ -130,11 +166,10 @@ function utils_save_div_to_svg(divId, outputFilename) {
 //    document.quizzinator.checkboxes and restores on redraw
 // ────────────────────────────────────────────────
 function update_comparisons() {
-  const checkedExps = Array.from(
-    document.querySelectorAll('#experiments-container input[type=checkbox]:checked')
-  ).map(cb => cb.id.substring(2));
+  const checkedExps = checkedExperiments();
 
-  refreshCommonQuestionsBasedOnExperiments(checkedExps);
+  return loadExperiments(checkedExps)
+    .then(() => refreshCommonQuestionsBasedOnExperiments(checkedExps));
 }
 
 function refreshCommonQuestionsBasedOnExperiments(experiments) {
@@ -757,9 +792,14 @@ function renderMultiHistograms() {
 document
   .getElementById('experiments-container')
   .addEventListener('change', () => {
-    renderHistograms();
-    renderMultiHistograms();
-    renderRawData();
+    // the shards of newly ticked experiments may still be on their way
+    loadExperiments(checkedExperiments())
+      .then(() => {
+        renderHistograms();
+        renderMultiHistograms();
+        renderRawData();
+      })
+      .catch(err => console.error(err));
   });
 
 document
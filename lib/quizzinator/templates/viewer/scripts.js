@@ -0,0 +1,171 @@
+// One viewer for every respondent of the experiment: index.html?id=N shows
+// respondent N, whose dialog is in shards/<N / shard_size>.js as gzipped,
+// base64-encoded JSON.
+window.addEventListener("DOMContentLoaded", () => {
+  const id = new URLSearchParams(window.location.search).get("id");
+  if (id == null) {
+    document.querySelector("#quizzinator_dialog tbody").textContent = "No respondent given (add ?id=N to the address)";
+    return;
+  }
+  renderNavigation(Number(id));
+  loadTranscript(id)
+    .then(({dialog, meta}) => {
+      renderMeta(meta || {});
+      renderDialog(dialog || [], meta || {});
+    })
+    .catch(err => {
+      document.querySelector("#quizzinator_dialog tbody").textContent = `Could not load respondent ${id}: ${err.message}`;
+    });
+});
+
+function loadShard(shard) {
+  if (document.quizzinator.shards[shard]) return Promise.resolve(document.quizzinator.shards[shard]);
+  return new Promise((resolve, reject) => {
+    // a <script> rather than fetch(), so the viewer also works from file://
+    const script = document.createElement("script");
+    script.src = `shards/${shard}.js`;
+    script.onload = () => resolve(document.quizzinator.shards[shard] || {});
+    script.onerror = () => reject(new Error(`missing ${script.src}`));
+    document.head.appendChild(script);
+  });
+}
+
+async function loadTranscript(id) {
+  const shard = Math.floor(Number(id) / document.quizzinator.viewer.shard_size);
+  const packed = (await loadShard(shard))[id];
+  if (packed == null) throw new Error("not in this experiment");
+  const bytes = Uint8Array.from(atob(packed), c => c.charCodeAt(0));
+  const stream = new Blob([bytes]).stream().pipeThrough(new DecompressionStream("gzip"));
+  return JSON.parse(await new Response(stream).text());
+}
+
+function renderNavigation(id) {
+  const nav = document.getElementById("quiz-nav");
+  [["← previous", id - 1], ["next →", id + 1]].forEach(([label, other]) => {
+    if (other < 0) return;
+    const a = document.createElement("a");
+    a.href = `?id=${other}`;
+    a.textContent = label;
+    nav.appendChild(a);
+  });
+}
+
+function renderMeta(meta) {
+  const tbodyMeta = document.querySelector("#quiz-meta-table tbody");
+  let started;
+  try {
+    const dt  = new Date(meta.start);
+    const z   = n => String(n).padStart(2, '0');
+    started = `${dt.getFullYear()}-${z(dt.getMonth()+1)}-${z(dt.getDate())}`
+            + ` ${z(dt.getHours())}:${z(dt.getMinutes())}:${z(dt.getSeconds())}`;
+  } catch { started = meta.start; }
+  const mins = Math.floor(meta.duration/60);
+  const secs = Math.floor(meta.duration%60);
+  const dur  = `${mins}m ${secs}s`;
+
+  [["Quiz", `${meta.index} of ${meta.size}`],
+   ["Started", started],
+   ["Duration", dur],
+   ["Model", meta.model]
+  ].forEach(([label, value]) => {
+    const tr = document.createElement("tr");
+    const td1 = document.createElement("td"); td1.textContent = label;
+    const td2 = document.createElement("td"); td2.textContent = value;
+    tr.append(td1, td2);
+    tbodyMeta.appendChild(tr);
+  });
+}
+
+function renderParagraphs(text, parent) {
+  (text || "")
+    .split(/\r?\n\s*\r?\n/)
+    .forEach(para => {
+      const p = document.createElement("p");
+      p.textContent = para.replace(/\r?\n/, " ");
+      parent.appendChild(p);
+    });
+}
+
+function renderThink(think, parent) {
+  // reasoning can run to many pages, so it is only laid out once opened
+  const details = document.createElement("details");
+  details.className = "think";
+  const summary = document.createElement("summary");
+  summary.textContent = `Reasoning (${think.length.toLocaleString()} characters)`;
+  details.appendChild(summary);
+  details.addEventListener("toggle", () => {
+    if (!details.open || details.dataset.rendered) return;
+    details.dataset.rendered = "1";
+    renderParagraphs(think, details);
+  });
+  parent.appendChild(details);
+}
+
+function renderDialog(dialog, meta) {
+  const tbodyDia  = document.querySelector("#quizzinator_dialog tbody");
+  const modelName = meta.model || "unknown model";
+
+  // Compute final answers
+  const finalAns = {};
+  dialog.forEach(e => {
+    const num = e.answer?.number;
+    const ans = e.answer?.answer;
+    if (num != null && ans != null) finalAns[num] = String(ans);
+  });
+
+  // Determine distinct questions and order
+  const questionNumbers = [...new Set(
+    dialog.map(e => e.answer?.number).filter(n => n != null)
+  )];
+  const totalQuestions = questionNumbers.length;
+
+  // Render Dialog
+  let lastQ = null;
+  dialog.forEach(entry => {
+    const qnum = entry.answer?.number ?? 0;
+    let qname  = (entry.answer?.name || "").replace(/^_/, '');
+    const displayIdx = questionNumbers.indexOf(qnum) + 1;
+    const tr   = document.createElement("tr");
+    tr.className = (displayIdx % 2 === 0) ? "even" : "odd";
+
+    // Question column
+    const tdQ = document.createElement("td");
+    if (qnum !== lastQ) {
+      const h1 = document.createElement("h1"); h1.textContent = qname;
+      const div = document.createElement("div"); div.textContent = `Question ${displayIdx} of ${totalQuestions}`;
+      tdQ.append(h1, div);
+      const fa = finalAns[qnum];
+      if (fa != null) {
+        const p = document.createElement("p");
+        const strong = document.createElement("strong"); strong.textContent = "Answer: ";
+        const preview = fa.length>20?fa.slice(0,20)+"…":fa;
+        p.append(strong, document.createTextNode(preview));
+        if (fa.length>20) { p.classList.add("tooltip"); p.dataset.tooltip = fa; }
+        tdQ.appendChild(p);
+      }
+      lastQ = qnum;
+    }
+    tr.appendChild(tdQ);
+
+    // Speaker column
+    const tdS = document.createElement("td");
+    const icon = document.createElement("i"); icon.classList.add("tooltip");
+    if (entry.role === "user") {
+      icon.classList.add("fa-solid","fa-chalkboard-user");
+      icon.dataset.tooltip = "Quizzinator administering the quiz";
+    } else {
+      icon.classList.add("fa-solid","fa-robot");
+      icon.dataset.tooltip = `AI running ${modelName}`;
+    }
+    tdS.appendChild(icon);
+    tr.appendChild(tdS);
+
+    // Content column
+    const tdC = document.createElement("td");
+    if (entry.role==="llm" && entry.think) renderThink(entry.think, tdC);
+    renderParagraphs(entry.content, tdC);
+
+    tr.appendChild(tdC);
+    tbodyDia.appendChild(tr);
+  });
+}
@@ -1,5 +1,7 @@
 import time, pprint, datetime
-from collections import Counter
+from collections import Counter, deque
+
+from .string import pythonify_string
 
 def timestamp_str() -> str:
     """YYYY-MM-DDThh-mm-ss"""
@@ -9,16 +11,6 @@ def pp(arg):
   pprint.pprint(arg, indent=2)
 
 
-def pythonify_string(s):
-    ret = ""
-    for char in s:
-        if char in string.ascii_letters or char in string.digits or \
-            char in string.punctuation or char.isspace():
-            ret += char
-        else:
-            ret += '\\0' + oct(ord(char))[2:]
-    return ret
-
 def ngram_repeat(text: str, L: int = 30, K: int = 2) -> dict[str,int]:
     """
     Returns the worst offender string and its count
@@ -40,6 +32,86 @@ def ngram_repeat(text: str, L: int = 30, K: int = 2) -> dict[str,int]:
 
     return ret[0]
 
+# (window, repeats) for RepeatDetector, by model name prefix - the longest
+# matching prefix wins. Small models loop far more often than big ones, so we
+# give up on them sooner.
+REPEAT_LIMITS = {
+    '': (40, 16),
+    'deepseek-r1:1.5b': (40, 8),
+    'deepseek-r1:7b': (40, 12),
+}
+
+def repeat_limits(model: str) -> tuple[int, int]:
+    """The (window, repeats) thresholds for this model"""
+    model = model.lower()
+    key = max((k for k in REPEAT_LIMITS if model.startswith(k)), key=len)
+    return REPEAT_LIMITS[key]
+
+class RepetitionError(TimeoutError):
+    """
+    The LLM got stuck saying the same thing over and over. It is a kind of
+    timeout (we gave up waiting for a real answer), and carries what the LLM
+    said so it can be saved for a post-mortem.
+    """
+    def __init__(self, message: str, repeat: str, count: int, buffer: str):
+        super().__init__(message)
+        self.repeat = repeat
+        self.count = count
+        self.buffer = buffer
+
+class RepeatDetector:
+    """
+    Incremental version of ngram_repeat: feed it text as it arrives and it
+    notices, in constant time per character, when any window of text has come
+    round more than repeats times.
+
+    Every window is reduced to a rolling (Rabin-Karp) hash, so moving the
+    window one character along is a multiply and an add rather than a new
+    string. Like ngram_repeat, windows of three or fewer distinct characters
+    (rules, padding, '....') are not counted.
+    """
+    BASE = 257
+    MOD = (1 << 61) - 1
+
+    def __init__(self, window: int = 40, repeats: int = 16):
+        self.window = window
+        self.repeats = repeats
+        self._top = pow(self.BASE, window - 1, self.MOD)
+        self._hash = 0
+        self._chars: deque[str] = deque()
+        self._distinct: Counter = Counter()
+        self._counts: dict[int, int] = {}
+
+        # set once the limit is passed
+        self.repeat = ''
+        self.count = 0
+
+    @property
+    def tripped(self) -> bool:
+        return self.count > self.repeats
+
+    def feed(self, text: str) -> bool:
+        """Take the next piece of text; returns True once it is repeating itself"""
+        if self.tripped: return True
+        for c in text:
+            if len(self._chars) == self.window:
+                old = self._chars.popleft()
+                self._hash = (self._hash - ord(old) * self._top) % self.MOD
+                self._distinct[old] -= 1
+                if not self._distinct[old]: del self._distinct[old]
+            self._chars.append(c)
+            self._distinct[c] += 1
+            self._hash = (self._hash * self.BASE + ord(c)) % self.MOD
+            if len(self._chars) < self.window or len(self._distinct) <= 3: continue
+
+            count = self._counts.get(self._hash, 0) + 1
+            self._counts[self._hash] = count
+            if count > self.repeats:
+                self.repeat = ''.join(self._chars)
+                self.count = count
+                return True
+        return False
+
 def human_duration(seconds: float, significance=2):
     """
     Convert an elapsed time in seconds to a human-readable string with a specified
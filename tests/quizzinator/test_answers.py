@@ -1,5 +1,8 @@
+import copy
 import pytest
-from quizzinator.answers import extract_llm_answer, pattern_consensus, evaluate_role_consistency
+from pathlib import Path
+from quizzinator.answers import extract_llm_answer, pattern_consensus, evaluate_role_consistency, extractor, AnswerExtractor, answer_schema
+from quizzinator.questions import parse_questions
 
 # Define a regex for numbers 1–12 and dash-separated sequences
 # Define a regex for numbers 1–12 (longest-first) and dash-separated sequences
@@ -111,3 +114,37 @@ def test_evaluate_role_consistency(hint, response, expected):
     if result != expected:
         print([hint, response, expected, result])
     assert result == expected
+
+
+def test_extractor_records_rule():
+    assert extractor(NUM_PATTERN).scan("Thinking it over.\nAnswer: (3)") == ('3', 'answer_parens')
+    single = AnswerExtractor('single', [1, 2, 3])
+    assert single.scan('', "**Final Answer:**Answer: 2", log=False) == (True, '2', 'final_answer')
+    assert single.scan('', "no idea", log=False) == (False, None, None)
+
+
+def test_questions_come_with_extractors():
+    questions = parse_questions(Path(__file__).parent / 'test_parser.txt')
+    for q in questions:
+        assert q.extractor.mode == q.mode
+    # copies of a question (make_full_questions) share the compiled extractor
+    assert copy.deepcopy(questions[0]).extractor is questions[0].extractor
+
+
+def test_answer_schema():
+    assert answer_schema('single', [1, 2])['properties']['answer'] == {'type': 'integer', 'enum': [1, 2]}
+    assert answer_schema('multi', [1, 2])['properties']['answer']['items']['enum'] == [1, 2]
+    assert answer_schema('free', []) is None
+
+
+def test_structured_replies():
+    single = AnswerExtractor('single', [1, 2, 3])
+    assert single.scan('', '{"answer": 2}', log=False) == (True, '2', 'schema')
+    # an illegal code in JSON is left to the answer rules, which find nothing here
+    assert single.scan('', '{"answer": 7}', log=False) == (False, None, None)
+    # and replies that aren't JSON are read as before
+    assert single.scan('', 'Answer: 3', log=False) == (True, '3', 'answer')
+    multi = AnswerExtractor('multi', [1, 2, 3])
+    assert multi.scan('', '{"answer": [3, 1, 3]}', log=False) == (True, ['1', '3'], 'schema')
+    date = AnswerExtractor('date', [])
+    assert date.scan('', '{"answer": "2020-02-29"}', log=False)[1].day == 29
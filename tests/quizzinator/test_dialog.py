@@ -101,4 +101,23 @@ def test_user_and_llm_history():
     assert user_entry['raw'] == 'prompt'
     assert user_entry['content'] == 'prompt'
     assert user_entry['think'] == ''
-    assert 'start' in user_entry
\ No newline at end of file
+    assert 'start' in user_entry
+
+def test_aquery_from_cache():
+    """The async query replays the cache exactly like the sync one."""
+    import asyncio
+    cache_file = Path(__file__).parent / 'test_dialog.json'
+    with open(cache_file) as f:
+        cache = json.load(f)
+
+    sync_dialog = Dialog(cache=cache)
+    async_dialog = Dialog(cache=cache)
+
+    async def replay():
+        return [await async_dialog.aquery(prompt) for prompt in (PROMPT1, PROMPT2)]
+
+    expected = [sync_dialog.query(prompt) for prompt in (PROMPT1, PROMPT2)]
+    for (user, llm), (e_user, e_llm) in zip(asyncio.run(replay()), expected):
+        assert user['content'] == e_user['content']
+        assert llm['think'] == e_llm['think']
+        assert llm['content'] == e_llm['content']
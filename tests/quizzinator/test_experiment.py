@@ -0,0 +1,50 @@
+import json
+
+from quizzinator.experiment import experiment_report
+
+def report_data(size):
+  return {'meta': {'model': 'm'}, 'responses': [{'number': str(i), 'Q': '1'} for i in range(size)]}
+
+def write(path_html, name, size):
+  (path_html / name).mkdir(parents=True, exist_ok=True)
+  (path_html / name / 'data.json').write_text(json.dumps(report_data(size)))
+
+def test_report_rewrites_only_the_experiment_that_ran(tmp_path):
+  write(tmp_path, 'a', 2)
+  write(tmp_path, 'b', 3)
+  experiment_report(tmp_path, 'a')
+  manifest = json.loads((tmp_path / 'manifest.json').read_text())
+  assert manifest['b'] == {'shard': 'shards/b.js', 'size': 3, 'model': 'm', 'start': None, 'end': None, 'questions': ['Q']}
+  assert (tmp_path / 'data.js').read_text().startswith('document.quizzinator.manifest = ')
+  assert (tmp_path / 'shards' / 'b.js').read_text().startswith('document.quizzinator.data["b"] = {"meta"')
+
+  # b has changed on disk but it was a that ran, so b's shard is left alone
+  write(tmp_path, 'b', 5)
+  write(tmp_path, 'a', 4)
+  experiment_report(tmp_path, 'a')
+  manifest = json.loads((tmp_path / 'manifest.json').read_text())
+  assert manifest['a']['size'] == 4 and manifest['b']['size'] == 3
+
+  # experiments whose html is gone drop out
+  (tmp_path / 'b' / 'data.json').unlink()
+  experiment_report(tmp_path, 'a')
+  assert list(json.loads((tmp_path / 'manifest.json').read_text())) == ['a']
+
+def test_prefix_keys_only_with_prefix_reuse(tmp_path):
+  from argparse import Namespace
+  from quizzinator.cli import cli_set_args
+  from quizzinator.experiment import experiment_prefix_order, experiment_prefix_key, experiment_quiz_meta, _prefix_keys
+  (tmp_path / 'setup').mkdir()
+  for name in ['human', 'identity', 'answers', 'consent']:
+    (tmp_path / 'setup' / f'{name}.txt').write_text(f'{name} text')
+  (tmp_path / 'hints.csv').write_text('number\n')
+  (tmp_path / 'questions.txt').write_text('---\nN: Q\nPick one\nA1: yes\n')
+  cli_set_args(Namespace(dir=tmp_path, hints=[], skip_identity=False, skip_setup=False, model='m', n=3, backend='pty'))
+  _prefix_keys.clear()
+
+  # without --prefix-reuse nobody works the preamble out again for each quiz
+  assert 'prefix' not in experiment_quiz_meta(0, 'now', 0.0)
+
+  todo = experiment_prefix_order([[i, True] for i in range(3)])
+  assert [index for index, _ in todo] == [0, 1, 2]
+  assert [experiment_quiz_meta(i, 'now', 0.0)['prefix'] for i in range(3)] == [experiment_prefix_key(0)] * 3
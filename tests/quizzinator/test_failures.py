@@ -0,0 +1,31 @@
+import json
+from argparse import Namespace
+
+from quizzinator.cli import cli_set_args
+from quizzinator.answers import AnswerExtractor
+from quizzinator.failures import FailureLog, failures_load, failures_clusters, prompt_hash
+
+def test_failures_are_compact_and_clustered(tmp_path):
+  cli_set_args(Namespace(dir=tmp_path, experiment='e1'))
+  log = FailureLog(tmp_path / 'failures')
+  single = AnswerExtractor('single', [1, 2, 3])
+  preamble = 'A very long setup text. ' * 500
+  for text in ('Answer: 1 or Answer: 2', 'Answer: 2 or maybe Answer: 3', 'no idea'):
+    ok, _, _ = single.scan(preamble, text, log=False)
+    assert not ok
+    log.record('Q1', 'single', preamble, text, single.signature(text))
+  log.close()
+
+  # the prompt is kept once, and the lines only point to it
+  assert (tmp_path / 'failures' / 'prompts' / f'{prompt_hash(preamble)}.txt').read_text() == preamble
+  lines = (tmp_path / 'failures' / 'failures.jsonl').read_text().splitlines()
+  assert len(lines) == 3 and all(len(line) < len(preamble) // 10 for line in lines)
+
+  failures = failures_load(tmp_path)
+  assert [r['experiment'] for r in failures] == ['e1'] * 3
+  assert failures_load(tmp_path, ['e2']) == []
+  clusters = failures_clusters(failures)
+  assert [(key, len(records)) for key, records in clusters] == [
+    (('Q1', 'single', 'answer*'), 2),
+    (('Q1', 'single', 'none'), 1),
+  ]
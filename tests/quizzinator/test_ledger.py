@@ -0,0 +1,46 @@
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from quizzinator.ledger import Ledger
+from quizzinator.store import ExperimentStore
+
+def test_runs_share_the_work(tmp_path):
+  # two runs with their own connections, as two processes would have
+  stores = [ExperimentStore(tmp_path / 'experiment.sqlite') for _ in range(2)]
+  ledgers = [Ledger(store, ttl=60) for store in stores]
+
+  def claim(ledger):
+    return [i for i in range(50) if ledger.acquire(i)]
+
+  with ThreadPoolExecutor(2) as pool:
+    claimed = list(pool.map(claim, ledgers))
+  assert sorted(claimed[0] + claimed[1]) == list(range(50))
+  for store in stores: store.close()
+
+def test_heartbeat_keeps_leases(tmp_path):
+  store = ExperimentStore(tmp_path / 'experiment.sqlite')
+  with Ledger(store, ttl=0.3) as ledger:
+    assert ledger.acquire(0)
+    time.sleep(0.6)
+    assert not Ledger(store).acquire(0)
+  time.sleep(0.4)
+  assert Ledger(store).acquire(0)
+  store.close()
+
+def test_reset_keeps_the_checkpoints_of_other_runs(tmp_path):
+  store = ExperimentStore(tmp_path / 'experiment.sqlite')
+  turn = {'role': 'user', 'content': 'pick'}
+  store.log_append(1, [turn])
+  first = Ledger(store, ttl=60)
+  assert first.acquire(0)
+  store.log_append(0, [turn])
+
+  # a run started with --reset leaves 0 to the run quizzing it
+  reset = Ledger(store, ttl=60, redo=True)
+  assert not reset.acquire(0)
+  assert store.log(0) == [turn]
+  # and starts 1, which nobody holds, from scratch
+  assert reset.acquire(1)
+  assert store.log(1) == []
+  store.close()
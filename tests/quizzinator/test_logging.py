@@ -101,3 +101,22 @@ def test_progress_no_steps(capsys):
     assert any("Step 2 | second" in l for l in lines)
     # Footer
     assert any("NoSteps completed in" in l for l in lines)
+
+
+def test_progress_steps_from_threads(capsys):
+    import threading
+    logger = Logger()
+    with logger.progress("Threads", steps=40) as prog:
+        def work():
+            # indenting inside a worker must not leak into the other threads
+            with logger.section("Worker"):
+                for i in range(10):
+                    prog.step(f"w{i}")
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for t in threads: t.start()
+        for t in threads: t.join()
+    assert prog.current == 40
+    assert logger.indent_level == 0
+    lines = clean_output(capsys.readouterr().out)
+    assert len([l for l in lines if "Step " in l]) == 40
+    assert any("Step 40/40" in l for l in lines)
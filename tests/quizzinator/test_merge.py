@@ -0,0 +1,46 @@
+from argparse import Namespace
+
+from quizzinator.cli import cli_set_args
+from quizzinator.merge import merge_open, merge_respondents
+from quizzinator.store import ExperimentStore
+
+def turn(role, raw):
+  return {
+    'role': role, 'raw': raw, 'content': raw, 'think': '', 'start': 1.0, 'elapsed': 1.0,
+    'answer': {'name': 'Q1', 'number': 1, 'answer': '1', 'ok': True},
+  }
+
+def respondent(store, index, reply):
+  history = [turn('user', 'pick'), turn('llm', reply)]
+  store.save(index, history, {}, {}, {'index': index})
+
+def test_duplicates_dropped_and_hint_profiles_kept(tmp_path):
+  cli_set_args(Namespace(workers=4))
+  a = ExperimentStore(tmp_path / 'a.sqlite')
+  b = ExperimentStore(tmp_path / 'b.sqlite')
+  for i, reply in enumerate(['x', 'y', 'z']): respondent(a, i, reply)
+  # host b ran 0 again (a duplicate), and 1 and 2 with other replies
+  for i, reply in enumerate(['x', 'v', 'w']): respondent(b, i, reply)
+
+  merged = [(index, r['index'], r['history'][1]['raw']) for index, r in merge_respondents([a, b], 2)]
+  # new numbers keep old number % 2, the hint profile the respondent was given
+  assert merged == [(0, 0, 'x'), (1, 1, 'y'), (2, 2, 'z'), (3, 1, 'v'), (4, 2, 'w')]
+
+  # without hints they are just numbered in order
+  assert [index for index, _ in merge_respondents([a, b], 0)] == [0, 1, 2, 3, 4]
+  a.close()
+  b.close()
+
+def test_sources_are_left_alone(tmp_path):
+  source = tmp_path / 'source'
+  store = ExperimentStore(source / 'experiment.sqlite', shared=True)
+  respondent(store, 0, 'x')
+  store.close()
+  before = {p.name: p.read_bytes() for p in source.iterdir()}
+
+  (tmp_path / 'tmp').mkdir()
+  copy = merge_open(source, tmp_path / 'tmp')
+  assert copy.history(0)[1]['raw'] == 'x'
+  copy.close()
+  # no WAL switched on, no files made, nothing written
+  assert {p.name: p.read_bytes() for p in source.iterdir()} == before
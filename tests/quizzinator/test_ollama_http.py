@@ -0,0 +1,187 @@
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from quizzinator.ollama_http import OllamaHttp, AsyncOllamaHttp
+from quizzinator.dialog import Dialog
+from quizzinator.utils import RepetitionError
+
+class StubOllama(BaseHTTPRequestHandler):
+  """Just enough of the ollama server to answer streamed /api/chat requests."""
+  protocol_version = 'HTTP/1.1'
+
+  def do_POST(self):
+    body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+    self.server.requests.append(body)
+    self.server.peers.add(self.client_address)
+    parts = self.server.replies.pop(0)
+    lines = [
+      json.dumps({
+        'model': body['model'],
+        'created_at': '2025-01-01T00:00:00Z',
+        'message': {'role': 'assistant', 'content': content, 'thinking': thinking},
+        'done': False,
+      })
+      for thinking, content in parts
+    ]
+    lines.append(json.dumps({
+      'model': body['model'],
+      'created_at': '2025-01-01T00:00:00Z',
+      'message': {'role': 'assistant', 'content': ''},
+      'done': True,
+    }))
+    data = ('\n'.join(lines) + '\n').encode('utf-8')
+    self.send_response(200)
+    self.send_header('Content-Type', 'application/x-ndjson')
+    self.send_header('Content-Length', str(len(data)))
+    self.end_headers()
+    self.wfile.write(data)
+
+  def log_message(self, *args):
+    pass
+
+@pytest.fixture
+def server():
+  s = ThreadingHTTPServer(('127.0.0.1', 0), StubOllama)
+  s.requests = []
+  s.peers = set()
+  s.replies = []
+  thread = threading.Thread(target=s.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+  thread.start()
+  yield s
+  s.shutdown()
+  s.server_close()
+
+def host(server):
+  return f'http://127.0.0.1:{server.server_address[1]}'
+
+def test_query_joins_thinking_and_content(server):
+  server.replies.append([('I should ', ''), ('say 3', ''), ('', 'Answer: '), ('', '3')])
+  o = OllamaHttp(host=host(server))
+  raw = o.query('pick a number')
+  assert raw == '<think>\nI should say 3\n</think>\n\nAnswer: 3'
+  assert Dialog.think_and_response(raw) == ('I should say 3', 'Answer: 3')
+
+def test_query_keeps_inline_think(server):
+  # older servers leave the reasoning inline in the content
+  server.replies.append([('', '<think>\nhmm\n</think>\n\n'), ('', 'Answer: 2')])
+  o = OllamaHttp(host=host(server))
+  assert Dialog.think_and_response(o.query('pick')) == ('hmm', 'Answer: 2')
+
+def test_conversation_and_keep_alive(server):
+  server.replies.append([('', 'first')])
+  server.replies.append([('', 'second')])
+  o = OllamaHttp(model='m:1b', host=host(server))
+  o.query('one')
+  o.query('two')
+
+  # the whole conversation goes up each turn
+  assert [m['content'] for m in server.requests[1]['messages']] == ['one', 'first', 'two']
+  assert server.requests[1]['model'] == 'm:1b'
+  assert server.requests[1]['stream'] is True
+
+  # and both turns went over the same connection
+  assert len(server.peers) == 1
+
+def test_kill_and_restart(server):
+  server.replies.append([('', 'first')])
+  o = OllamaHttp(host=host(server))
+  o.query('one')
+  o.restart()
+  assert o.alive()
+  assert o.messages == []
+  o.kill()
+  assert not o.alive()
+
+def test_unreachable_server_times_out():
+  o = OllamaHttp(host='http://127.0.0.1:9', timeout=1)
+  with pytest.raises(TimeoutError):
+    o.query('anyone there?')
+
+def test_dialog_uses_http_backend(server):
+  server.replies.append([('thinking', ''), ('', 'Answer: 4')])
+  dialog = Dialog(timeout=5, backend='http')
+  dialog.ollama().host = host(server)
+  dialog.ollama().restart()
+  user, llm = dialog.query('pick')
+  assert llm['think'] == 'thinking'
+  assert llm['content'] == 'Answer: 4'
+  dialog.kill()
+
+def test_dialog_unknown_backend():
+  with pytest.raises(ValueError):
+    Dialog(backend='carrier-pigeon')
+
+def test_async_query_and_conversation(server):
+  server.replies.append([('let me see', ''), ('', 'Answer: 1')])
+  server.replies.append([('', 'Answer: 2')])
+
+  async def talk():
+    o = AsyncOllamaHttp(host=host(server))
+    first = await o.query('one')
+    second = await o.query('two')
+    await o.kill()
+    return first, second
+
+  first, second = asyncio.run(talk())
+  assert Dialog.think_and_response(first) == ('let me see', 'Answer: 1')
+  assert second == 'Answer: 2'
+  assert [m['content'] for m in server.requests[1]['messages']] == ['one', 'Answer: 1', 'two']
+
+def test_dialog_async_needs_async_backend():
+  with pytest.raises(ValueError):
+    Dialog(backend='pty').aollama()
+
+def test_early_stop_closes_the_stream(server):
+  server.replies.append([('hmm', ''), ('', 'Answer: 2\n'), ('', 'and on and on\n'), ('', 'forever')])
+  o = OllamaHttp(host=host(server))
+  reply = o.chat('pick', stop=lambda answer: 'Answer: 2' in answer)
+  assert reply.truncated
+  assert reply.content == 'Answer: 2'
+  assert o.messages[-1]['content'] == 'Answer: 2'
+
+def test_schema_is_sent_as_the_format(server):
+  server.replies.append([('hmm', ''), ('', '{"answer": 2}')])
+  server.replies.append([('', 'Answer: 1')])
+  dialog = Dialog(timeout=5, backend='http')
+  dialog.ollama().host = host(server)
+  dialog.ollama().restart()
+  schema = {'type': 'object', 'properties': {'answer': {'type': 'integer'}}, 'required': ['answer']}
+  _, llm = dialog.query('pick', format=schema)
+  assert llm['content'] == '{"answer": 2}'
+  assert server.requests[0]['format'] == schema
+  dialog.query('pick again')
+  assert 'format' not in server.requests[1]
+  dialog.kill()
+
+def test_looping_reply_is_cut_off(server):
+  server.replies.append([('Wait, is it 3 or 4? ', '')] * 200 + [('', 'Answer: 3')])
+  o = OllamaHttp(host=host(server))
+  with pytest.raises(RepetitionError):
+    o.chat('pick')
+  assert not o.alive()
+
+def test_stored_turns_are_primed_into_the_conversation(server, tmp_path):
+  from quizzinator.response_cache import ResponseCache
+  store = ResponseCache(tmp_path / 'r.sqlite')
+  server.replies.append([('', 'Answer: 1')])
+  first = Dialog(timeout=5, backend='http', store=store, respondent=0)
+  first.ollama().host = host(server)
+  first.ollama().restart()
+  first.query('one')
+  first.close()
+
+  # the first turn comes from the store, the second has to tell the server about it
+  server.replies.append([('', 'Answer: 2')])
+  second = Dialog(timeout=5, backend='http', store=store, respondent=0)
+  second.ollama().host = host(server)
+  second.ollama().restart()
+  assert second.query('one')[1]['content'] == 'Answer: 1'
+  assert second.query('two')[1]['content'] == 'Answer: 2'
+  second.close()
+  assert len(server.requests) == 2
+  assert [m['content'] for m in server.requests[1]['messages']] == ['one', 'Answer: 1', 'two']
+  store.close()
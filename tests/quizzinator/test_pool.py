@@ -0,0 +1,69 @@
+import sys
+
+from quizzinator.ollama import Ollama
+from quizzinator.dialog import Dialog
+from quizzinator.pool import SessionPool
+
+def fake_session():
+  return Ollama('fake', timeout=10, command=f"{sys.executable} -m quizzinator.fake_ollama --think 10")
+
+def test_sessions_are_reused():
+  pool = SessionPool(fake_session, 1)
+  try:
+    pool.warm()
+    assert pool.spawns == 1
+    first = pool.acquire()
+    pid = first.child.pid
+    assert first.chat('pick').content == 'Answer: 1'
+    pool.release(first)
+
+    second = pool.acquire()
+    assert second is first and second.child.pid == pid
+    assert second.chat('pick again').content == 'Answer: 1'
+    pool.release(second)
+
+    meta = pool.meta()
+    assert meta['spawns'] == 1
+    assert meta['resets'] == 2
+    assert meta['failures'] == 0
+  finally:
+    pool.close()
+  assert not first.alive()
+
+def test_dead_sessions_are_replaced():
+  pool = SessionPool(fake_session, 1)
+  try:
+    session = pool.acquire()
+    session.kill()
+    pool.release(session)
+    assert pool.failures == 1
+
+    fresh = pool.acquire()
+    assert fresh is not session and fresh.alive()
+    assert pool.spawns == 2
+    pool.release(fresh)
+  finally:
+    pool.close()
+
+def test_extra_sessions_are_killed():
+  pool = SessionPool(fake_session, 1)
+  try:
+    a, b = pool.acquire(), pool.acquire()
+    pool.release(a)
+    pool.release(b)
+    assert a.alive() and not b.alive()
+  finally:
+    pool.close()
+
+def test_dialog_borrows_from_pool():
+  pool = SessionPool(fake_session, 1)
+  try:
+    dialog = Dialog(model='fake', timeout=10, pool=pool)
+    user, llm = dialog.query('pick')
+    assert llm['content'] == 'Answer: 1'
+    session = dialog.ollama()
+    dialog.close()
+    assert session.alive()
+    assert Dialog(model='fake', timeout=10, pool=pool).ollama() is session
+  finally:
+    pool.close()
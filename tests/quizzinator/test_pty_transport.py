@@ -0,0 +1,101 @@
+import os
+import sys
+import time
+
+import pytest
+
+from quizzinator.ollama import Ollama
+from quizzinator.pty_transport import PtyTransport
+from quizzinator.dialog import Dialog
+from quizzinator.utils import RepetitionError
+
+def fake(**kwargs):
+  flags = ' '.join(f'--{k} {v}' for k, v in kwargs.items())
+  return f"{sys.executable} -m quizzinator.fake_ollama {flags}"
+
+def test_query_against_fake_repl():
+  o = Ollama('fake', timeout=10, command=fake(think=5000, answer="'Answer: 3'"))
+  try:
+    think, content = Dialog.think_and_response(o.query('pick a number'))
+    assert len(think) == 5000
+    assert content == 'Answer: 3'
+  finally:
+    o.kill()
+
+def test_huge_multiline_prompt_does_not_hang():
+  o = Ollama('fake', timeout=10, command=fake(think=10))
+  try:
+    prompt = '\n'.join(['some setup text that goes on and on'] * 2000)
+    t0 = time.time()
+    assert Dialog.think_and_response(o.query(prompt))[1] == 'Answer: 1'
+    assert Dialog.think_and_response(o.query(prompt))[1] == 'Answer: 1'
+    assert time.time() - t0 < 5
+  finally:
+    o.kill()
+
+def test_dead_repl_is_a_timeout():
+  o = Ollama('fake', timeout=10, command=fake())
+  o.child.kill(9)
+  o.child.wait()
+  with pytest.raises(TimeoutError):
+    o.query('anyone there?')
+  assert not o.alive()
+
+def test_transport_read_times_out():
+  master, slave = os.openpty()
+  try:
+    t = PtyTransport(master)
+    t0 = time.time()
+    assert t.read(0.05) == ''
+    assert time.time() - t0 >= 0.05
+    os.write(slave, 'ok ⠋'.encode('utf-8'))
+    assert t.read(1) == 'ok ⠋'
+  finally:
+    os.close(master)
+    os.close(slave)
+
+def test_early_stop_interrupts_the_repl():
+  # the full reply would take the fake REPL about 8 seconds to trickle out
+  o = Ollama('fake', timeout=10, command=fake(think=10, ramble=200000, chunk=256, delay=0.01))
+  try:
+    for prompt in ['pick a number', 'and again']:
+      t0 = time.time()
+      reply = o.chat(prompt, stop=lambda answer: 'Answer: 1' in answer)
+      assert reply.truncated
+      assert reply.content == 'Answer: 1'
+      assert time.time() - t0 < 2
+  finally:
+    o.kill()
+
+def test_early_stop_at_the_end_of_the_reply():
+  o = Ollama('fake', timeout=10, command=fake(think=10))
+  try:
+    for prompt in ['pick a number', 'and again']:
+      reply = o.chat(prompt, stop=lambda answer: 'Answer: 1' in answer)
+      assert not reply.truncated
+      assert reply.content == 'Answer: 1'
+    assert not o._interrupted
+  finally:
+    o.kill()
+
+def test_late_interrupt_keeps_the_repl_in_step():
+  o = Ollama('fake', timeout=10, command=fake(think=10, answer="'Answer: 3'", delay=0.05))
+  try:
+    assert o.chat('pick a number').content == 'Answer: 3'
+    # a ^C that only gets there once the reply is over; the REPL takes a
+    # moment to answer it, by which time the next prompt has been sent
+    o._interrupt()
+    for prompt in ['and again', 'once more']:
+      reply = o.chat(prompt)
+      assert reply.content == 'Answer: 3'
+      assert reply.think
+  finally:
+    o.kill()
+
+def test_looping_repl_is_killed():
+  o = Ollama('fake', timeout=10, command=fake(think=200000, loop=''))
+  with pytest.raises(RepetitionError) as e:
+    o.chat('pick a number')
+  assert not o.alive()
+  assert 'The user wants an answer.' in e.value.buffer
+  assert len(e.value.buffer) < 5000
@@ -0,0 +1,43 @@
+import time
+
+from pathlib import Path
+
+from quizzinator.questions import parse_questions
+from quizzinator.publisher import Publisher
+from quizzinator.results import ResultsTable, results_read
+from quizzinator.store import ExperimentStore
+
+QUESTIONS = parse_questions(Path(__file__).parent / 'test_parser.txt')
+
+def turn(role, raw, start):
+  return {
+    'role': role, 'raw': raw, 'content': raw, 'think': '', 'start': start, 'elapsed': 1.0,
+    'answer': {'name': 'PuPSafeword', 'number': 1, 'answer': '2', 'ok': True},
+  }
+
+def finish(store, publisher, index):
+  history = [turn('user', 'pick', index), turn('llm', 'Answer: 2', index + 0.5)]
+  store.save(index, history, {}, {}, {'index': index})
+  publisher.push(index, {'PuPSafeword': '2'}, history)
+
+def test_report_kept_current_while_running(tmp_path):
+  store = ExperimentStore(tmp_path / 'experiment.sqlite')
+  results = ResultsTable(tmp_path, QUESTIONS)
+  published = []
+  publisher = Publisher(store, results, tmp_path / 'dialog', lambda table, **extra: published.append((table.num_rows, extra)), interval=0.05, shard_size=2)
+  publisher.start()
+  finish(store, publisher, 0)
+  finish(store, publisher, 1)
+  for _ in range(100):
+    if published and published[-1][0] == 2: break
+    time.sleep(0.05)
+  # the report caught up with both respondents before the run was over
+  assert published[-1] == (2, {})
+  assert (tmp_path / 'dialog' / 'shards' / '0.js').exists()
+
+  finish(store, publisher, 4)
+  publisher.close(pool_meta={'spawns': 1})
+  assert published[-1] == (3, {'pool_meta': {'spawns': 1}})
+  assert sorted(p.name for p in (tmp_path / 'dialog' / 'shards').iterdir()) == ['0.js', '2.js']
+  assert results_read(tmp_path / 'results.parquet').column('number').to_pylist() == [0, 1, 4]
+  store.close()
@@ -10,7 +10,8 @@ from quizzinator.questions import (
     load_hints,
     build_question,
     build_prompt,
-    make_full_questions
+    make_full_questions,
+    preamble_key
 )
 
 # Paths to test data files
@@ -213,3 +214,8 @@ def test_build_question_ordering():
     assert lines[1] == ''
     assert lines[2:] == ['(1) First\n', '(2) Second\n', '(3) Third\n']
 
+
+def test_preamble_key():
+    assert preamble_key('m:1b', 'You are a person.') == preamble_key('m:1b', 'You are a person.')
+    assert preamble_key('m:1b', 'You are a person.') != preamble_key('m:7b', 'You are a person.')
+    assert preamble_key('m:1b', 'You are a person.') != preamble_key('m:1b', 'You are a robot.')
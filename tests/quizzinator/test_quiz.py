@@ -0,0 +1,98 @@
+from argparse import Namespace
+from pathlib import Path
+
+from quizzinator.questions import parse_questions
+from quizzinator.dialog import Dialog
+from quizzinator.store import ExperimentStore
+from quizzinator.cli import cli_set_args
+from quizzinator.quiz import quiz_turns, quiz_resume, quiz_checkpoint, quiz_rescore
+
+QUESTIONS = parse_questions(Path(__file__).parent / 'test_parser.txt')
+NAMES = ['PuPSafeword', 'RRSafeword']
+
+def run(dialog, replies, **kwargs):
+  """Drive quiz_turns with canned replies; returns the prompts it asked"""
+  asked = []
+  turns = quiz_turns(QUESTIONS, NAMES, {}, False, 2, **kwargs)
+  try:
+    prompt, _, _ = next(turns)
+    while True:
+      asked.append(prompt)
+      dialog.set_to_cache(prompt, replies.pop(0))
+      prompt, _, _ = turns.send(dialog.query(prompt))
+  except StopIteration:
+    pass
+  return asked
+
+def test_retry_only_asks_what_is_unanswered(tmp_path):
+  # bad answers are logged to <dir>/failures
+  cli_set_args(Namespace(dir=tmp_path))
+  experiment = ExperimentStore(tmp_path / 'experiment.sqlite')
+  first = Dialog(cache={})
+  run(first, ['Answer: 2', 'no idea', 'still no idea'], checkpoint=quiz_checkpoint(7, experiment))
+  assert len(experiment.log(7)) == 6
+
+  # the retry carries on from the log and only asks RRSafeword again
+  second = Dialog(cache={})
+  answered = quiz_resume(7, second, experiment)
+  assert answered == {'PuPSafeword'}
+  asked = run(second, ['Answer: 3'], answered=answered, checkpoint=quiz_checkpoint(7, experiment))
+  assert len(asked) == 1
+  # the failed answers to RRSafeword are not carried on with
+  assert len(second.history) == 4
+  assert [h['answer']['answer'] for h in second.history if h['role'] == 'llm'] == ['2', '3']
+
+  # the session is told about the resumed turns before it is asked anything
+  assert [m['content'] for m in second._unsent] == [first.history[0]['content'], 'Answer: 2']
+  experiment.close()
+
+def test_resume_keeps_the_preamble(tmp_path):
+  cli_set_args(Namespace(dir=tmp_path))
+  experiment = ExperimentStore(tmp_path / 'experiment.sqlite')
+  first = Dialog(cache={})
+  run(first, ['no idea', 'Answer: 2', 'no idea', 'still no idea'], checkpoint=quiz_checkpoint(7, experiment))
+
+  # the first question was only answered when asked again, but its first
+  # prompt is the one that starts the conversation
+  second = Dialog(cache={})
+  assert quiz_resume(7, second, experiment) == {'PuPSafeword'}
+  assert [h['content'] for h in second.history] == [h['content'] for h in first.history[:4]]
+  experiment.close()
+
+def test_repl_starts_afresh(tmp_path):
+  cli_set_args(Namespace(dir=tmp_path))
+  experiment = ExperimentStore(tmp_path / 'experiment.sqlite')
+  run(Dialog(cache={}), ['Answer: 2', 'no idea', 'still no idea'], checkpoint=quiz_checkpoint(7, experiment))
+
+  # the pty backend can't be handed the logged turns, so they are dropped
+  dialog = Dialog(backend='pty')
+  assert quiz_resume(7, dialog, experiment) == set()
+  assert dialog.history == [] and dialog._unsent == []
+  assert experiment.log(7) == []
+  experiment.close()
+
+def test_rescore_stored_history():
+  history = [
+    {'role': 'user', 'content': 'pick', 'answer': {'name': 'PuPSafeword', 'number': 0, 'count': 0, 'ok': False, 'answer': None}},
+    {'role': 'llm', 'content': 'Answer: 2', 'answer': {'name': 'PuPSafeword', 'number': 0, 'count': 0, 'ok': False, 'answer': None}},
+    {'role': 'user', 'content': 'pick', 'answer': {'name': 'Gone', 'number': 1, 'count': 0, 'ok': False, 'answer': None}},
+    {'role': 'llm', 'content': 'Answer: 1', 'answer': {'name': 'Gone', 'number': 1, 'count': 0, 'ok': True, 'answer': '1'}},
+  ]
+  specs = {q.name: (q.mode, [o.code for o in q.options]) for q in QUESTIONS}
+  turns, questions = quiz_rescore(history, specs)
+  # only the turn of a question that still exists is extracted again
+  assert list(turns) == [1]
+  assert turns[1]['ok'] and turns[1]['answer'] == '2' and history[1]['answer'] == turns[1]
+  assert questions['PuPSafeword']['answer'] == '2' and questions['Gone']['answer'] == '1'
+
+def test_structured_turns_carry_the_schema():
+  turns = quiz_turns(QUESTIONS, NAMES, {}, False, 2, structured=True)
+  prompt, _, schema = next(turns)
+  assert '{"answer": X}' in prompt
+  assert schema['properties']['answer']['type'] == 'integer'
+
+  # a reply that follows the schema is read as JSON
+  dialog = Dialog(cache={prompt: '{"answer": 2}'})
+  user, llm = dialog.query(prompt)
+  turns.send([user, llm])
+  assert llm['answer']['ok'] and llm['answer']['answer'] == '2' and llm['answer']['rule'] == 'schema'
@@ -0,0 +1,75 @@
+from quizzinator.rescore import rescore_diff
+
+def q(answer, ok=False):
+  # quiz_answers never sets ok, so only the answer tells
+  return {'answer': answer, 'ok': ok}
+
+def test_diff_counts():
+  counts = {}
+  rescore_diff({'A': q(None, False), 'B': q('1'), 'C': q(['1', '2'])}, {'A': q('2'), 'B': q('1'), 'C': q(['2'])}, counts)
+  rescore_diff({'A': q('1'), 'B': q('1')}, {'A': q(None, False), 'B': q('3'), 'C': q('1')}, counts)
+  assert counts['A'] == {'respondents': 2, 'parsed': 1, 'changed': 0, 'lost': 1}
+  assert counts['B'] == {'respondents': 2, 'parsed': 0, 'changed': 1, 'lost': 0}
+  # a question the respondent had no answer to before counts as newly parsed
+  assert counts['C'] == {'respondents': 2, 'parsed': 1, 'changed': 1, 'lost': 0}
+
+def test_in_place_refreshes_the_html(tmp_path):
+  import json, shutil
+  from argparse import Namespace
+  from pathlib import Path
+  from quizzinator.cli import cli_set_args, cli_get_args
+  from quizzinator.parser import parse_questions
+  from quizzinator.store import ExperimentStore
+  from quizzinator.rescore import rescore_experiment
+
+  shutil.copy(Path(__file__).parent / 'test_parser.txt', tmp_path / 'questions.txt')
+  path_experiment = tmp_path / 'experiments' / 'e'
+  path_experiment.mkdir(parents=True)
+  (path_experiment / 'meta.json').write_text(json.dumps({'questions': ['PuPSafeword']}))
+  store = ExperimentStore(path_experiment / 'experiment.sqlite')
+  failed = {'name': 'PuPSafeword', 'number': 0, 'count': 0, 'ok': False, 'answer': None}
+  history = [
+    {'role': 'user', 'raw': 'pick', 'content': 'pick', 'think': '', 'start': 1.0, 'elapsed': 0.0, 'answer': failed},
+    {'role': 'llm', 'raw': 'Answer: 2', 'content': 'Answer: 2', 'think': '', 'start': 1.0, 'elapsed': 1.0, 'answer': failed},
+  ]
+  store.save(0, history, {'PuPSafeword': failed}, {}, {'index': 0})
+  store.close()
+
+  args = Namespace(in_place=True, version='')
+  cli_set_args(args)
+  specs = {q.name: (q.mode, [o.code for o in q.options]) for q in parse_questions(tmp_path / 'questions.txt')}
+  counts = rescore_experiment(tmp_path, path_experiment, specs, 1)
+  assert counts['PuPSafeword']['parsed'] == 1
+  assert cli_get_args() is args
+
+  # the html shows the new answer too
+  path_html = tmp_path / 'html'
+  assert '2' in (path_html / 'e' / 'data.csv').read_text().splitlines()[1].split(',')
+  assert (path_html / 'e' / 'data.json').exists()
+  assert list((path_html / 'e' / 'dialog' / 'shards').glob('*.js'))
+  assert 'e' in json.loads((path_html / 'manifest.json').read_text())
+
+def test_dry_run_leaves_the_experiment_alone(tmp_path):
+  import shutil
+  from argparse import Namespace
+  from pathlib import Path
+  from quizzinator.cli import cli_set_args
+  from quizzinator.store import ExperimentStore
+  from quizzinator.rescore import rescore_experiment
+
+  shutil.copy(Path(__file__).parent / 'test_parser.txt', tmp_path / 'questions.txt')
+  path_experiment = tmp_path / 'experiments' / 'e'
+  store = ExperimentStore(path_experiment / 'experiment.sqlite', shared=True)
+  failed = {'name': 'PuPSafeword', 'number': 0, 'count': 0, 'ok': False, 'answer': None}
+  history = [
+    {'role': 'user', 'raw': 'pick', 'content': 'pick', 'think': '', 'start': 1.0, 'elapsed': 0.0, 'answer': failed},
+    {'role': 'llm', 'raw': 'Answer: 2', 'content': 'Answer: 2', 'think': '', 'start': 1.0, 'elapsed': 1.0, 'answer': failed},
+  ]
+  store.save(0, history, {'PuPSafeword': failed}, {}, {'index': 0})
+  store.close()
+  before = {p.name: p.read_bytes() for p in path_experiment.iterdir()}
+
+  cli_set_args(Namespace(in_place=False, version=''))
+  counts = rescore_experiment(tmp_path, path_experiment, {'PuPSafeword': ('single', [1, 2, 3, 4, 5])}, 1)
+  assert counts['PuPSafeword']['parsed'] == 1
+  assert {p.name: p.read_bytes() for p in path_experiment.iterdir()} == before
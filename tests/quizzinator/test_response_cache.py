@@ -0,0 +1,131 @@
+import json
+import sys
+
+from quizzinator.response_cache import ResponseCache
+from quizzinator.dialog import Dialog
+from quizzinator.ollama import Ollama
+
+def reply(text):
+  return {'raw': text, 'think': '', 'content': text, 'truncated': False}
+
+def test_get_and_put(tmp_path):
+  store = ResponseCache(tmp_path / 'r.sqlite')
+  key = ResponseCache.key('m', [('user', 'hi'), ('llm', 'hello')], 'pick', {'seed': 1})
+  assert store.get(key) is None
+  store.put(key, reply('Answer: 1'))
+  assert store.get(key)['content'] == 'Answer: 1'
+  assert store.stats()['hits'] == 1 and store.stats()['misses'] == 1
+  store.close()
+
+  # and it is still there next time
+  store = ResponseCache(tmp_path / 'r.sqlite')
+  assert store.get(key)['content'] == 'Answer: 1'
+  store.close()
+
+def test_key_covers_everything():
+  base = ResponseCache.key('m', [('user', 'hi')], 'pick', {'seed': 1})
+  assert base == ResponseCache.key('m', [('user', 'hi')], 'pick', {'seed': 1})
+  assert base != ResponseCache.key('m2', [('user', 'hi')], 'pick', {'seed': 1})
+  assert base != ResponseCache.key('m', [('user', 'hello')], 'pick', {'seed': 1})
+  assert base != ResponseCache.key('m', [('user', 'hi')], 'choose', {'seed': 1})
+  assert base != ResponseCache.key('m', [('user', 'hi')], 'pick', {'seed': 2})
+
+def test_least_recently_used_are_evicted(tmp_path):
+  size = len(json.dumps(reply('0' * 150)))
+  store = ResponseCache(tmp_path / 'r.sqlite', max_bytes=5 * size)
+  for i in range(5):
+    store.put(f'k{i}', reply(f'{i}' * 150))
+  # k0 was used recently, so k1 goes first
+  store.get('k0')
+  store.put('k5', reply('5' * 150))
+  assert store.get('k0') is not None
+  assert store.get('k1') is None
+  assert store.stats()['evictions'] >= 1
+  assert store.stats()['bytes'] <= 5 * size
+  store.close()
+
+def test_dialog_reuses_stored_turns(tmp_path):
+  store = ResponseCache(tmp_path / 'r.sqlite')
+  command = f"{sys.executable} -m quizzinator.fake_ollama --think 10"
+  Dialog_ = lambda: Dialog(model='fake', timeout=10, backend='http', store=store, respondent=3)
+
+  first = Dialog_()
+  first._ollama = Ollama('fake', timeout=10, command=command)
+  first.query('one')
+  first.query('two')
+  first.close()
+
+  # the same respondent again: no model needed at all
+  second = Dialog_()
+  assert second.query('one')[1]['content'] == 'Answer: 1'
+  assert second.query('two')[1]['content'] == 'Answer: 1'
+  assert second._ollama is None
+  assert [h['raw'] for h in second.history] == [h['raw'] for h in first.history]
+
+  # but another respondent is asked afresh
+  other = Dialog(model='fake', timeout=10, backend='http', store=store, respondent=4)
+  other._ollama = Ollama('fake', timeout=10, command=command)
+  other.query('one')
+  other.close()
+  assert store.stats()['hits'] == 2
+  store.close()
+
+class Session:
+  """Just enough of a session to see what a dialog tells it"""
+  def __init__(self):
+    self.primed = []
+    self.asked = []
+
+  def prime(self, messages):
+    self.primed.extend(messages)
+
+  def chat(self, prompt, stop=None):
+    from quizzinator.stream import Reply
+    self.asked.append(prompt)
+    return Reply(raw='Answer: 2', think='', content='Answer: 2')
+
+  def kill(self):
+    pass
+
+def test_session_is_handed_stored_turns(tmp_path):
+  store = ResponseCache(tmp_path / 'r.sqlite')
+  first = Dialog(model='fake', timeout=10, backend='http', store=store, respondent=0)
+  first._ollama = Session()
+  first.query('one')
+
+  second = Dialog(model='fake', timeout=10, backend='http', store=store, respondent=0)
+  second.query('one')
+  second._ollama = session = Session()
+  assert second.query('two')[1]['content'] == 'Answer: 2'
+  # 'one' is restored, not asked again
+  assert session.primed == [{'role': 'user', 'content': 'one'}, {'role': 'assistant', 'content': 'Answer: 2'}]
+  assert session.asked == ['two']
+  assert second._unsent == []
+  store.close()
+
+def test_repl_does_not_use_the_store(tmp_path):
+  store = ResponseCache(tmp_path / 'r.sqlite')
+  command = f"{sys.executable} -m quizzinator.fake_ollama --think 10"
+  for _ in range(2):
+    dialog = Dialog(model='fake', timeout=10, store=store, respondent=0)
+    dialog._ollama = Ollama('fake', timeout=10, command=command)
+    assert dialog.query('one')[1]['content'] == 'Answer: 1'
+    dialog.close()
+  assert store.stats()['hits'] == 0 and store.stats()['misses'] == 0
+  store.close()
+
+def test_unseeded_runs_do_not_share_responses(tmp_path):
+  from argparse import Namespace
+  from quizzinator.cli import cli_set_args
+  from quizzinator.experiment import experiment_response_cache
+  args = Namespace(dir=tmp_path, seed=None, backend='http', no_response_cache=False, use_cache=False, response_cache_size=1, shared=False)
+  cli_set_args(args)
+  # each unseeded run is its own sample, so none of them look in the cache
+  assert experiment_response_cache() is None
+  assert experiment_response_cache() is None
+  assert not (tmp_path / 'cache').exists()
+
+  args.seed = 7
+  store = experiment_response_cache()
+  assert store is not None
+  store.close()
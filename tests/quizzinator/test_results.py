@@ -0,0 +1,57 @@
+import csv
+
+from quizzinator.questions import Question, Option
+from quizzinator.store import ExperimentStore
+from quizzinator.results import ResultsTable, results_load, results_csv
+
+QUESTIONS = [
+  Question(name='Safe', prompt_text='', options=[Option(code=1, text='a'), Option(code=2, text='b')], multi=False, mode='single'),
+  Question(name='Roles', prompt_text='', options=[Option(code=3, text='c'), Option(code=9, text='d')], multi=True, mode='multi'),
+  Question(name='Age', prompt_text='', options=[], multi=False, mode='number'),
+]
+
+def history(start):
+  return [
+    {'role': 'user', 'raw': 'q', 'content': 'q', 'think': '', 'start': start, 'elapsed': 0.0},
+    {'role': 'llm', 'raw': 'a', 'content': 'a', 'think': '', 'start': start, 'elapsed': 2.5},
+  ]
+
+def answers(safe, roles, age):
+  return {'Safe': safe, 'Roles': roles, 'Age': age}
+
+def test_typed_columns(tmp_path):
+  results = ResultsTable(tmp_path, QUESTIONS, batch=1)
+  results.append(0, answers('2', ['3', '9'], '1,200'), history(10.0))
+  results.append(1, answers(None, None, None), history(20.0))
+  results.close()
+
+  # readable while the run is still going
+  table = results_load(tmp_path)
+  assert str(table.schema.field('Safe').type) == 'int16'
+  assert str(table.schema.field('Roles').type) == 'list<element: int16>'
+  assert table.schema == results.schema
+  rows = table.to_pylist()
+  assert rows[0] == {'number': 0, 'start': 10.0, 'end': 12.5, 'llm_time': 2.5, 'Safe': 2, 'Roles': [3, 9], 'Age': 1200.0}
+  assert rows[1]['Safe'] is None and rows[1]['Roles'] is None
+
+def test_compact_and_csv(tmp_path):
+  store = ExperimentStore(tmp_path / 'experiment.sqlite')
+  qs = lambda safe: {'Safe': {'name': 'Safe', 'number': 0, 'answer': safe, 'ok': True}}
+  for i in range(3): store.save(i, history(float(i)), qs(str(i % 2 + 1)), {}, {})
+
+  # only respondent 1 made it into a part file; the rest come from the store
+  results = ResultsTable(tmp_path, QUESTIONS)
+  results.append(1, answers('1', ['9'], '7'), history(1.0))
+  table = results.compact(store)
+  assert table.column('number').to_pylist() == [0, 1, 2]
+  assert table.column('Roles').to_pylist() == [None, [9], None]
+  assert not list((tmp_path / 'results').glob('*.parquet'))
+  # the row from the part file was kept, not rebuilt from the store
+  assert table.column('Age').to_pylist() == [None, 7.0, None]
+
+  results_csv(table, tmp_path / 'data.csv')
+  with open(tmp_path / 'data.csv') as f:
+    rows = list(csv.DictReader(f))
+  assert list(rows[1].keys()) == ['number', 'Safe', 'Roles', 'Age']
+  assert rows[1] == {'number': '1', 'Safe': '1', 'Roles': "['9']", 'Age': '7'}
+  store.close()
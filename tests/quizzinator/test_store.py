@@ -0,0 +1,137 @@
+import base64
+import gzip
+import json
+
+from quizzinator.store import ExperimentStore, store_open, export_viewer
+
+def turn(role, raw, start, name='Q1', answer='1'):
+  return {
+    'role': role, 'raw': raw, 'content': raw, 'think': '', 'start': start, 'elapsed': 1.0,
+    'answer': {'name': name, 'number': 1, 'answer': answer, 'ok': True},
+  }
+
+def questions(answer):
+  return {'Q1': {'name': 'Q1', 'number': 1, 'answer': answer, 'ok': True}}
+
+def test_save_and_read_back(tmp_path):
+  store = ExperimentStore(tmp_path / 'experiment.sqlite')
+  history = [turn('user', 'pick', 10.0), turn('llm', 'Answer: 1', 11.0)]
+  store.save(2, history, questions('1'), {'k': 'v'}, {'index': 2})
+  store.save(0, history, questions(['1', '2']), {}, {'index': 0})
+  assert store.done() == {0, 2}
+  assert store.history(2) == history
+  assert store.cache(2) == {'k': 'v'}
+  assert store.meta(0) == {'index': 0}
+  assert list(store.answers()) == [(0, {'Q1': ['1', '2']}), (2, {'Q1': '1'})]
+  assert store.span() == (10.0, 12.0)
+  assert store.cache(1) is None
+  store.close()
+
+def test_save_replaces(tmp_path):
+  store = ExperimentStore(tmp_path / 'experiment.sqlite')
+  store.save(0, [turn('user', 'a', 1.0), turn('llm', 'b', 2.0)], questions('1'), {}, {})
+  store.save(0, [turn('user', 'c', 5.0)], questions('2'), {}, {})
+  assert [h['raw'] for h in store.history(0)] == ['c']
+  assert list(store.answers()) == [(0, {'Q1': '2'})]
+  store.close()
+
+def test_legacy_round_trip(tmp_path):
+  store = ExperimentStore(tmp_path / 'old.sqlite')
+  history = [turn('user', 'pick', 10.0)]
+  store.save(4, history, questions('3'), {'c': 1}, {'index': 4})
+  store.export_legacy(tmp_path / 'exp' / 'quizzes')
+  store.close()
+
+  path = tmp_path / 'exp' / 'quizzes' / '4'
+  assert (path / 'done').exists() and (path / 'index.html').exists()
+  assert json.loads((path / 'history.json').read_text()) == history
+
+  # an experiment from before the store is brought in the first time it is opened
+  store = store_open(tmp_path / 'exp')
+  assert store.done() == {4}
+  assert store.meta(4) == {'index': 4}
+  assert store.cache(4) == {'c': 1}
+  assert store.questions(4) == questions('3')
+  store.close()
+
+def test_log_until_saved(tmp_path):
+  store = ExperimentStore(tmp_path / 'experiment.sqlite')
+  store.log_append(1, [turn('user', 'a', 1.0), turn('llm', 'b', 2.0)])
+  store.log_append(1, [turn('user', 'c', 3.0)])
+  assert [h['raw'] for h in store.log(1)] == ['a', 'b', 'c']
+  assert store.done() == set()
+
+  # saving the respondent retires its log
+  store.save(1, store.log(1), questions('1'), {}, {})
+  assert store.log(1) == []
+  store.log_append(2, [turn('user', 'd', 1.0)])
+  store.log_clear(2)
+  assert store.log(2) == []
+  store.close()
+
+def test_shared_viewer(tmp_path):
+  store = ExperimentStore(tmp_path / 'experiment.sqlite')
+  for i in (0, 1, 5): store.save(i, [turn('llm', f'reply {i}', 1.0)], questions('1'), {}, {'index': i})
+  export_viewer(tmp_path / 'dialog', store, shard_size=2)
+  store.close()
+
+  # one copy of the page, and respondents 0 and 1 share a shard
+  assert (tmp_path / 'dialog' / 'index.html').exists()
+  assert sorted(p.name for p in (tmp_path / 'dialog' / 'shards').iterdir()) == ['0.js', '2.js']
+  text = (tmp_path / 'dialog' / 'shards' / '2.js').read_text()
+  assert text.startswith('document.quizzinator.shards[2] = ')
+  packed = json.loads(text.split(' = ', 1)[1].rstrip(';\n'))
+  transcript = json.loads(gzip.decompress(base64.b64decode(packed['5'])))
+  assert transcript['meta'] == {'index': 5}
+  assert transcript['dialog'][0]['raw'] == 'reply 5'
+
+def test_texts_are_in_cold_storage(tmp_path):
+  store = ExperimentStore(tmp_path / 'experiment.sqlite')
+  think = 'Let me think about this at length. ' * 100
+  llm = dict(turn('llm', f'<think>{think}</think>\nAnswer: 2', 2.0), content='Answer: 2', think=think)
+  history = [turn('user', 'pick', 1.0), llm]
+  store.save(0, history, questions('2'), {'pick': llm['raw']}, {})
+
+  # the hot rows know nothing of the reasoning, and it is stored once, compressed
+  hot = store.history(0, texts=False)
+  assert 'raw' not in hot[1] and 'think' not in hot[1] and hot[1]['content'] == 'Answer: 2'
+  assert (tmp_path / 'experiment.blob').stat().st_size < len(think) // 10
+
+  assert store.history(0) == history
+  assert store.text(0, 1)['think'] == think
+  assert store.cache(0) == {'pick': llm['raw']}
+  store.close()
+
+def test_leases(tmp_path):
+  store = ExperimentStore(tmp_path / 'experiment.sqlite')
+  assert store.lease(3, 'a', 60)
+  assert not store.lease(3, 'b', 60)
+
+  # only the lease holder gets to record the respondent, and then it is done
+  assert not store.save(3, [turn('llm', 'b', 1.0)], questions('1'), {}, {}, owner='b')
+  assert store.save(3, [turn('llm', 'a', 1.0)], questions('1'), {}, {}, owner='a')
+  assert store.leases() == {}
+  assert not store.lease(3, 'b', 60)
+
+  # a lease that ran out is taken over; the old holder can no longer save
+  assert store.lease(4, 'a', -1)
+  assert store.lease(4, 'b', 60)
+  assert not store.save(4, [turn('llm', 'a', 1.0)], questions('1'), {}, {}, owner='a')
+  assert store.renew('b', 60) == 1
+  store.release(4, 'b')
+  assert store.leases() == {}
+
+  # redoing only takes respondents saved before the run began
+  assert store.lease(3, 'b', 60, since=float('inf'))
+  assert not store.lease(3, 'c', 60, since=0.0)
+  store.close()
+
+def test_rescore_keeps_the_text(tmp_path):
+  store = ExperimentStore(tmp_path / 'experiment.sqlite')
+  history = [turn('user', 'pick', 1.0), turn('llm', 'Answer: 2', 2.0, answer='1')]
+  store.save(0, history, questions('1'), {}, {})
+  store.rescore(0, {1: dict(history[1]['answer'], answer='2')}, questions('2'))
+  assert store.history(0)[1]['answer']['answer'] == '2'
+  assert store.history(0)[1]['raw'] == 'Answer: 2'
+  assert list(store.answers()) == [(0, {'Q1': '2'})]
+  store.close()
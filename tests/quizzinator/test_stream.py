@@ -0,0 +1,100 @@
+import pytest
+
+from quizzinator.ollama import Ollama
+from quizzinator.dialog import Dialog
+from quizzinator.stream import StreamParser, StreamCleaner
+from quizzinator.string import clean_text
+from quizzinator.utils import RepeatDetector, RepetitionError
+
+TRANSCRIPTS = [
+  # the usual shape of a REPL reply, spinner noise and all
+  '⠋\x1b[K\x1b[D⠙\x1b[K\x1b[D\x1b[?25h<think>\r\nI think “three”—maybe.\r\n</think>\r\n\r\nAnswer: 3\r\n\r\n>>> \x1b[38;5;245mSend a message\x1b[0m',
+  # reasoning with no opening tag (the template already sent it)
+  'Hmm, let me see.\n</think>\n\nAnswer: 2\n\n>>> ',
+  # no reasoning at all
+  '  Answer: 7  \n\n>>> ',
+  # a <think> that never closes
+  '<think>\nround and round\n\n>>> ',
+  # two closing tags: only the text after the last one is the answer
+  '<think>\na\n</think>\nb\n</think>\n\nAnswer: 4\n>>> ',
+  # odd characters are made visible
+  '<think>é x</think>Answer: ø\n>>> ',
+  # an empty reasoning section
+  '<think>\n\n</think>\n\nGreetings!\n>>> ',
+]
+
+def old_pipeline(buffer: str) -> tuple[str, str, str]:
+  """What _pull, _clean and think_and_response made of a whole buffer"""
+  if '<think>' in buffer:
+    buffer = '<think>' + buffer.split('<think>')[1]
+  raw = Ollama._clean(buffer.split('>>> ')[0])
+  return (raw, *Dialog.think_and_response(raw))
+
+@pytest.mark.parametrize('transcript', TRANSCRIPTS)
+@pytest.mark.parametrize('size', [1, 2, 3, 5, 8, 64, 100000])
+def test_matches_old_pipeline(transcript, size):
+  parser = StreamParser()
+  for i in range(0, len(transcript), size):
+    if parser.feed(transcript[i:i + size]): break
+  assert parser.done
+  reply = parser.result()
+  assert (reply.raw, reply.think, reply.content) == old_pipeline(transcript)
+
+def test_stream_without_prompt_marker():
+  parser = StreamParser(prompt=None)
+  parser.feed('<think>\nwhy >>> not\n</think>\n\nAnswer: ')
+  parser.feed('5')
+  reply = parser.finish()
+  assert reply.think == 'why >>> not'
+  assert reply.content == 'Answer: 5'
+
+def test_callbacks():
+  tokens, sections = [], []
+  parser = StreamParser(on_token=lambda s, t: tokens.append((s, t)), on_section=sections.append)
+  for c in 'noise<think>abc</think>xyz>>> ':
+    parser.feed(c)
+  assert sections == ['think', 'answer', 'done']
+  assert ''.join(t for s, t in tokens if s == 'think') == 'abc'
+  assert ''.join(t for s, t in tokens if s == 'answer') == 'xyz'
+
+@pytest.mark.parametrize('size', [1, 2, 3, 4])
+def test_cleaner_matches_clean_text(size):
+  text = 'a\r\n\x1b[38;5;245mb\x1b[0m\r\n“c”⠋\x1b[?25h\r'
+  cleaner = StreamCleaner()
+  out = ''.join(cleaner.feed(text[i:i + size]) for i in range(0, len(text), size)) + cleaner.flush()
+  assert out == clean_text(text)
+
+def test_stop_truncates_after_a_whole_line():
+  seen = []
+  def stop(answer):
+    seen.append(answer)
+    return answer.strip().endswith('3')
+  parser = StreamParser(stop=stop)
+  for c in '<think>\nhmm\n</think>\n\nAnswer: 3\nand more\n</think>\nstuff\n>>> ':
+    parser.feed(c)
+  reply = parser.result()
+  assert parser.done and reply.truncated
+  assert reply.think == 'hmm'
+  assert reply.content == 'Answer: 3'
+  # never asked about a half-written line
+  assert all(not s.endswith('Answer: ') for s in seen)
+
+def test_answer_at_the_end_is_not_truncated():
+  parser = StreamParser(stop=lambda answer: answer.strip().endswith('3'))
+  for c in '<think>\nhmm\n</think>\n\nAnswer: 3\n\n>>> ':
+    parser.feed(c)
+  reply = parser.result()
+  # the model had nothing more to say, so nothing was cut off
+  assert parser.settled and not reply.truncated
+  assert reply.content == 'Answer: 3'
+
+def test_repetition_is_caught_while_streaming():
+  parser = StreamParser(repeats=RepeatDetector(window=30, repeats=5))
+  parser.feed('<think>\n')
+  with pytest.raises(RepetitionError) as e:
+    for _ in range(100):
+      parser.feed('Wait, maybe the answer is three. ')
+  assert e.value.count == 6
+  assert e.value.buffer.startswith('<think>\nWait, maybe')
+  # caught within a few laps of the loop, not at the end
+  assert len(e.value.buffer) < 10 * 33
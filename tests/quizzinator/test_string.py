@@ -0,0 +1,51 @@
+import json
+import string
+from argparse import Namespace
+from pathlib import Path
+
+import pytest
+
+from quizzinator.string import clean_text, pythonify_string
+from quizzinator.stream import StreamCleaner
+from quizzinator.fake_ollama import fake_ollama_reply
+
+def reference(text):
+  """clean_text as it was written before, one pass per rule: the spec"""
+  import re
+  text = re.sub(r'(\x9B|\x1B\[)[0-?]*[ -\/]*[@-~]', '', text)
+  for a, b in (('“', '"'), ('”', '"'), ('‘', "'"), ('’', "'"), ('—', '-'), ('–', '-')):
+    text = text.replace(a, b)
+  text = ''.join(c for c in text if not 0x2800 <= ord(c) <= 0x28ff)
+  text = text.replace('\r\n', '\n')
+  ok = string.ascii_letters + string.digits + string.punctuation
+  return ''.join(c if c in ok or c.isspace() else '\\0' + oct(ord(c))[2:] for c in text)
+
+def transcripts():
+  recorded = json.loads((Path(__file__).parent / 'test_dialog.json').read_text())
+  fake = fake_ollama_reply(Namespace(think=2000, answer='Answer: 3', loop=False, ramble=100))
+  return list(recorded.values()) + [fake.replace('\n', '\r\n')]
+
+def test_same_rules_on_transcripts():
+  for text in transcripts():
+    assert clean_text(text) == reference(text)
+
+@pytest.mark.parametrize('text', [
+  'a\r\x1b[0m\nb',
+  '\r⠋\x1b[K\n',
+  '\r\x1b⠋[0m\n',
+  '\x1b\x1b[0m[0m',
+  '\x9b2J\x9b',
+  '\r\r\n',
+  '“é” — 中 😀\x00\x07\x7f\xa0\x85　',
+])
+def test_same_rules_on_edge_cases(text):
+  assert clean_text(text) == reference(text)
+
+def test_chunk_by_chunk():
+  text = transcripts()[-1]
+  cleaner = StreamCleaner()
+  out = ''.join(cleaner.feed(text[i:i + 7]) for i in range(0, len(text), 7)) + cleaner.flush()
+  assert out == clean_text(text)
+
+def test_pythonify_string():
+  assert pythonify_string('a\tb\x00é') == 'a\tb\\00\\0351'
@@ -0,0 +1,39 @@
+import pytest
+from quizzinator.utils import RepeatDetector, repeat_limits, ngram_repeat
+
+def test_catches_a_loop():
+    d = RepeatDetector(window=30, repeats=5)
+    text = 'I need to choose the right answer here. ' * 20
+    assert d.feed(text)
+    assert d.tripped
+    assert d.count == 6
+    assert len(d.repeat) == 30 and d.repeat in text
+
+def test_chunks_do_not_matter():
+    text = 'Let me think about it some more. ' * 10
+    whole = RepeatDetector(window=30, repeats=4)
+    whole.feed(text)
+    pieces = RepeatDetector(window=30, repeats=4)
+    for c in text:
+        if pieces.feed(c): break
+    assert (whole.repeat, whole.count) == (pieces.repeat, pieces.count)
+
+def test_ordinary_text_is_fine():
+    d = RepeatDetector(window=30, repeats=3)
+    text = ''.join(f'Thought {i} is new. ' for i in range(2000))
+    assert not d.feed(text)
+
+def test_agrees_with_ngram_repeat():
+    text = 'abc ' * 3 + 'the same old story, again and again ' * 5 + 'the end'
+    repeat, count = ngram_repeat(text, L=30, K=2)
+    d = RepeatDetector(window=30, repeats=count - 1)
+    assert d.feed(text)
+    assert d.count == count
+
+def test_few_distinct_characters_are_not_loops():
+    assert not RepeatDetector(window=10, repeats=2).feed('-' * 1000 + '.' * 1000 + '=-' * 1000)
+
+def test_repeat_limits_by_model():
+    assert repeat_limits('deepseek-r1:1.5B') == (40, 8)
+    assert repeat_limits('deepseek-r1:70b') == repeat_limits('')
+    assert repeat_limits('llama3') == repeat_limits('')